@@ -1,10 +1,12 @@
 import json
 import pickle
+import struct
 from enum import IntEnum
 from typing import List, Type, Union, Dict
 import uuid
 import numpy as np
 from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
 import warnings
 
 __all__ = ['DType', 'DataFrame', 'DataField']
@@ -31,6 +33,7 @@ class DType(IntEnum):
     ARRAY = 7
     TUPLE = 8
     ND_ARR = 9
+    TAGGED = 10  # dict, list, tuple and numbers, see Tag
     CUSTOM_TYPE_START = 100  # all ids above this type are user generated, TBD dynamic
     CUSTOM_TYPE_END = 200  # all ids above this type are user generated, TBD dynamic
     UNKNOWN = 230
@@ -54,17 +57,181 @@ class DataFrameBaseType(BaseModel):
         validate_all = False
 
 
+ND_ARR_VERSION = 1  # pickled arrays of earlier releases start with the pickle protocol byte, 0x80
+FRAME_ALIGNMENT = 16  # queues place frames at multiples of it, array buffers are aligned from the frame start
+
+
+class NDArrayType(DataFrameBaseType):
+    """
+    numpy arrays without pickle: version u8, byte order u8, dtype code size u8, dtype code, ndim u8, padding u8,
+    shape u64 * ndim, strides i64 * ndim, padding zero bytes, then the array buffer. The padding puts the buffer
+    at a multiple of the dtype alignment (at least 8) from the frame start, given as the value offset in the frame.
+    Decoded arrays are views over the frame bytes
+    """
+
+    @staticmethod
+    def from_byte_array(arr: bytearray):
+        if arr[0] != ND_ARR_VERSION:
+            return DataFrameBaseType.from_byte_array(arr)
+        byte_order = chr(arr[1])
+        code_size = arr[2]
+        dtype_code = str(arr[3:3 + code_size], "ascii")
+        ndim = arr[3 + code_size]
+        padding = arr[4 + code_size]
+        offset = 5 + code_size
+        shape = struct.unpack_from(f"<{ndim}Q", arr, offset)
+        strides = struct.unpack_from(f"<{ndim}q", arr, offset + 8 * ndim)
+        offset += 16 * ndim + padding
+        return np.ndarray(shape, dtype=np.dtype(byte_order + dtype_code), buffer=arr, offset=offset, strides=strides)
+
+    @staticmethod
+    def encode(data: np.ndarray, offset: int = 0):
+        """
+        Header bytes and the array buffer as a bytes view, None for arrays without a raw layout
+        """
+        if data.dtype.hasobject or data.dtype.names is not None:
+            return None  # python objects and records are pickled
+        if not data.flags.c_contiguous and not data.flags.f_contiguous:
+            data = np.ascontiguousarray(data)
+        dtype_str = data.dtype.str
+        dtype_code = dtype_str[1:].encode("ascii")
+        ndim = data.ndim
+        padding = -(offset + 5 + len(dtype_code) + 16 * ndim) % max(data.dtype.alignment, 8)
+        header = struct.pack(f"<BBB{len(dtype_code)}sBB{ndim}Q{ndim}q{padding}x", ND_ARR_VERSION,
+                             ord(dtype_str[0]), len(dtype_code), dtype_code, ndim, padding, *data.shape, *data.strides)
+        return header, data.ravel(order="K").view(np.uint8).data  # memory order, no copy of F-contiguous arrays
+
+    @staticmethod
+    def to_byte_array(data: np.ndarray, offset: int = 0):
+        encoded = NDArrayType.encode(data, offset)
+        if encoded is None:
+            return DataFrameBaseType.to_byte_array(data)
+        header, buffer = encoded
+        arr = bytearray(header)
+        arr += buffer
+        return arr
+
+
+class ModelCodec:
+    """
+    Codec compiled from the fields of a DataFrameBaseType model. Fixed width fields share one struct layout:
+    bool, int (i64), float (f64), str and bytes with a max_length, np.ndarray with Field(shape=..., dtype=...).
+    Field(fmt=...) sets the struct format of a number, e.g. "f" or "H". Arrays are decoded as views over the bytes.
+    Other fields follow the layout in a tail section, each as type u8, size u32 and its encoded bytes
+    """
+
+    def __init__(self, model: Type[DataFrameBaseType]):
+        self.model = model
+        self.fields = []  # (name, kind, size) packed by the layout, strings and bytes as size prefix and slot
+        self.arrays = []  # (name, offset, shape, dtype)
+        self.tail = []  # names
+        fmt = "<"
+        for name, field in model.__fields__.items():
+            field_type = field.type_
+            extra = field.field_info.extra
+            max_length = field.field_info.max_length or getattr(field_type, "max_length", None)  # Field or constr
+            if field.shape != SHAPE_SINGLETON or field.allow_none or not isinstance(field_type, type):
+                self.tail.append(name)
+            elif issubclass(field_type, (bool, int, float)):
+                default_fmt = "?" if issubclass(field_type, bool) else "q" if issubclass(field_type, int) else "d"
+                field_fmt = extra.get("fmt", default_fmt)
+                struct.calcsize(field_fmt)  # bad formats fail at registration
+                fmt += field_fmt
+                self.fields.append((name, field_type, 1))
+            elif issubclass(field_type, (str, bytes)) and max_length is not None:
+                size = max_length  # utf-8 bytes for strings
+                fmt += f"{'H' if size < 2 ** 16 else 'I'}{size}s"
+                self.fields.append((name, str if issubclass(field_type, str) else bytes, size))
+            elif issubclass(field_type, np.ndarray) and "shape" in extra and "dtype" in extra:
+                shape = tuple(extra["shape"])
+                dtype = np.dtype(extra["dtype"]).newbyteorder("<")
+                self.arrays.append((name, struct.calcsize(fmt), shape, dtype))
+                fmt += f"{int(np.prod(shape)) * dtype.itemsize}x"
+            else:
+                self.tail.append(name)
+        self.layout = struct.Struct(fmt)
+
+    @staticmethod
+    def compile(model: Type[DataFrameBaseType]):
+        """
+        None for models with their own byte codec or no fields
+        """
+        if model.to_byte_array is not DataFrameBaseType.to_byte_array or \
+                model.from_byte_array is not DataFrameBaseType.from_byte_array or len(model.__fields__) == 0:
+            return None
+        return ModelCodec(model)
+
+    def to_byte_array(self, data) -> bytearray:
+        values = []
+        for name, kind, size in self.fields:
+            value = getattr(data, name)
+            if kind is str or kind is bytes:
+                value = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+                if len(value) > size:
+                    raise ValueError(f"{self.model.__name__}.{name}: {len(value)} bytes, max_length is {size}")
+                values.append(len(value))
+            values.append(value)
+        tail = []
+        for name in self.tail:
+            value = getattr(data, name)
+            d_type = get_data_type(value)
+            tail.append((d_type, data_to_byte_arr(value, d_type)))
+        arr = bytearray(self.layout.size + sum([5 + len(value_bytes) for _, value_bytes in tail]))
+        self.layout.pack_into(arr, 0, *values)
+        for name, offset, shape, dtype in self.arrays:
+            value = np.asarray(getattr(data, name), dtype=dtype)
+            if value.shape != shape:
+                raise ValueError(f"{self.model.__name__}.{name}: shape {value.shape}, expected {shape}")
+            arr[offset:offset + value.nbytes] = value.tobytes()
+        offset = self.layout.size
+        for d_type, value_bytes in tail:
+            arr[offset] = d_type
+            arr[offset + 1:offset + 5] = len(value_bytes).to_bytes(4, "little")
+            arr[offset + 5:offset + 5 + len(value_bytes)] = value_bytes
+            offset += 5 + len(value_bytes)
+        return arr
+
+    def from_byte_array(self, arr: bytearray):
+        if len(arr) < self.layout.size:
+            raise ValueError(f"{self.model.__name__}: {len(arr)} bytes, the layout is {self.layout.size} bytes")
+        packed = iter(self.layout.unpack_from(arr))
+        values = {}
+        for name, kind, size in self.fields:
+            value = next(packed)
+            if kind is str or kind is bytes:
+                value = next(packed)[:value]
+                if kind is str:
+                    value = str(value, "utf-8")
+            values[name] = value
+        for name, offset, shape, dtype in self.arrays:
+            values[name] = np.ndarray(shape, dtype=dtype, buffer=arr, offset=offset)
+        offset = self.layout.size
+        for name in self.tail:
+            value_size = int.from_bytes(arr[offset + 1:offset + 5], "little")
+            values[name] = data_from_byte_arr(arr[offset + 5:offset + 5 + value_size], DType(arr[offset]))
+            offset += 5 + value_size
+        model = self.model.__new__(self.model)  # construct() without its defaults pass, every field is set
+        object.__setattr__(model, "__dict__", values)
+        object.__setattr__(model, "__fields_set__", set(values))
+        return model
+
+
 class TypeHandler:
     def __init__(self, type_id: int, model_definition: Type[DataFrameBaseType]):
         if type_id > MAX_TYPE_ID:
             raise IndexError(f"Custom type id must be between {DType.CUSTOM_TYPE_START} to {DType.CUSTOM_TYPE_END}")
         self.model = model_definition.construct(_fields_set=None, **{})
+        self.codec = ModelCodec.compile(model_definition)  # pickle codec of DataFrameBaseType otherwise
         self.type_id = type_id
 
     def from_byte_array(self, arr: bytearray):
+        if self.codec is not None:
+            return self.codec.from_byte_array(arr)
         return self.model.from_byte_array(arr)
 
     def to_byte_array(self, data):
+        if self.codec is not None:
+            return self.codec.to_byte_array(data)
         return self.model.to_byte_array(data)
 
     @property
@@ -77,14 +244,12 @@ def get_data_type(data):
         return DType.U32
     if isinstance(data, str):
         return DType.STR
-    if isinstance(data, list):
-        return DType.ARRAY
-    if isinstance(data, tuple):
-        return DType.TUPLE
+    if data is None or isinstance(data, (dict, list, tuple, float, bytes, bytearray)):
+        return DType.TAGGED
     if isinstance(data, np.ndarray):
         return DType.ND_ARR
-    if is_jsonable(data):  # always keep last, slower than others
-        return DType.JSON
+    if isinstance(data, DataFrameBaseType):
+        return model_types.get(type(data), DType.UNKNOWN)
     return DType.UNKNOWN
 
 
@@ -100,8 +265,179 @@ def int_size(d_type: DType):
     raise ValueError("Data type has no fixed size")
 
 
+class Tag:
+    """
+    DType.TAGGED value tags, every value is its tag byte and then its bytes, little endian.
+    Lists of ints only or floats only, nested lists of them with equal lengths too, are packed as one array.
+    Plain ints and not an IntEnum, enum compares are slow in the decode loop
+    """
+    NONE = 0
+    FALSE = 1
+    TRUE = 2
+    INT = 3  # i64
+    BIG_INT = 4  # u32 size, signed int bytes
+    FLOAT = 5  # f64
+    STR = 6  # u32 size, utf-8
+    BYTES = 7  # u32 size, bytes
+    LIST = 8  # u32 items, items
+    TUPLE = 9  # u32 items, items
+    DICT = 10  # u32 items, key and value per item
+    INT_LIST = 11  # u8 int size, u8 ndim, u32 shape * ndim, ints
+    FLOAT_LIST = 12  # u8 ndim, u32 shape * ndim, f64 items
+    TYPED = 13  # u8 data type, u32 size, value encoded by its data type
+
+
+I64 = struct.Struct("<q")
+F64 = struct.Struct("<d")
+U32 = struct.Struct("<I")
+NUMBER_LIST_MIN = 8  # shorter lists are tagged item by item
+INT_LIST_SIZES = [(np.iinfo(dtype).min, np.iinfo(dtype).max, np.dtype(dtype).itemsize)
+                  for dtype in [np.int8, np.int16, np.int32, np.int64]]
+
+
+def _tag_number_list(value: list, arr: bytearray) -> bool:
+    rows = [value]
+    item_types = {list}
+    while item_types == {list}:  # down the nested lists, a level at a time
+        item_types = set()
+        for row in rows:
+            item_types.update(map(type, row))
+        if item_types == {list}:
+            rows = [item for row in rows for item in row]
+    if item_types != {int} and item_types != {float}:
+        return False
+    try:
+        numbers = np.array(value, dtype=np.int64 if item_types == {int} else "<f8")
+    except (ValueError, OverflowError):
+        return False  # lengths differ, or ints past 64 bit
+    if numbers.ndim > 255:
+        return False
+    if item_types == {int}:
+        low, high = numbers.min(), numbers.max()
+        size = next(size for min_int, max_int, size in INT_LIST_SIZES if min_int <= low and high <= max_int)
+        numbers = numbers.astype(f"<i{size}")
+        arr.append(Tag.INT_LIST)
+        arr.append(size)
+    else:
+        arr.append(Tag.FLOAT_LIST)
+    arr.append(numbers.ndim)
+    arr += struct.pack(f"<{numbers.ndim}I", *numbers.shape)
+    arr += numbers.tobytes()
+    return True
+
+
+def _tag_value(value, arr: bytearray):
+    if value is None:
+        arr.append(Tag.NONE)
+    elif isinstance(value, str):
+        value_bytes = value.encode("utf-8")
+        arr.append(Tag.STR)
+        arr += U32.pack(len(value_bytes))
+        arr += value_bytes
+    elif isinstance(value, (bool, np.bool_)):
+        arr.append(Tag.TRUE if value else Tag.FALSE)
+    elif isinstance(value, (int, np.integer)):
+        if -2 ** 63 <= value < 2 ** 63:
+            arr.append(Tag.INT)
+            arr += I64.pack(value)
+        else:
+            value_bytes = int(value).to_bytes(int(value).bit_length() // 8 + 1, "little", signed=True)
+            arr.append(Tag.BIG_INT)
+            arr += U32.pack(len(value_bytes))
+            arr += value_bytes
+    elif isinstance(value, (float, np.floating)):
+        arr.append(Tag.FLOAT)
+        arr += F64.pack(value)
+    elif isinstance(value, dict):
+        arr.append(Tag.DICT)
+        arr += U32.pack(len(value))
+        for key, item in value.items():
+            _tag_value(key, arr)
+            _tag_value(item, arr)
+    elif isinstance(value, (list, tuple)):
+        if isinstance(value, list) and len(value) >= NUMBER_LIST_MIN and _tag_number_list(value, arr):
+            return
+        arr.append(Tag.LIST if isinstance(value, list) else Tag.TUPLE)
+        arr += U32.pack(len(value))
+        for item in value:
+            _tag_value(item, arr)
+    elif isinstance(value, (bytes, bytearray)):
+        arr.append(Tag.BYTES)
+        arr += U32.pack(len(value))
+        arr += value
+    else:
+        d_type = get_data_type(value)
+        value_bytes = data_to_byte_arr(value, d_type)
+        arr.append(Tag.TYPED)
+        arr.append(d_type)
+        arr += U32.pack(len(value_bytes))
+        arr += value_bytes
+
+
+def _untag_value(arr: memoryview, offset: int):
+    """
+    returns the value tagged at offset and the offset after it
+    """
+    tag = arr[offset]
+    offset += 1
+    if tag == Tag.STR:
+        size = U32.unpack_from(arr, offset)[0]
+        offset += 4
+        return str(arr[offset:offset + size], "utf-8"), offset + size
+    if tag == Tag.INT:
+        return I64.unpack_from(arr, offset)[0], offset + 8
+    if tag == Tag.FLOAT:
+        return F64.unpack_from(arr, offset)[0], offset + 8
+    if tag == Tag.DICT:
+        items = U32.unpack_from(arr, offset)[0]
+        offset += 4
+        value = {}
+        for _ in range(items):
+            key, offset = _untag_value(arr, offset)
+            value[key], offset = _untag_value(arr, offset)
+        return value, offset
+    if tag == Tag.LIST or tag == Tag.TUPLE:
+        items = U32.unpack_from(arr, offset)[0]
+        offset += 4
+        value = []
+        for _ in range(items):
+            item, offset = _untag_value(arr, offset)
+            value.append(item)
+        return (value if tag == Tag.LIST else tuple(value)), offset
+    if tag == Tag.NONE:
+        return None, offset
+    if tag == Tag.TRUE or tag == Tag.FALSE:
+        return tag == Tag.TRUE, offset
+    if tag == Tag.INT_LIST or tag == Tag.FLOAT_LIST:
+        dtype = "<f8"
+        if tag == Tag.INT_LIST:
+            dtype = f"<i{arr[offset]}"
+            offset += 1
+        ndim = arr[offset]
+        shape = struct.unpack_from(f"<{ndim}I", arr, offset + 1)
+        offset += 1 + 4 * ndim
+        numbers = np.ndarray(shape, dtype=dtype, buffer=arr, offset=offset)
+        return numbers.tolist(), offset + numbers.nbytes
+    if tag == Tag.BYTES or tag == Tag.BIG_INT:
+        size = U32.unpack_from(arr, offset)[0]
+        offset += 4
+        value_bytes = bytes(arr[offset:offset + size])
+        if tag == Tag.BIG_INT:
+            return int.from_bytes(value_bytes, "little", signed=True), offset + size
+        return value_bytes, offset + size
+    if tag == Tag.TYPED:
+        d_type = DType(arr[offset])
+        size = U32.unpack_from(arr, offset + 1)[0]
+        offset += 5
+        return data_from_byte_arr(arr[offset:offset + size], d_type), offset + size
+    raise ValueError(f"Unknown value tag {tag} at {offset - 1}")
+
+
 def data_to_byte_arr(data, d_type: DType = None):
-    if d_type == DType.JSON:
+    if d_type == DType.TAGGED:
+        data_arr = bytearray()
+        _tag_value(data, data_arr)
+    elif d_type == DType.JSON:
         data_arr = bytearray(bytes(json.dumps(data), encoding='utf-8'))
     elif d_type == DType.STR:
         data_arr = bytearray(data.encode('utf-8'))
@@ -124,7 +460,9 @@ def data_to_byte_arr(data, d_type: DType = None):
 
 def data_from_byte_arr(arr: bytearray, d_type: DType = None):
     data = None
-    if d_type == DType.U8:
+    if d_type == DType.TAGGED:  # first, the default of most values
+        data, _ = _untag_value(memoryview(arr), 0)
+    elif d_type == DType.U8:
         data = int.from_bytes(arr, "little")
     elif d_type == DType.U16:
         data = int.from_bytes(arr, "little")
@@ -133,11 +471,11 @@ def data_from_byte_arr(arr: bytearray, d_type: DType = None):
     elif d_type == DType.U64:
         data = int.from_bytes(arr, "little")
     elif d_type == DType.JSON:
-        data = json.loads(arr.decode("utf-8"))
+        data = json.loads(str(arr, "utf-8"))
     elif d_type == DType.TUPLE:
-        data = tuple(json.loads(arr.decode("utf-8")))
+        data = tuple(json.loads(str(arr, "utf-8")))
     elif d_type == DType.STR:
-        data = arr.decode("utf-8")
+        data = str(arr, "utf-8")
     elif d_type == DType.ARRAY:
         data = []
         arr_size = len(arr)
@@ -160,6 +498,7 @@ def data_from_byte_arr(arr: bytearray, d_type: DType = None):
 NEXT_CUSTOM_TYPE_ID = DType.CUSTOM_TYPE_START
 MAX_TYPE_ID = 255  # 1 byte
 type_handlers: List[Union[TypeHandler, None]] = [None for _ in range(MAX_TYPE_ID)]
+model_types: Dict[Type[DataFrameBaseType], int] = {}  # type id of registered model instances
 
 
 def _allocate_new_type():
@@ -178,10 +517,13 @@ def register_data_type(d_model: Type[DataFrameBaseType], d_type=None):
         d_type = _allocate_new_type()
     handler = TypeHandler(d_type, d_model)
     type_handlers[d_type] = handler
+    if d_model is not DataFrameBaseType:
+        model_types.setdefault(d_model, d_type)
+    return d_type
 
 
 def _register_builtin_types():
-    register_data_type(DataFrameBaseType, DType.ND_ARR)
+    register_data_type(NDArrayType, DType.ND_ARR)
     register_data_type(DataFrameBaseType, DType.UNKNOWN)
 
 
@@ -193,25 +535,74 @@ if not _built_in_register_done:
 
 
 class DataField:
+    """
+    Fields decoded from frame bytes keep their encoded bytes, the value is decoded on first access.
+    Encoding reuses the bytes while they still hold the value
+    """
 
     def __init__(self, key: str, value, d_type: DType = None):
         if d_type is None:
             d_type = get_data_type(value)
         self.key = key
-        self.value = value
         self.d_type = d_type
+        self._value = value
+        self._decoded = True
+        self._raw = None  # encoded field bytes
+        self._value_start = 0
+        self._offset = 0  # frame position of the encoded bytes, array buffers are aligned from the frame start
+        self._changes = 0  # value assignments, frames check it before reusing their encoding
+
+    @property
+    def value(self):
+        if not self._decoded:
+            self._value = data_from_byte_arr(self._raw[self._value_start:], self.d_type)
+            self._decoded = True
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._decoded = True
+        self._raw = None
+        self._changes += 1
+
+    def _raw_valid(self) -> bool:
+        if self._raw is None:
+            return False
+        if not self._decoded:
+            return True
+        if isinstance(self._value, (int, float, str, bytes)):
+            return True
+        if isinstance(self._value, np.ndarray):  # arrays decoded as views write through to the bytes
+            return np.may_share_memory(self._value, np.frombuffer(self._raw, dtype=np.uint8))
+        return False  # containers may have been changed in place
+
+    def _cacheable(self) -> bool:
+        # the field encoding holds until its value is set: immutable values, or bytes the value still decodes from
+        return self._value is None or isinstance(self._value, (int, float, str, bytes)) or self._raw_valid()
+
+    def _encode(self, offset: int = 0):
+        """
+        Field header (type, key size, key, value size) and value parts for the field at offset in the frame.
+        Array buffers are views of the array, other values are encoded once
+        """
+        if self._raw_valid() and (self.d_type != DType.ND_ARR or (offset - self._offset) % FRAME_ALIGNMENT == 0):
+            return self._raw[:self._value_start], self._raw[self._value_start:]
+        key_bytes = self.key.encode('utf-8')
+        value_parts = None
+        if self.d_type == DType.ND_ARR:
+            value_parts = NDArrayType.encode(self.value, offset + 6 + len(key_bytes))
+        if value_parts is None:
+            value_parts = (data_to_byte_arr(self.value, self.d_type),)
+        value_size = sum([len(part) for part in value_parts])
+        header = bytes([self.d_type, len(key_bytes)]) + key_bytes + value_size.to_bytes(4, "little")
+        return (header, *value_parts)
 
     @property
     def byte_arr(self):
-        arr = bytearray(2)
-        arr[0] = self.d_type
-        key_bytes = bytearray(self.key.encode('utf-8'))
-        arr[1] = len(key_bytes)
-        arr.extend(key_bytes)
-        value_bytes = data_to_byte_arr(self.value, self.d_type)
-        value_size = len(value_bytes)
-        arr.extend(value_size.to_bytes(4, "little"))
-        arr.extend(value_bytes)
+        arr = bytearray()
+        for part in self._encode():
+            arr += part
         return arr
 
     @staticmethod
@@ -219,18 +610,19 @@ class DataField:
         d_type = DType(arr[0])
         key_size = arr[1]
         key_start = 2
-        key_bytes = arr[key_start:key_start + key_size]
-        key = key_bytes.decode("utf-8")
+        key = str(arr[key_start:key_start + key_size], "utf-8")
         key_end = key_start + key_size
         value_size = int.from_bytes(arr[key_end:key_end + 4], "little")
         value_start = key_end + 4
-        value_bytes = arr[value_start:value_start + value_size]
-        field = DataField(key, data_from_byte_arr(value_bytes, d_type), d_type)
+        field = DataField(key, None, d_type)
+        field._raw = arr[:value_start + value_size]
+        field._value_start = value_start
+        field._decoded = False
         return field
 
     @property
     def size(self):
-        return len(self.byte_arr)
+        return sum([len(part) for part in self._encode()])
 
 
 class DataFrame:
@@ -238,12 +630,23 @@ class DataFrame:
     d  - default data field
     pip - frame pipline id
     last - marks no more frames are expected
+    priority - queue lane, carried in the queue frame header and not in the frame fields
+    Encoding is cached on the frame while its values can not change in place, until a field is added, removed
+    or has its value set. Frames with containers, arrays or models are encoded again for every write, the
+    encoding nbytes makes is written by the next write_into or to_byte_arr. Array buffers are copied by the write
     """
     reserved_keys = ['d', 'pid', 'last']
     MAX_FIELD_LIMIT = 255
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, priority: int = None):
         self.fields: Dict[str, DataField] = dict()
+        self.priority = priority
+        self._raw = None  # bytes the frame was decoded from, emitted again while its fields are unchanged
+        self._raw_fields = ()
+        self._parts = None  # encoding, chunks written back to back
+        self._parts_state = None  # fields and their value assignments the encoding was made from
+        self._parts_pending = False  # made by nbytes and not written yet, reused even if values may change
+        self._nbytes = 0
         if data is not None:
             self.fields['d'] = DataField('d', data)  # "d" is special key, the default key
 
@@ -264,6 +667,10 @@ class DataFrame:
 
     @staticmethod
     def from_byte_arr(arr: bytearray):
+        """
+        Indexes the frame fields, values are decoded when accessed
+        """
+        arr = memoryview(arr)  # field values are sliced without copies, arrays decode as views over arr
         frame = DataFrame()
         fields_num = arr[0]
         next_field_index = 1
@@ -273,10 +680,18 @@ class DataFrame:
             field_size = int.from_bytes(field_size_bytes, "little")
             field_bytes = arr[field_start:field_start + field_size]
             f = DataField.from_byte_arr(field_bytes)
+            f._offset = field_start
             frame._add_field(f, True)
             next_field_index = next_field_index + 4 + field_size
+        frame._raw = arr
+        frame._raw_fields = tuple(frame.fields.values())
         return frame
 
+    def _raw_valid(self) -> bool:
+        if self._raw is None or len(self.fields) != len(self._raw_fields):
+            return False
+        return all([f is raw_field and f._raw_valid() for f, raw_field in zip(self.fields.values(), self._raw_fields)])
+
     @property
     def data(self):
         if self.fields_number == 0:
@@ -310,19 +725,65 @@ class DataFrame:
 
     @staticmethod
     def encode_field_to_byte_arr(f: DataField):
-        arr = bytearray(0)
         field_bytes = f.byte_arr
-        field_size = len(field_bytes)
-        arr.extend(field_size.to_bytes(4, "little"))
-        arr.extend(field_bytes)
-        return arr
+        return bytearray(len(field_bytes).to_bytes(4, "little")) + field_bytes
+
+    def _encode(self):
+        # first pass: every value is encoded once and the frame size summed, the bytes are written by the caller
+        state = [(f, f._changes) for f in self.fields.values()]
+        if self._parts is not None and state == self._parts_state and (self._parts_pending or self.encoding_kept):
+            return
+        if self._raw_valid():
+            parts = [self._raw]  # forwarded frame
+        else:
+            parts = [bytes([self.fields_number])]
+            offset = 1
+            for f in self.fields.values():
+                field_parts = f._encode(offset + 4)
+                field_size = sum([len(part) for part in field_parts])
+                parts.append(field_size.to_bytes(4, "little"))
+                parts.extend(field_parts)
+                offset += 4 + field_size
+        self._parts = parts
+        self._parts_state = state
+        self._parts_pending = True
+        self._nbytes = sum([len(part) for part in parts])
+
+    @property
+    def encoding_kept(self) -> bool:
+        """
+        The frame values can not change in place, it is encoded once and nbytes, write_into and to_byte_arr reuse it
+        """
+        return all([f._cacheable() for f in self.fields.values()])
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Encoded frame size
+        """
+        self._encode()
+        return self._nbytes
+
+    def write_into(self, buf, offset: int = 0) -> int:
+        """
+        Write the encoded frame into buf at offset, returns the number of bytes written
+        """
+        self._encode()
+        if offset + self._nbytes > len(buf):
+            raise IndexError(f"{self._nbytes} bytes frame does not fit {len(buf) - offset} bytes at offset {offset}")
+        self._write_parts(buf, offset)
+        return self._nbytes
+
+    def _write_parts(self, buf, offset: int):
+        for part in self._parts:
+            buf[offset:offset + len(part)] = part
+            offset += len(part)
+        self._parts_pending = False
 
     def to_byte_arr(self):
-        arr = bytearray(1)
-        arr[0] = self.fields_number
-        for key in self.fields:
-            f = self.fields[key]
-            arr.extend(self.encode_field_to_byte_arr(f))
+        self._encode()
+        arr = bytearray(self._nbytes)
+        self._write_parts(arr, 0)
         return arr
 
     @property
@@ -332,4 +793,6 @@ class DataFrame:
     def set_pipe_exe_id(self, _id=None):
         if _id is None:
             _id = uuid.uuid4().__str__()
+        elif _id == self.pipe_execution_id:
+            return  # forwarded frames keep their encoding
         self.fields['pid'] = DataField('pid', _id)
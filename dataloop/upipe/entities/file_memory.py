@@ -0,0 +1,43 @@
+import mmap
+import os
+
+
+class FileMemory:
+    """
+    File backed memory mapping, with the SharedMemory interface MemQueue uses (name, size, buf, close, unlink)
+    """
+
+    def __init__(self, path: str, create: bool = False, size: int = 0):
+        flags = os.O_RDWR
+        if create:
+            flags |= os.O_CREAT | os.O_EXCL  # FileExistsError if there, same as SharedMemory
+        fd = os.open(path, flags)
+        try:
+            if create:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.name = path
+        self.size = size
+        self.buf = memoryview(self._mmap)
+
+    def flush(self, offset: int = 0, size: int = None):
+        """
+        msync, offset must be a multiple of mmap.PAGESIZE
+        """
+        if size is None:
+            size = self.size - offset
+        self._mmap.flush(offset, size)
+
+    def close(self):
+        if self.buf is None:
+            return
+        self.buf.release()
+        self.buf = None
+        self._mmap.close()
+
+    def unlink(self):
+        os.unlink(self.name)
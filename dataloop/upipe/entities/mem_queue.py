@@ -1,24 +1,35 @@
 import binascii
+import ctypes
+import mmap
 import os
-import struct
 
 import numpy as np
 import time
+from collections import defaultdict, deque
 from enum import IntEnum
 from multiprocessing import shared_memory
 
-from pydantic.class_validators import Optional
-from pydantic.main import BaseModel
-from typing import List, Union
+from typing import Deque, Dict, List, Tuple, Union
 
-from ..types import APIQueue
-from .dataframe import DataFrame
+from ..types import APIQueue, QueueMode, OverflowPolicy, IntegrityPolicy, PageBacking
+from .dataframe import DataFrame, FRAME_ALIGNMENT
+from .queue_spill import QueueSpill
+from .file_memory import FileMemory
+from .page_memory import open_memory, place_memory, memory_path
+from .queue_v1 import QueueV1Reader
 
 import asyncio
+import tempfile
 
-from ..types.performance import QueuePerformanceStats, PerformanceMetric, ThroughputPerformanceMetric
+from ..types.performance import QueuePerformanceStats, PerformanceMetric, ThroughputPerformanceMetric, MetricType
+
+try:
+    from crc32c import crc32c  # hardware accelerated (SSE4.2, ARMv8) when installed
+except ImportError:
+    crc32c = None
 
 debug = False
+LOCK_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
 
 
 def debug_print(*args):
@@ -27,41 +38,83 @@ def debug_print(*args):
         print(*args)
 
 
-class QLogEntry(BaseModel):
-    time: Optional[int]
-    frame_counter: int
-    alloc_index: int
-    exe_index: int
-    alloc_counter: int
-    exe_counter: int
-    pending_counter: int
-    free_space: int
-    capacity: float
-    data_size: int
+Q_LOG_DTYPE = np.dtype([("time", "<f8"),  # ms
+                        ("frame_counter", "<u8"),
+                        ("alloc_index", "<u8"),
+                        ("exe_index", "<u8"),
+                        ("alloc_counter", "<u8"),
+                        ("exe_counter", "<u8"),
+                        ("pending_counter", "<u8"),
+                        ("free_space", "<u8"),
+                        ("data_size", "<u8")])
 
 
 class QActionLog:
-    def __init__(self, entry_limit=60):
-        self._enqueue_log: List[QLogEntry] = []
-        self._dequque_log: List[QLogEntry] = []
+    """
+    Fixed size ring of queue operation samples, one ring for enqueue and one for dequeue.
+    Every sample_every-th operation is recorded, shm_name keeps the rings in shared memory
+    so other processes can read them
+    """
+    ENQUEUE = 0
+    DEQUEUE = 1
+    HEADER_SIZE = 16  # recorded entries count per ring, 8 bytes each
+
+    def __init__(self, entry_limit=60, sample_every=1, shm_name=None):
         self.entry_limit = entry_limit
-
-    def add_to_log(self, entry: QLogEntry, log: list):
-        while len(log) > self.entry_limit:
-            log.remove(log[0])
-        log.append(entry)
-
-    def log_enqueue(self, entry: QLogEntry):
-        self.add_to_log(entry, self._enqueue_log)
-
-    def log_dequeue(self, entry: QLogEntry):
-        self.add_to_log(entry, self._dequque_log)
+        self.sample_every = max(sample_every, 1)
+        self._op_counters = [0, 0]
+        self._recorded = None  # set before mem, released first so the memory can close
+        self._entries = None
+        self.mem = None
+        size = self.HEADER_SIZE + 2 * entry_limit * Q_LOG_DTYPE.itemsize
+        if shm_name:
+            try:
+                self.mem = shared_memory.SharedMemory(name=shm_name, create=True, size=size)
+                self.mem.buf[:self.HEADER_SIZE] = bytes(self.HEADER_SIZE)  # entries past the counts are never read
+            except FileExistsError:
+                self.mem = shared_memory.SharedMemory(name=shm_name, size=size)
+            buf = self.mem.buf
+        else:
+            buf = bytearray(size)
+        self._recorded = np.ndarray((2,), dtype=np.uint64, buffer=buf)
+        self._entries = np.ndarray((2, entry_limit), dtype=Q_LOG_DTYPE, buffer=buf, offset=self.HEADER_SIZE)
+
+    def sample(self, op) -> bool:
+        counter = self._op_counters[op]
+        self._op_counters[op] = counter + 1
+        return counter % self.sample_every == 0
+
+    def record(self, op, entry: tuple):
+        recorded = int(self._recorded[op])
+        self._entries[op, recorded % self.entry_limit] = entry
+        self._recorded[op] = recorded + 1
+
+    def entries(self, op) -> np.ndarray:
+        """
+        Copy of the recorded samples, oldest first
+        """
+        recorded = int(self._recorded[op])
+        if recorded <= self.entry_limit:
+            return self._entries[op, :recorded].copy()
+        start = recorded % self.entry_limit
+        return np.concatenate((self._entries[op, start:], self._entries[op, :start]))
 
     @property
     def pending_stats(self):
-        if len(self._dequque_log) == 0:
+        recorded = min(int(self._recorded[self.DEQUEUE]), self.entry_limit)
+        if recorded == 0:
             return 0
-        return int(np.mean([d.pending_counter for d in self._dequque_log]))
+        return int(self._entries[self.DEQUEUE, :recorded]["pending_counter"].mean())
+
+    def close(self):
+        self._recorded = None
+        self._entries = None
+        if self.mem:
+            self.mem.close()
+
+    def unlink(self):
+        if self.mem:
+            self.mem.unlink()
 
 
 def current_milli_time():
@@ -83,6 +136,151 @@ class FRAME_STATUS(IntEnum):
     CREATED = 1
     EXECUTING = 2
     RETIRED = 3
+    DROPPED = 4  # QueueMode.CONFLATE, overwritten by a newer frame before it was read
+
+
+class FRAME_TYPE(IntEnum):
+    WHOLE = 13  # the frame holds the whole data frame
+    CHUNK_FIRST = 14  # first chunk of a data frame larger than half the ring
+    CHUNK = 15  # continuation chunk, frame number follows the previous chunk
+    PAD = 16  # fills the ring end the next frame did not fit before, readers go on at the data start
+
+
+class CHECKSUM(IntEnum):
+    CRC32 = 0
+    CRC32C = 1
+
+
+class QControlBlock(ctypes.LittleEndianStructure):
+    """
+    Queue control block, mapped over the first Q_CONTROL_SIZE bytes of the queue memory
+    """
+    _pack_ = 1
+    _fields_ = [("version", ctypes.c_uint8),  # CONTROL_VERSION, version 1 had the 0/1 data_waiters flag here
+                ("data_waiters", ctypes.c_uint8),  # a consumer is parked on the data event
+                ("space_waiters", ctypes.c_uint8),  # a producer is parked on the space event
+                ("status", ctypes.c_uint8),
+                ("direction", ctypes.c_uint8),
+                ("checksum", ctypes.c_uint8),  # CHECKSUM of the frames, set by the queue creator
+                ("generation", ctypes.c_uint16),  # segment generation, the next one once resized
+                ("spilled_frames", ctypes.c_uint32),  # frames waiting on disk, OverflowPolicy.SPILL
+                ("dfps_interval_ms", ctypes.c_uint32),
+                # 64 bit fields are 8 bytes aligned, single stores
+                ("ring_size", ctypes.c_uint64),  # the queue size, attached queues take it from here
+                ("alloc_index", ctypes.c_uint64),
+                ("exe_index", ctypes.c_uint64),
+                ("claim_index", ctypes.c_uint64),  # MPMC next frame to claim
+                ("alloc_counter", ctypes.c_uint64),
+                ("exe_counter", ctypes.c_uint64),
+                ("claim_counter", ctypes.c_uint64),  # MPMC claimed frames
+                ("spilled_bytes", ctypes.c_uint64),
+                ("last_dfps_calc_time", ctypes.c_uint64),
+                ("dfps_last_alloc_counter", ctypes.c_uint64),
+                ("dfps_last_exe_counter", ctypes.c_uint64),
+                ("crc_errors", ctypes.c_uint32),  # frames dropped on a checksum mismatch
+                ("header_errors", ctypes.c_uint32),  # frames with a broken watermark or version
+                ("dropped_frames", ctypes.c_uint64),  # QueueMode.CONFLATE, unread frames dropped for newer ones
+                ("reserved_2", ctypes.c_uint8 * 8)]
+
+
+class QCursor(ctypes.LittleEndianStructure):
+    """
+    Broadcast queue reader cursor, the cursors table follows the ring
+    """
+    _pack_ = 1
+    _fields_ = [("index", ctypes.c_uint64),  # next frame to read
+                ("counter", ctypes.c_uint64)]  # frames read, published after the index
+
+
+class QCheckpoint(ctypes.LittleEndianStructure):
+    """
+    Durable queue checkpoint slot, the control block as of the last committed consumed position
+    """
+    _pack_ = 1
+    _fields_ = [("sequence", ctypes.c_uint64),
+                ("control", QControlBlock),
+                ("crc32", ctypes.c_uint32)]
+
+    @property
+    def valid(self):
+        return self.sequence > 0 and binascii.crc32(bytes(self)[:-4]) == self.crc32
+
+
+class QueueEvent:
+    """
+    Cross process wakeup over a named pipe, waiters park on the event loop until notify() writes to it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._notify_fd = None
+        self._loop = None
+        self._waiters: List[asyncio.Future] = []
+
+    def _open(self):
+        try:
+            os.mkfifo(self.path)
+        except FileExistsError:
+            pass
+        # read/write open never blocks and never sees EOF when notifiers come and go
+        self._fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+
+    def _on_readable(self):
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+    async def wait(self, timeout):
+        if self._fd is None:
+            self._open()
+        self._loop = asyncio.get_event_loop()
+        waiter = self._loop.create_future()
+        if len(self._waiters) == 0:
+            self._loop.add_reader(self._fd, self._on_readable)
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait([waiter], timeout=timeout)
+        finally:
+            self._waiters.remove(waiter)
+            if len(self._waiters) == 0:
+                self._loop.remove_reader(self._fd)
+        return waiter.done()
+
+    def notify(self):
+        if self._notify_fd is None:
+            try:
+                self._notify_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:  # nobody ever waited on this queue
+                return
+        try:
+            os.write(self._notify_fd, b"\0")
+        except BlockingIOError:  # pipe full, a wakeup is pending anyway
+            pass
+        except OSError:
+            os.close(self._notify_fd)
+            self._notify_fd = None
+
+    def close(self):
+        if self._fd is not None:
+            if len(self._waiters) > 0:
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._notify_fd is not None:
+            os.close(self._notify_fd)
+            self._notify_fd = None
+
+    def unlink(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
 
 
 class FrameParser:
@@ -92,7 +290,7 @@ class FrameParser:
         self.frame_status = buffer[self.frame_status_pointer]
         self.frame_d_type = buffer[exe_index + MemQueue.FRAME_TYPE_OFFSET]
         self.frame_size_pointer = exe_index + MemQueue.FRAME_SIZE_OFFSET
-        self.frame_size = int.from_bytes(buffer[self.frame_size_pointer:self.frame_size_pointer + 4], "little")
+        self.frame_size = int.from_bytes(buffer[self.frame_size_pointer:self.frame_size_pointer + 8], "little")
         self.frame_data_pointer = exe_index + MemQueue.FRAME_HEADER_SIZE
         self.frame_data_size = self.frame_size - MemQueue.FRAME_HEADER_SIZE
         self.frame_data = bytearray(self.frame_data_size)
@@ -116,32 +314,32 @@ class MemQueue:
     FRAME_HEADER_SIZE = 32  # added to every frame
     FRAME_STATUS_OFFSET = 0  # from frame start, size 1
     FRAME_TYPE_OFFSET = 1  # from frame start, size 1
-    FRAME_SIZE_OFFSET = 2  # from frame start, size 4
-    FRAME_WATERMARK_OFFSET = 6  # from frame start, size 8
-    FRAME_CRC32_OFFSET = 14  # from frame start, size 4
-    FRAME_NUM_OFFSET = 18  # from frame start, size 4
+    FRAME_VERSION_OFFSET = 2  # from frame start, size 1
+    FRAME_PRIORITY_OFFSET = 3  # from frame start, size 1, the lane the frame was put to
+    FRAME_CRC32_OFFSET = 4  # from frame start, size 4
+    FRAME_SIZE_OFFSET = 8  # from frame start, size 8
+    FRAME_WATERMARK_OFFSET = 16  # from frame start, size 8
+    FRAME_NUM_OFFSET = 24  # from frame start, size 8
+    FRAME_VERSION = 2  # version 1 layout is read by QueueV1Reader only
     # end of frame header space
-    # Q header space
-    Q_CONTROL_SIZE = 64
+    CHUNK_PREFIX_SIZE = 16  # chunk data starts with the first chunk frame number (8) and the data frame size (8)
+    CHUNK_RATIO = 4  # chunk frames take this part of the ring, producer and consumer work on the stream together
+    CHUNK_TIMEOUT = 10  # sec, a stream waiting this long on the other side is torn
+    # Q header space, see QControlBlock
+    Q_CONTROL_SIZE = 128
+    CONTROL_VERSION = 2
     DATA_START_POINT = Q_CONTROL_SIZE
-    R_LOCK_POINTER = 6  # size = 4
-    R_LOCK__COUNTER_POINTER = 10  # size = 4
-    W_LOCK_POINTER = 14  # size = 4
-    W_LOCK__COUNTER_POINTER = 20  # size = 4
-    STATUS_POINTER = 24  # size = 1
-    DIRECTION_POINTER = 25  # size = 1
-    ALLOC_POINTER = 26  # size = 4
-    EXE_POINTER = 30  # size = 4
-    ALLOC_COUNTER_POINTER = 34  # size = 4
-    EXE_COUNTER_POINTER = 38  # size = 4
-    DFPS_CALC_INTERVAL = 42  # size = 4
-    LAST_DFPS_CALC_TIME = 46  # size = 8
-    DFPS_LAST_ALLOC_COUNTER = 54  # size = 4
-    DFPS_LAST_EXE_COUNTER = 58  # size = 4
+    MIN_SIZE = Q_CONTROL_SIZE + 3 * FRAME_HEADER_SIZE + 2  # a 1 byte frame fits wherever the indexes are
+    LANE_SIZE_DIVISOR = 4  # lanes above lane 0 take this share of the queue size, unless APIQueue.lane_size is set
+    CHECKPOINT_SLOT_SIZE = 256  # durable queues, 2 slots on the page after the queue
     # end of Q header
     LOCK_TIMEOUT = 100
     LOCK_CHECK_INTERVAL = 0.05
+    LOCK_SPIN_INTERVAL = 0.0001  # first wait for a lock, doubled up to LOCK_CHECK_INTERVAL
+    WAIT_PARK_TIMEOUT = 0.05  # parked waiters recheck the queue, covers a wakeup lost to a race
+    WAIT_POLL_INTERVAL = 0.01  # no named pipes on this platform, waiters poll
     MAX_CAPACITY = 0.90
+    SEGMENT_SEARCH_LIMIT = 16  # resized segments retired while drained may be skipped by followers
     WATER_MARK = bytearray()
     WATER_MARK.extend(map(ord, "d@tal0op"))
 
@@ -151,45 +349,483 @@ class MemQueue:
         MemQueue.next_serial += 1
         return q_id
 
-    def __init__(self, q: APIQueue):
-        self.log: QActionLog = QActionLog()
-        min_q_size = self.Q_CONTROL_SIZE + self.FRAME_HEADER_SIZE + 1  # send at least 1 byte ...
-        if q.size < min_q_size:
-            raise MemoryError(f"Queue size must be at least {min_q_size}")
-        self.frame_counter = 0
+    def __init__(self, q: APIQueue, reader: str = None):
+        if q.size < self.MIN_SIZE:
+            raise MemoryError(f"Queue size must be at least {self.MIN_SIZE}")
+        if q.mode == QueueMode.BROADCAST and (q.durable_path or not q.readers):
+            raise ValueError(f"Queue {q.id}: broadcast queues need readers and can not be durable")
+        if not 1 <= q.lanes <= 255:
+            raise ValueError(f"Queue {q.id}: lanes must be between 1 and 255")
+        if q.durable_path and q.page_backing != PageBacking.DEFAULT:
+            raise ValueError(f"Queue {q.id}: durable queues are file backed, huge pages are for shared memory queues")
+        if q.mode == QueueMode.CONFLATE and (q.overflow != OverflowPolicy.REJECT or q.conflate_depth < 1):
+            raise ValueError(f"Queue {q.id}: conflating queues drop frames on overflow and keep at least one")
         self.qid = q.id
         self.from_p = q.from_p
         self.to_p = q.to_p
+        self.readers = list(q.readers)
+        self.reader = reader
         self.length = 10
         self.name = f"{self.from_p} -> {self.to_p} ({self.qid})"
         self.memory_name = f"Q_{self.qid}"
+        log_shm_name = f"{self.memory_name}_log" if q.shared_log else None
+        self.log: QActionLog = QActionLog(sample_every=q.log_sample_every, shm_name=log_shm_name)
         self.size = q.size
         self.nextMessageAddress = 0
         self.currentAddress = 0
         self.host = q.host
-        self.r_lock_mem = None
-        self.w_lock_mem = None
+        self.mode = q.mode
+        self.spin_us = q.spin_us
+        self._data_event = None
+        self._space_event = None
+        if hasattr(os, "mkfifo"):
+            self._data_event = QueueEvent(os.path.join(LOCK_DIR, f"{self.memory_name}_data"))
+            self._space_event = QueueEvent(os.path.join(LOCK_DIR, f"{self.memory_name}_space"))
+        self.overflow = q.overflow
+        self.spill_dir = q.spill_dir
+        self._spill = None
+        self._replay_lock = asyncio.Lock()  # one replay at a time, a frame read from disk is put once
+        self._replay_task = None
+        if self.overflow == OverflowPolicy.SPILL:
+            spill_dir = self.spill_dir or os.path.join(tempfile.gettempdir(), "upipe_spill")
+            self._spill = QueueSpill(spill_dir, self.memory_name)
+        self.durable_path = q.durable_path
+        self.checkpoint_interval_ms = q.checkpoint_interval_ms
+        self._last_checkpoint_time = 0
+        self.r_lock = None
+        self.w_lock = None
+        self._put_lock = asyncio.Lock()  # lock free queues: producer tasks of this process take turns
+        self._put_locked = False
+        self._ctrl = None  # set before mem, released first so the memory can close
+        self._cursors = None
+        self._cursor = None
+        self._checkpoints = None
+        self._view = None
+        self._view_frame = None
+        self._view_priority = 0
+        self._stream = None  # reassembled chunk stream held by the current view
+        self._reserved = None
+        self.generation = q.generation
+        self.burst_window_ms = q.burst_window_ms
+        self.integrity = q.integrity
+        self.integrity_sample_every = max(q.integrity_sample_every, 1)
+        self._set_checksum(CHECKSUM.CRC32C if crc32c is not None else CHECKSUM.CRC32)
+        self.page_backing = q.page_backing
+        self.prefault = q.prefault
+        self.numa_node = q.numa_node
+        self.conflate_depth = q.conflate_depth
+        self.conflate_key = q.conflate_key
+        # QueueMode.CONFLATE, (frame start, frame number) of the unread frames this producer put, per key
+        self._conflated: Dict[object, Deque[Tuple[int, int]]] = defaultdict(deque)
+        self._retired: List[shared_memory.SharedMemory] = []  # resized segments not drained yet
+        self.lanes = q.lanes
+        self.lane_size = q.lane_size
+        self.priority = 0  # this ring lane, the queue object is lane 0 and holds the higher lanes
+        self._lanes: List[MemQueue] = []
+        self._view_lane = None
         try:
-            self.mem = shared_memory.SharedMemory(name=self.memory_name, create=True, size=self.size)
-            self.mem.buf[:] = bytearray(self.size)
-            self.status = LOCK_STATUS.OPEN
-            self.direction = Q_DIRECTION.NORMAL
-            self.alloc_index = self.DATA_START_POINT
-            self.exe_index = self.DATA_START_POINT
-
+            if self.generation > 0:
+                raise FileExistsError  # resized segments are created by resize() only
+            self.mem = self._open_memory(create=True)
+            self.created = True
+            self._init_segment()
+            if self.durable_path:
+                self._checkpoints = self._map_checkpoints()
+                self.checkpoint()
         except FileExistsError:
-            self.mem = shared_memory.SharedMemory(name=self.memory_name, size=self.size)
+            self.created = False
+            if self.generation > 0:
+                self._attach_segment(self.generation)
+            else:
+                self.mem = self._open_memory(create=False)
+                if self.mem.buf[0] != self.CONTROL_VERSION:
+                    self._upgrade_layout()
+                self._ctrl = QControlBlock.from_buffer(self.mem.buf)
+                self.size = self._ctrl.ring_size  # the node may have sized (or resized) it differently
+                self._set_checksum(self._ctrl.checksum)
+                self._map_cursors()
+            if self.durable_path:
+                self._checkpoints = self._map_checkpoints()
         self.dfps_interval_ms = 1000
+        for priority in range(1, self.lanes):
+            lane = MemQueue(self._lane_def(q, priority), reader=reader)
+            lane.priority = priority
+            lane._data_event = self._data_event  # consumers park on lane 0 for frames on any lane
+            self._lanes.append(lane)
+
+    @classmethod
+    def _lane_size(cls, size: int, lane_size: int = None) -> int:
+        if lane_size:
+            return lane_size
+        return max(size // cls.LANE_SIZE_DIVISOR, cls.MIN_SIZE)
+
+    @classmethod
+    def _lane_def(cls, q: APIQueue, priority: int) -> APIQueue:
+        lane_id = f"{q.id}_p{priority}"
+        durable_path = f"{q.durable_path}.p{priority}" if q.durable_path else None
+        return q.copy(update={"id": lane_id, "name": lane_id, "lanes": 1, "durable_path": durable_path,
+                              "size": cls._lane_size(q.size, q.lane_size), "lane_size": None})
+
+    def lane(self, priority: int = None) -> "MemQueue":
+        """
+        The ring serving the given frame priority, priorities above the lanes number go to the highest lane
+        """
+        priority = min(max(priority or 0, 0), self.lanes - 1)
+        if priority == 0:
+            return self
+        return self._lanes[priority - 1]
+
+    def _init_segment(self):
+        # new segments and files map zero pages, only the control block and the reader cursors are written.
+        # The data area is left untouched: its pages are faulted in on first use, or up front with prefault
+        self.mem.buf[:self.Q_CONTROL_SIZE] = bytes(self.Q_CONTROL_SIZE)
+        self.mem.buf[self.size:self.size + self._cursors_size] = bytes(self._cursors_size)
+        self._ctrl = QControlBlock.from_buffer(self.mem.buf)
+        self._ctrl.version = self.CONTROL_VERSION
+        self._ctrl.checksum = self.checksum
+        self._ctrl.generation = self.generation
+        self._ctrl.ring_size = self.size
+        self.status = LOCK_STATUS.OPEN
+        self.direction = Q_DIRECTION.NORMAL
+        self.alloc_index = self.DATA_START_POINT
+        self.exe_index = self.DATA_START_POINT
+        self.claim_index = self.DATA_START_POINT
+        self._map_cursors()
+        for cursor in self._cursors or []:
+            cursor.index = self.DATA_START_POINT
+
+    def _upgrade_layout(self):
+        """
+        Durable queue file in the version 1 layout: its pending frames are moved to a new file in this layout,
+        the ring grows by the control block difference so they always fit
+        """
+        if not self.durable_path:
+            self.mem.close()
+            raise BrokenPipeError(f"Queue {self.qid}: memory layout is not version {self.CONTROL_VERSION}")
+        reader = QueueV1Reader(self.mem.buf, self.size)
+        frames = reader.frames()
+        self.size = reader.size + self.Q_CONTROL_SIZE - reader.Q_CONTROL_SIZE
+        self.mem.close()
+        old_path = f"{self.durable_path}.v1"
+        os.replace(self.durable_path, old_path)  # kept until the new file is checkpointed
+        self.mem = self._open_memory(create=True)
+        self._init_segment()
+        alloc_index = self.DATA_START_POINT
+        frame_number = reader.exe_counter
+        for frame_type, frame_data in frames:
+            if frame_type != FRAME_TYPE.WHOLE:
+                frame_data = frame_data[:4] + bytes(4) + frame_data[4:]  # chunk stream number is 64 bit now
+            frame_size = len(frame_data) + self.FRAME_HEADER_SIZE
+            crc32 = self._checksum(frame_number, frame_data)
+            self._write_ring(alloc_index, self._frame_header(frame_size, crc32, frame_number, frame_type) + frame_data)
+            alloc_index = self._next_frame_index(alloc_index, frame_size)
+            frame_number += 1
+        self.alloc_index = alloc_index
+        self.alloc_counter = frame_number
+        self.exe_counter = self.claim_counter = reader.exe_counter
+        self._checkpoints = self._map_checkpoints()
+        self.checkpoint()
+        self._checkpoints = None
+        self._ctrl = None
+        os.unlink(old_path)
+
+    @property
+    def _segment_name(self):
+        if self.generation == 0:
+            return self.memory_name
+        return f"{self.memory_name}_g{self.generation}"
+
+    def _open_memory(self, create):
+        if not self.durable_path:
+            return open_memory(self._segment_name, create, self.size + self._cursors_size, self.page_backing,
+                               self.numa_node, self.prefault)
+        file_size = self._checkpoint_offset + mmap.PAGESIZE
+        mem = FileMemory(self.durable_path, create=create, size=file_size)
+        if mem.size < file_size:
+            mem.close()
+            raise MemoryError(f"Queue file {self.durable_path} is smaller than the queue size {self.size}")
+        if create:
+            place_memory(mem._mmap, self.numa_node, self.prefault)
+        return mem
+
+    @property
+    def _cursors_size(self):
+        if self.mode != QueueMode.BROADCAST:
+            return 0
+        return ctypes.sizeof(QCursor) * len(self.readers)
+
+    def _map_cursors(self):
+        if self.mode != QueueMode.BROADCAST:
+            return
+        self._cursors = (QCursor * len(self.readers)).from_buffer(self.mem.buf, self.size)
+        if self.reader is not None:
+            self._cursor = self._cursors[self.readers.index(self.reader)]
+
+    def _map_checkpoints(self):
+        return [QCheckpoint.from_buffer(self.mem.buf, self._checkpoint_offset + i * self.CHECKPOINT_SLOT_SIZE)
+                for i in range(2)]
+
+    @property
+    def _checkpoint_offset(self):
+        return -(-self.size // mmap.PAGESIZE) * mmap.PAGESIZE  # page aligned, msync works on pages
+
+    @property
+    def _committed_exe_index(self):
+        slot_a, slot_b = self._checkpoints
+        return slot_a.control.exe_index if slot_a.sequence >= slot_b.sequence else slot_b.control.exe_index
+
+    def checkpoint(self):
+        """
+        Durable queues: flush the queue file and commit the consumed position, consumed frames space is reused
+        only once committed and recover() replays frames from the last checkpoint.
+        The exe side must not move meanwhile, callers are the SPSC consumer or the read lock holder
+        """
+        self.mem.flush(0, self._checkpoint_offset)
+        newest, oldest = sorted(self._checkpoints, key=lambda c: c.sequence, reverse=True)
+        ctypes.memmove(ctypes.addressof(oldest.control), ctypes.addressof(self._ctrl), self.Q_CONTROL_SIZE)
+        oldest.sequence = newest.sequence + 1
+        oldest.crc32 = binascii.crc32(bytes(oldest)[:-4])
+        self.mem.flush(self._checkpoint_offset, mmap.PAGESIZE)
+        self._last_checkpoint_time = time.time()
+
+    def _maybe_checkpoint(self):
+        if self._checkpoints is None:
+            return
+        if (time.time() - self._last_checkpoint_time) * 1000 >= self.checkpoint_interval_ms:
+            self.checkpoint()
+
+    def _try_checkpoint(self):
+        if self.lock_free or self.r_lock:
+            self.checkpoint()
+            return
+        self.r_lock = self.try_acquire_lock(self.r_lock_memory_name)
+        if not self.r_lock:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            self.release_read_lock()
+
+    def recover(self) -> int:
+        """
+        Durable queues: bring the queue file back after a crash, from the last checkpoint.
+        Frames are validated (watermark, CRC32, frame number) up to the first broken one, in flight and
+        consumed after the checkpoint frames are delivered again. Call before producers and consumers attach.
+        returns the number of pending frames
+        """
+        valid = [c for c in self._checkpoints if c.valid]
+        if len(valid) == 0:
+            raise BrokenPipeError(f"Queue {self.qid}: no valid checkpoint in {self.durable_path}")
+        checkpoint = max(valid, key=lambda c: c.sequence)
+        exe_index = checkpoint.control.exe_index
+        exe_counter = checkpoint.control.exe_counter
+        frame_start = exe_index
+        frames = 0
+        walked = 0
+        while True:
+            frame_start = self._frame_at(frame_start)
+            frame_header = self._read_frame_header(frame_start)
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+            frame_number = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little")
+            if frame_header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8] != self.WATER_MARK:
+                break
+            if frame_number != exe_counter + frames:
+                break  # left over from an earlier lap
+            if frame_size < self.FRAME_HEADER_SIZE or frame_start + frame_size > self.size or \
+                    walked + frame_size >= self._data_size:
+                break
+            frame_data = self._read_frame_data(frame_start, frame_size - self.FRAME_HEADER_SIZE)
+            expected_crc32 = frame_header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4]
+            if self._checksum(frame_number, frame_data).to_bytes(4, "little") != expected_crc32:
+                break
+            self.set_frame_status(frame_start, FRAME_STATUS.CREATED)  # claimed by a consumer that is gone
+            frames += 1
+            walked += frame_size
+            frame_start = self._next_frame_index(frame_start, frame_size)
+        ctrl = self._ctrl
+        ctrl.exe_index = exe_index
+        ctrl.exe_counter = exe_counter
+        ctrl.claim_index = exe_index
+        ctrl.claim_counter = exe_counter
+        ctrl.alloc_index = frame_start
+        ctrl.alloc_counter = exe_counter + frames
+        ctrl.data_waiters = 0
+        ctrl.space_waiters = 0
+        ctrl.spilled_frames = 0
+        ctrl.spilled_bytes = 0
+        self.checkpoint()
+        return frames + sum([lane.recover() for lane in self._lanes])
+
+    async def resize(self, size: int):
+        """
+        Online resize: move the queue to a new memory segment of the given size while it is in use.
+        Pending frames are migrated under the queue locks (LOCKED and MPMC queues), SPSC and broadcast
+        consumers drain the old segment first. Attached queues follow the generation counter on their next
+        put/get, or on follow(). Called from the node, not from the queue producer or consumer
+        """
+        if self.durable_path:
+            raise ValueError(f"Queue {self.qid}: durable queues can not be resized")
+        if size < self.MIN_SIZE:
+            raise MemoryError(f"Queue size must be at least {self.MIN_SIZE}")
+        if self._view_frame is not None or self._reserved is not None:
+            raise BufferError(f"Queue {self.qid}: release the view or reserved frame before resizing")
+        for lane in self._lanes:
+            if not self.lane_size:
+                await lane.resize(self._lane_size(size))
+        self.collect_segments()
+        migrate = self.mode in (QueueMode.LOCKED, QueueMode.MPMC, QueueMode.CONFLATE)
+        await self.acquire_write_lock()
+        try:
+            if migrate:
+                await self.acquire_read_lock()
+            while self._ctrl.generation != self.generation:
+                self._switch_segment()
+            frames = self._pending_frames() if migrate else []
+            pending_bytes = sum([len(frame) for frame in frames])
+            if pending_bytes >= size - self.Q_CONTROL_SIZE or pending_bytes / size > self.MAX_CAPACITY:
+                raise MemoryError(f"Queue {self.qid}: {pending_bytes} pending bytes do not fit in {size}")
+            old_mem = self.mem
+            old_ctrl = self._ctrl
+            self._ctrl = None
+            self._cursors = None
+            self._cursor = None
+            self.size = size
+            self.generation += 1
+            self.mem = self._open_memory(create=True)
+            self._init_segment()
+            alloc_index = self.DATA_START_POINT
+            for frame in frames:
+                self._write_ring(alloc_index, frame)
+                alloc_index = self._next_frame_index(alloc_index, len(frame))
+            self.alloc_index = alloc_index
+            self.alloc_counter = old_ctrl.alloc_counter
+            self.exe_counter = self.claim_counter = old_ctrl.alloc_counter - len(frames)
+            self._ctrl.spilled_frames = old_ctrl.spilled_frames
+            self._ctrl.spilled_bytes = old_ctrl.spilled_bytes
+            for cursor in self._cursors or []:
+                cursor.counter = self.alloc_counter
+            if self.mode in (QueueMode.LOCKED, QueueMode.CONFLATE):
+                old_ctrl.exe_index = old_ctrl.alloc_index
+                old_ctrl.exe_counter = old_ctrl.alloc_counter
+            elif self.mode == QueueMode.MPMC:
+                old_ctrl.claim_index = old_ctrl.alloc_index  # claimed frames are retired on the old segment
+                old_ctrl.claim_counter = old_ctrl.alloc_counter
+            if not self.lock_free:
+                old_ctrl.status = LOCK_STATUS.LOCKED  # sealed, the SPSC producer seals it when it follows
+            old_ctrl.generation = self.generation  # published last, the new segment is ready
+            wake_data, wake_space = old_ctrl.data_waiters, old_ctrl.space_waiters
+            old_ctrl = None
+            if self._data_event and wake_data:
+                self._data_event.notify()
+            if self._space_event and wake_space:
+                self._space_event.notify()
+            self._retired.append(old_mem)
+            self.collect_segments()
+        finally:
+            self.release_read_lock()
+            self.release_write_lock()
+
+    def _pending_frames(self) -> List[bytearray]:
+        if self.mode == QueueMode.MPMC:
+            frame_start, frames_num = self.claim_index, self.unclaimed_counter
+        else:
+            frame_start, frames_num = self.exe_index, self.pending_counter
+        frames = []
+        for _ in range(frames_num):
+            frame_start = self._frame_at(frame_start)
+            frame_header = self._read_frame_header(frame_start)
+            self._validate_watermark(frame_header, frame_start)
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+            frames.append(frame_header + self._read_frame_data(frame_start, frame_size - self.FRAME_HEADER_SIZE))
+            frame_start = self._next_frame_index(frame_start, frame_size)
+        return frames
+
+    def collect_segments(self) -> int:
+        """
+        Unlink the resized segments every follower is done with, returns the number of segments still in use
+        """
+        for mem in list(self._retired):
+            if self._segment_drained(mem):
+                self._retired.remove(mem)
+                mem.close()
+                mem.unlink()
+        return len(self._retired)
+
+    def _segment_drained(self, mem) -> bool:
+        ctrl = QControlBlock.from_buffer(mem.buf)
+        try:
+            if ctrl.status != LOCK_STATUS.LOCKED:
+                return False
+            if self.mode == QueueMode.BROADCAST:
+                cursors = (QCursor * len(self.readers)).from_buffer(mem.buf, ctrl.ring_size)
+                drained = all([cursor.counter == ctrl.alloc_counter for cursor in cursors])
+                del cursors
+                return drained
+            if self.mode == QueueMode.MPMC:
+                return ctrl.claim_counter == ctrl.alloc_counter
+            return ctrl.exe_counter == ctrl.alloc_counter
+        finally:
+            del ctrl
+
+    def follow(self, consumer: bool):
+        """
+        Move to the queue latest memory segment after a resize. Producers move right away,
+        consumers once they are done with the frames pending on the old segment
+        """
+        for lane in self._lanes:
+            lane.follow(consumer)
+        if consumer:
+            self._follow_consumer()
+        else:
+            self._follow_producer()
+
+    def _follow_producer(self):
+        while self._ctrl.generation != self.generation:
+            if self.lock_free:
+                self._ctrl.status = LOCK_STATUS.LOCKED  # no more writes, the consumer moves on once drained
+            self._switch_segment()
+
+    def _follow_consumer(self):
+        while self._ctrl.generation != self.generation and self._view_frame is None:
+            if self._ctrl.status != LOCK_STATUS.LOCKED or self._ring_has_data():
+                return
+            self._switch_segment()
+
+    def _switch_segment(self):
+        generation = self._ctrl.generation
+        self._ctrl = None
+        self._cursors = None
+        self._cursor = None
+        self.mem.close()
+        self._attach_segment(generation)
+
+    def _attach_segment(self, generation):
+        for _ in range(self.SEGMENT_SEARCH_LIMIT):
+            self.generation = generation
+            try:
+                self.mem = self._open_memory(create=False)
+                break
+            except FileNotFoundError:
+                generation += 1  # drained and unlinked before we got to it
+        else:
+            raise BrokenPipeError(f"Queue {self.qid}: segment generation {self.generation} not found")
+        self._ctrl = QControlBlock.from_buffer(self.mem.buf)
+        self.size = self._ctrl.ring_size
+        self._set_checksum(self._ctrl.checksum)
+        self._map_cursors()
+
+    def log_enqueue(self, frame_counter, data_size):
+        if self.log.sample(QActionLog.ENQUEUE):
+            self._log_sample(QActionLog.ENQUEUE, frame_counter, data_size)
 
-    def log_enqueue(self, entry: QLogEntry):
-        current_time = time.time() * 1000  # ms
-        entry.time = current_time
-        self.log.log_enqueue(entry)
+    def log_dequeue(self, frame_counter, data_size):
+        if self.log.sample(QActionLog.DEQUEUE):
+            self._log_sample(QActionLog.DEQUEUE, frame_counter, data_size)
 
-    def log_dequeue(self, entry: QLogEntry):
-        current_time = time.time() * 1000  # ms
-        entry.time = current_time
-        self.log.log_dequeue(entry)
+    def _log_sample(self, op, frame_counter, data_size):
+        ctrl = self._ctrl
+        self.log.record(op, (time.time() * 1000, frame_counter, ctrl.alloc_index, ctrl.exe_index, ctrl.alloc_counter,
+                             ctrl.exe_counter, ctrl.alloc_counter - ctrl.exe_counter, self.free_space, data_size))
 
     def update_dfps(self):
         current_time_ms = time.time() * 1000
@@ -202,142 +838,1130 @@ class MemQueue:
         self.last_dfps_calc_time = int(current_time_ms)
 
     async def get(self) -> Union[DataFrame, None]:
+        view = await self.get_view()
+        if view is None:
+            return None
+        return self._frame_from_view(view)
+
+    def _frame_from_view(self, view) -> DataFrame:
+        ring = self._view_lane or self
         try:
-            if self.pending_counter == 0:
-                return None
+            frame_data = ring._stream if ring._stream is not None else bytearray(view)
+            priority = ring._view_priority
+        finally:
+            self.release()
+        frame = DataFrame.from_byte_arr(frame_data)
+        frame.priority = priority
+        return frame
+
+    async def get_many(self, max_n: int, max_bytes: int = None) -> List[DataFrame]:
+        """
+        Dequeue up to max_n frames (and about max_bytes of frame data) under one lock,
+        indexes and counters are updated once for the whole run. At least one pending frame is always returned
+        """
+        if self._view_frame is not None or self._view_lane is not None:
+            raise BufferError(f"Queue {self.qid}: release the current view before getting the next one")
+        for lane in reversed(self._lanes):  # a batch is taken from the highest non-empty lane only
+            frames = await lane.get_many(max_n, max_bytes)
+            if frames:
+                return frames
+        frames = await self._get_many(max_n, max_bytes)
+        for frame in frames:
+            frame.priority = self.priority
+        return frames
+
+    async def _get_many(self, max_n, max_bytes) -> List[DataFrame]:
+        if self._ctrl.generation != self.generation:
+            self._follow_consumer()
+        if self._ring_has_data() and self._next_frame_type() != FRAME_TYPE.WHOLE:
+            view = await self._get_stream_view()
+            return [] if view is None else [self._frame_from_view(view)]
+        if self.mode == QueueMode.MPMC:
+            return await self._claim_many(max_n, max_bytes)
+        if self.mode == QueueMode.BROADCAST:
+            return await self._read_many(max_n, max_bytes)
+        if self.pending_counter == 0:
+            return []
+        if not self.lock_free:
             await self.acquire_read_lock()
-            capacity = (self.size - self.Q_CONTROL_SIZE - self.free_space) / self.size
-            frame_header = bytearray(self.FRAME_HEADER_SIZE)
-            start_exe_index = self.exe_index
-            # get the frame header
-            if self.exe_index + self.FRAME_HEADER_SIZE < self.size:
-                frame_header[:] = self.mem.buf[self.exe_index:self.exe_index + self.FRAME_HEADER_SIZE]
-            else:
-                header_space_left = self.size - self.exe_index
-                part1 = self.mem.buf[self.exe_index:]
-                part2 = self.mem.buf[
-                        self.DATA_START_POINT:self.DATA_START_POINT + self.FRAME_HEADER_SIZE - header_space_left]
-                frame_header[:] = part1.tobytes() + part2.tobytes()
-            # validate frame
-            frame_status = frame_header[self.FRAME_STATUS_OFFSET]
-            watermark = frame_header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8]
-            expected_crc32 = frame_header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4]
-            if frame_status != FRAME_STATUS.CREATED:
+        try:
+            frames_data = []
+            frame_start = self.exe_index
+            data_bytes = 0
+            dropped = 0
+            pending = self.pending_counter
+            while len(frames_data) < max_n and len(frames_data) + dropped < pending:
+                frame_start = self._frame_at(frame_start)
+                frame_header = self._read_frame_header(frame_start)
+                if frame_header[self.FRAME_STATUS_OFFSET] == FRAME_STATUS.DROPPED:
+                    frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8],
+                                                "little")
+                    self._clear_frame(frame_start)
+                    frame_start = self._next_frame_index(frame_start, frame_size)
+                    dropped += 1
+                    continue
+                if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED:
+                    break
+                if frame_header[self.FRAME_TYPE_OFFSET] != FRAME_TYPE.WHOLE:
+                    break  # chunk streams are read on their own
+                self._validate_watermark(frame_header, frame_start)
+                frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+                data_size = frame_size - self.FRAME_HEADER_SIZE
+                if max_bytes is not None and frames_data and data_bytes + data_size > max_bytes:
+                    break
+                frame_data = self._read_frame_data(frame_start, data_size)
+                self._clear_frame(frame_start)
+                frames_data.append((frame_start, frame_header, frame_data))
+                data_bytes += data_size
+                frame_start = self._next_frame_index(frame_start, frame_size)
+            if len(frames_data) + dropped == 0:
+                return []
+            for _, frame_header, frame_data in frames_data:
+                frame_counter = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little")
+                self.log_dequeue(frame_counter, len(frame_data))
+            # space is given back once for the whole batch, exe_counter last
+            self.exe_index = frame_start
+            self.update_dfps()
+            self.exe_counter += len(frames_data) + dropped
+            self._notify_space()
+            self._maybe_checkpoint()
+        finally:
+            self.release_read_lock()
+        for frame_start, frame_header, frame_data in frames_data:
+            self._validate_crc32(frame_header, frame_data, frame_start)
+        return [DataFrame.from_byte_arr(frame_data) for _, _, frame_data in frames_data]
+
+    async def _read_many(self, max_n, max_bytes):
+        # broadcast readers share no frames, the cursor is moved frame by frame so the producer gets space early
+        frames = []
+        total_bytes = 0
+        while len(frames) < max_n and (max_bytes is None or total_bytes < max_bytes):
+            view = await self.get_view()
+            if view is None:
+                break
+            try:
+                total_bytes += len(view)
+                frames.append(DataFrame.from_byte_arr(bytearray(view)))
+            finally:
+                self.release()
+        return frames
+
+    async def _claim_many(self, max_n, max_bytes):
+        if self.unclaimed_counter == 0:
+            if self.exe_counter != self.claim_counter:
+                self._try_reclaim()
+            return []
+        claimed = []
+        try:
+            await self.acquire_read_lock()
+            self._reclaim_retired()
+            frame_start = self.claim_index
+            data_bytes = 0
+            for _ in range(min(self.unclaimed_counter, max_n)):
+                frame_start = self._frame_at(frame_start)
+                frame_header = self._read_frame_header(frame_start)
+                if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED:
+                    break
+                if frame_header[self.FRAME_TYPE_OFFSET] != FRAME_TYPE.WHOLE:
+                    break
+                self._validate_watermark(frame_header, frame_start)
+                frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+                if max_bytes is not None and claimed and data_bytes + frame_size - self.FRAME_HEADER_SIZE > max_bytes:
+                    break
+                self.set_frame_status(frame_start, FRAME_STATUS.EXECUTING)
+                claimed.append((frame_start, frame_header, frame_size))
+                data_bytes += frame_size - self.FRAME_HEADER_SIZE
+                frame_start = self._next_frame_index(frame_start, frame_size)
+            if len(claimed) > 0:
+                self.claim_index = frame_start
+                self.claim_counter += len(claimed)
+        finally:
+            self.release_read_lock()
+        frames = []
+        try:
+            for frame_start, frame_header, frame_size in claimed:
+                frame_data = self._read_frame_data(frame_start, frame_size - self.FRAME_HEADER_SIZE)
+                self._validate_crc32(frame_header, frame_data, frame_start)
+                frames.append(DataFrame.from_byte_arr(frame_data))
+        finally:
+            for frame_start, _, _ in claimed:
+                self.set_frame_status(frame_start, FRAME_STATUS.RETIRED)
+            if claimed:
+                self._try_reclaim(claimed[0][0])
+        return frames
+
+    async def get_view(self) -> Union[memoryview, None]:
+        """
+        Zero copy dequeue: returns a read only view of the next frame data, pointing into the queue memory.
+        The frame space is held until release() is called, one view can be held at a time per queue object.
+        Frames are contiguous in the ring, chunk streams are reassembled in one buffer.
+        returns None if no frame is pending
+        """
+        if self._view_frame is not None or self._view_lane is not None:
+            raise BufferError(f"Queue {self.qid}: release the current view before getting the next one")
+        for lane in reversed(self._lanes):
+            view = await lane.get_view()
+            if view is not None:
+                self._view_lane = lane
+                return view
+        if self._ctrl.generation != self.generation:
+            self._follow_consumer()
+        if self._checkpoints is not None and not self._ring_has_data() and self.exe_index != self._committed_exe_index:
+            self._try_checkpoint()  # durable: consumer is idle, commit what it consumed
+        if self._ring_has_data() and self._next_frame_type() != FRAME_TYPE.WHOLE:
+            return await self._get_stream_view()
+        if self.mode == QueueMode.MPMC:
+            claimed = await self.claim()
+            if claimed is None:
                 return None
-            if watermark != self.WATER_MARK:
-                raise BrokenPipeError(
-                    f"{current_milli_time()} - Missing watermark on index:{watermark} @ {self.exe_index}")
-
-            frame_d_type = frame_header[self.FRAME_TYPE_OFFSET]
-            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 4], "little")
-            frame_data_size = frame_size - self.FRAME_HEADER_SIZE
-            frame_counter = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 4], "little")
-            # log
-            self.log_dequeue(
-                QLogEntry(frame_counter=frame_counter, alloc_index=self.alloc_index, exe_index=self.exe_index,
-                          alloc_counter=self.alloc_counter, exe_counter=self.exe_counter,
-                          pending_counter=self.pending_counter, free_space=self.free_space, capacity=capacity,
-                          data_size=frame_data_size))
-            debug_print(
-                f"Get {current_milli_time()}- Frame size:{frame_size}, free space:{self.free_space}, alloc_index:{self.alloc_index},exe_index:{self.exe_index}")
-            # get the frame data
-            if self.exe_index + self.FRAME_HEADER_SIZE >= self.size:
-                frame_data_pointer = self.DATA_START_POINT + (self.exe_index + self.FRAME_HEADER_SIZE) % self.size
-            else:
-                frame_data_pointer = self.exe_index + self.FRAME_HEADER_SIZE
-            frame_data = bytearray(frame_data_size)
-            if frame_data_pointer + frame_data_size < self.size:
-                frame_data[:] = self.mem.buf[frame_data_pointer:frame_data_pointer + frame_data_size]
-            else:
-                data_space_left = self.size - frame_data_pointer
-                part1 = self.mem.buf[frame_data_pointer:]
-                part2 = self.mem.buf[self.DATA_START_POINT:self.DATA_START_POINT + frame_data_size - data_space_left]
-                frame_data[:] = part1.tobytes() + part2.tobytes()
-            # clear executed frame
-            if self.exe_index + frame_size < self.size:
-                self.mem.buf[self.exe_index:self.exe_index + frame_size] = bytearray(frame_size)
-            else:
-                frame_space_left = self.size - self.exe_index
-                self.mem.buf[self.exe_index:] = bytearray(frame_space_left)
-                self.mem.buf[self.DATA_START_POINT:self.DATA_START_POINT + frame_size - frame_space_left] = bytearray(
-                    frame_size - frame_space_left)
-            # update execution index
-            if self.exe_index + frame_size < self.size:
-                self.exe_index = self.exe_index + frame_size
-            else:
-                self.exe_index = self.DATA_START_POINT + (self.exe_index + frame_size) % self.size
-            # validate data
-            actual_crc32 = binascii.crc32(frame_data).to_bytes(4, "little")
-            if expected_crc32 != actual_crc32:
-                print(f"CRC Check: Expected:{expected_crc32},Actual:{actual_crc32}")
-                raise BrokenPipeError(f"Frame CRC32 error at index:{start_exe_index}, exe count:{self.exe_counter} ")
-            # done
-            frame = DataFrame.from_byte_arr(frame_data)
+            frame_start, frame_header = claimed
+        else:
+            # alloc_counter is the producer publish point, nothing below is read before it moves
+            if not self._ring_has_data():
+                return None
+            if not self.lock_free:
+                await self.acquire_read_lock()
+            try:
+                if self.mode == QueueMode.CONFLATE:
+                    self._skip_dropped()
+                    if not self._ring_has_data():
+                        self.release_read_lock()
+                        return None
+                frame_start = self._frame_at(self.exe_index if self._cursor is None else self._cursor.index)
+                frame_header = self._read_frame_header(frame_start)
+                if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED or \
+                        frame_header[self.FRAME_TYPE_OFFSET] != FRAME_TYPE.WHOLE:
+                    self.release_read_lock()
+                    return None
+                self._validate_watermark(frame_header, frame_start)
+            except Exception:
+                self.release_read_lock()
+                raise
+        frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+        self._log_dequeue_frame(frame_header)
+        debug_print(
+            f"Get {current_milli_time()}- Frame size:{frame_size}, free space:{self.free_space}, alloc_index:{self.alloc_index},exe_index:{self.exe_index}")
+        self._view_frame = (frame_start, frame_size)
+        self._view_priority = frame_header[self.FRAME_PRIORITY_OFFSET]
+        data_size = frame_size - self.FRAME_HEADER_SIZE
+        data_pointer = self._frame_data_pointer(frame_start)
+        view = self.mem.buf[data_pointer:data_pointer + data_size].toreadonly()
+        try:
+            self._validate_crc32(frame_header, view, frame_start)
+        except BrokenPipeError:
+            view.release()
+            self.release()  # drop the broken frame, the queue keeps going
+            raise
+        self._view = view
+        return view
+
+    def release(self):
+        """
+        Done with the frame returned by get_view(), the view is released and the frame space is given back
+        """
+        if self._view_lane is not None:
+            lane = self._view_lane
+            self._view_lane = None
+            lane.release()
+            return
+        if self._view_frame is None:
+            return
+        frame_start, frame_size = self._view_frame
+        self._view_frame = None
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if frame_start is None:
+            self._stream = None  # chunk stream, the chunks were given back as they were read
+            return
+        if self.mode == QueueMode.MPMC:
+            self.set_frame_status(frame_start, FRAME_STATUS.RETIRED)
+            self._try_reclaim(frame_start)
+            return
+        if self._cursor is not None:
+            try:
+                self._cursor.index = self._next_frame_index(frame_start, frame_size)
+                self._cursor.counter += 1
+            finally:
+                self.release_read_lock()
+            self._try_reclaim_cursors()
+            return
+        try:
+            self._clear_frame(frame_start)
+            # update execution index, exe_counter is released last so the producer sees the space only once cleared
+            self.exe_index = self._next_frame_index(frame_start, frame_size)
             self.update_dfps()
             self.exe_counter += 1
-            return frame
+            self._notify_space()
+            self._maybe_checkpoint()
+        finally:
+            self.release_read_lock()
+
+    async def claim(self):
+        """
+        MPMC consumer side: reserve the next CREATED frame for this consumer.
+        Only the claim itself is done under the read lock, the frame is copied and decoded by the caller,
+        which marks it RETIRED once done. returns (frame start, frame header) or None
+        """
+        if self.unclaimed_counter == 0:
+            if self.exe_counter != self.claim_counter:
+                self._try_reclaim()
+            return None
+        try:
+            await self.acquire_read_lock()
+            self._reclaim_retired()
+            if self.unclaimed_counter == 0:
+                return None
+            frame_start = self._frame_at(self.claim_index)
+            frame_header = self._read_frame_header(frame_start)
+            if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED:
+                return None
+            if frame_header[self.FRAME_TYPE_OFFSET] != FRAME_TYPE.WHOLE:
+                return None  # chunk streams are claimed whole by get_view()
+            self._validate_watermark(frame_header, frame_start)
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+            self.set_frame_status(frame_start, FRAME_STATUS.EXECUTING)
+            self.claim_index = self._next_frame_index(frame_start, frame_size)
+            self.claim_counter += 1
+            return frame_start, frame_header
+        finally:
+            self.release_read_lock()
+
+    async def reclaim(self):
+        """
+        Advance exe_index past the contiguous RETIRED frames, freeing their space to the producer.
+        """
+        await self.acquire_read_lock()
+        try:
+            self._reclaim_retired()
+        finally:
+            self.release_read_lock()
+
+    def _try_reclaim(self, frame_start=None):
+        # gives up if another consumer holds the read lock, it will reclaim on its next claim. A frame released
+        # behind the first unreclaimed frame is reclaimed with it, by the consumer releasing that frame
+        if frame_start is not None and frame_start != self._frame_at(self.exe_index):
+            return
+        self.r_lock = self.try_acquire_lock(self.r_lock_memory_name)
+        if not self.r_lock:
+            return
+        try:
+            self._reclaim_retired()
         finally:
             self.release_read_lock()
 
-    async def space_available(self, frame: DataFrame):
-        frame_size = len(frame.to_byte_arr())
-        frame_size = frame_size + self.FRAME_HEADER_SIZE
-        if frame_size > self.free_space:
+    def _try_reclaim_cursors(self):
+        # broadcast: the slowest cursor frees the space behind it, any reader or the producer may move it
+        reclaim_lock = self.try_acquire_lock(f"{self.memory_name}_rlock")
+        if not reclaim_lock:
+            return
+        try:
+            exe_counter = self.exe_counter
+            slowest = min(self._cursors, key=lambda c: c.counter - exe_counter)
+            counter = slowest.counter  # read before the index, the reader publishes it last
+            if counter == exe_counter:
+                return
+            self.exe_index = slowest.index
+            self.update_dfps()
+            self.exe_counter = counter
+            self._notify_space()
+        finally:
+            os.unlink(reclaim_lock)
+
+    def _reclaim_retired(self):
+        while self.exe_counter < self.claim_counter:
+            frame_start = self._frame_at(self.exe_index)
+            if self.get_frame_status(frame_start) != FRAME_STATUS.RETIRED:
+                break
+            frame_header = self._read_frame_header(frame_start)
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+            self._clear_frame(frame_start)
+            self.exe_index = self._next_frame_index(frame_start, frame_size)
+            self.update_dfps()
+            self.exe_counter += 1
+            self._notify_space()
+        self._maybe_checkpoint()
+
+    async def _get_stream_view(self) -> Union[memoryview, None]:
+        """
+        Reassemble the chunk stream at the head of the queue into one buffer. The read lock is held until the
+        last chunk so no other consumer takes a chunk in between, chunks are given back to the producer as read
+        """
+        if not self.lock_free:
+            await self.acquire_read_lock()
+        try:
+            data = await self._read_chunks()
+        finally:
+            self.release_read_lock()
+        if data is None:
+            return None
+        self._stream = data
+        self._view_frame = (None, len(data))
+        self._view = memoryview(data).toreadonly()
+        return self._view
+
+    async def _read_chunks(self) -> Union[bytearray, None]:
+        data = None
+        target = None
+        received = 0
+        chunks = 0
+        stream_number = 0
+        deadline = time.time() + self.CHUNK_TIMEOUT
+        try:
+            while data is None or received < len(data):
+                next_frame = self._stream_frame()
+                if next_frame is None:
+                    if data is None:
+                        return None
+                    if time.time() > deadline:
+                        raise TimeoutError(f"Queue {self.qid}: chunk stream stalled at {received} of {len(data)} bytes")
+                    self._follow_consumer()  # the SPSC producer may go on in a resized segment
+                    await self._wait(self._ring_has_data, self._data_event, "data_waiters", self.WAIT_PARK_TIMEOUT)
+                    continue
+                frame_start, frame_header = next_frame
+                frame_type = frame_header[self.FRAME_TYPE_OFFSET]
+                if data is None and frame_type == FRAME_TYPE.WHOLE:
+                    return None  # taken by another consumer before we got the lock
+                frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+                frame_number = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little")
+                data_pointer = self._frame_data_pointer(frame_start)
+                prefix = bytearray(self.CHUNK_PREFIX_SIZE)
+                self._copy_ring(data_pointer, memoryview(prefix))
+                if data is None:
+                    if frame_type != FRAME_TYPE.CHUNK_FIRST:
+                        self._stream_consume(frame_start, frame_size)  # rest of a torn stream
+                        continue
+                    stream_number = int.from_bytes(prefix[:8], "little")
+                    data = bytearray(int.from_bytes(prefix[8:], "little"))
+                    target = memoryview(data)
+                elif frame_type != FRAME_TYPE.CHUNK or int.from_bytes(prefix[:8], "little") != stream_number or \
+                        frame_number != stream_number + chunks:
+                    raise BrokenPipeError(
+                        f"Queue {self.qid}: chunk stream {stream_number} torn at {received} of {len(data)} bytes")
+                payload_size = frame_size - self.FRAME_HEADER_SIZE - self.CHUNK_PREFIX_SIZE
+                payload = target[received:received + payload_size]
+                self._copy_ring(data_pointer + self.CHUNK_PREFIX_SIZE, payload)
+                self._log_dequeue_frame(frame_header)
+                self._stream_consume(frame_start, frame_size)
+                if len(payload) != payload_size:
+                    raise BrokenPipeError(f"Queue {self.qid}: chunk stream {stream_number} longer than its frame")
+                self._validate_crc32(frame_header, payload, frame_start, prefix)
+                received += payload_size
+                chunks += 1
+                deadline = time.time() + self.CHUNK_TIMEOUT
+        finally:
+            if target is not None:
+                target.release()
+        return data
+
+    def _next_frame_type(self):
+        # peeked without the lock, chunk streams are checked again under the read lock
+        if self.mode == QueueMode.MPMC:
+            frame_start = self.claim_index
+        elif self._cursor is not None:
+            frame_start = self._cursor.index
+        else:
+            frame_start = self.exe_index
+        return self.mem.buf[self._frame_at(frame_start) + self.FRAME_TYPE_OFFSET]
+
+    def _stream_frame(self):
+        # next frame of this consumer, the caller holds the read lock (or is the SPSC consumer)
+        if self.mode == QueueMode.MPMC:
+            self._reclaim_retired()
+            frame_start = self.claim_index
+        elif self._cursor is not None:
+            frame_start = self._cursor.index
+        else:
+            frame_start = self.exe_index
+        if not self._ring_has_data():
+            return None
+        frame_start = self._frame_at(frame_start)
+        frame_header = self._read_frame_header(frame_start)
+        if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED:
+            return None
+        self._validate_watermark(frame_header, frame_start)
+        return frame_start, frame_header
+
+    def _stream_consume(self, frame_start, frame_size):
+        next_index = self._next_frame_index(frame_start, frame_size)
+        if self.mode == QueueMode.MPMC:
+            self.set_frame_status(frame_start, FRAME_STATUS.RETIRED)
+            self.claim_index = next_index
+            self.claim_counter += 1
+            self._reclaim_retired()
+            return
+        if self._cursor is not None:
+            self._cursor.index = next_index
+            self._cursor.counter += 1
+            self._try_reclaim_cursors()
+            return
+        self._clear_frame(frame_start)
+        self.exe_index = next_index
+        self.update_dfps()
+        self.exe_counter += 1
+        self._notify_space()
+        self._maybe_checkpoint()
+
+    def _read_frame_header(self, frame_start) -> bytearray:
+        return bytearray(self.mem.buf[frame_start:frame_start + self.FRAME_HEADER_SIZE])
+
+    def _frame_data_pointer(self, frame_start):
+        return frame_start + self.FRAME_HEADER_SIZE
+
+    def _read_frame_data(self, frame_start, frame_data_size) -> bytearray:
+        data_pointer = self._frame_data_pointer(frame_start)
+        return bytearray(self.mem.buf[data_pointer:data_pointer + frame_data_size])
+
+    def _copy_ring(self, address, out: memoryview):
+        out[:] = self.mem.buf[address:address + len(out)]
+
+    def _frame_at(self, index):
+        # the frame published at index, a padding frame sends the reader on to the data start
+        if self.mem.buf[index + self.FRAME_TYPE_OFFSET] == FRAME_TYPE.PAD:
+            return self.DATA_START_POINT
+        return index
+
+    def _place_frame(self, alloc_index, frame_size):
+        # where the producer writes the frame, a frame that does not fit before the ring end starts over
+        # at the data start, behind a padding frame. Published with the frame
+        if alloc_index + frame_size <= self.size:
+            return alloc_index
+        pad = self._frame_header(self.size - alloc_index, 0, 0, FRAME_TYPE.PAD)
+        self.mem.buf[alloc_index:alloc_index + self.FRAME_HEADER_SIZE] = pad
+        return self.DATA_START_POINT
+
+    def _frame_span(self, alloc_index, frame_size):
+        # ring bytes a frame put at alloc_index takes, the padding it leaves at the ring end included
+        aligned_size = -(-frame_size // FRAME_ALIGNMENT) * FRAME_ALIGNMENT
+        if alloc_index + frame_size > self.size:
+            return self.size - alloc_index + aligned_size
+        if alloc_index + aligned_size + self.FRAME_HEADER_SIZE > self.size:
+            return self.size - alloc_index
+        return aligned_size
+
+    def _clear_frame(self, frame_start):
+        # reclaimed by the status byte only, the frame bytes stay until overwritten.
+        # durable: recover() replays the frame if it is after the last checkpoint
+        self.mem.buf[frame_start + self.FRAME_STATUS_OFFSET] = FRAME_STATUS.AVAILABLE
+
+    def _next_frame_index(self, frame_start, frame_size):
+        # frames never cross the ring end, a tail too short for a frame header is skipped. Frames start at
+        # multiples of FRAME_ALIGNMENT, the array buffers in them are aligned in the ring
+        next_index = frame_start + -(-frame_size // FRAME_ALIGNMENT) * FRAME_ALIGNMENT
+        if next_index + self.FRAME_HEADER_SIZE > self.size:
+            return self.DATA_START_POINT
+        return next_index
+
+    def _set_checksum(self, checksum: CHECKSUM):
+        self.checksum = checksum
+        self._crc = binascii.crc32
+        if checksum == CHECKSUM.CRC32C:
+            if crc32c is None and self.integrity in (IntegrityPolicy.FULL, IntegrityPolicy.SAMPLED):
+                raise LookupError(f"Queue {self.qid}: frames are checked with CRC32C, the crc32c package is missing")
+            self._crc = crc32c
+
+    def _checksum(self, frame_number, data, prefix=None) -> int:
+        # 0 for the frames the integrity policy does not check
+        if self.integrity == IntegrityPolicy.FULL or \
+                self.integrity == IntegrityPolicy.SAMPLED and frame_number % self.integrity_sample_every == 0:
+            return self._crc(data, 0 if prefix is None else self._crc(prefix))
+        return 0
+
+    def _validate_watermark(self, frame_header, frame_start):
+        if self.integrity == IntegrityPolicy.OFF:
+            return
+        watermark = frame_header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8]
+        if watermark != self.WATER_MARK:
+            self._ctrl.header_errors += 1
+            raise BrokenPipeError(
+                f"{current_milli_time()} - Missing watermark on index:{watermark} @ {frame_start}")
+        if frame_header[self.FRAME_VERSION_OFFSET] != self.FRAME_VERSION:
+            self._ctrl.header_errors += 1
+            raise BrokenPipeError(f"Frame version {frame_header[self.FRAME_VERSION_OFFSET]} @ {frame_start}")
+
+    def _validate_crc32(self, frame_header, frame_data, frame_start, prefix=None):
+        if self.integrity in (IntegrityPolicy.HEADER, IntegrityPolicy.OFF):
+            return
+        frame_number = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little")
+        expected_crc32 = frame_header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4]
+        actual_crc32 = self._checksum(frame_number, frame_data, prefix).to_bytes(4, "little")
+        if expected_crc32 != actual_crc32:
+            self._ctrl.crc_errors += 1
+            print(f"CRC Check: Expected:{expected_crc32},Actual:{actual_crc32}")
+            raise BrokenPipeError(f"Frame CRC32 error at index:{frame_start}, exe count:{self.exe_counter} ")
+
+    def _log_dequeue_frame(self, frame_header):
+        if not self.log.sample(QActionLog.DEQUEUE):
+            return
+        frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+        frame_counter = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little")
+        self._log_sample(QActionLog.DEQUEUE, frame_counter, frame_size - self.FRAME_HEADER_SIZE)
+
+    async def space_available(self, frame: DataFrame, nbytes: int = None):
+        """
+        nbytes: frame.nbytes when the caller has it, frames with containers are encoded to get it
+        """
+        if frame.priority and self.lanes > 1:
+            return await self.lane(frame.priority).space_available(frame, nbytes)
+        frame_size = self._fit_size(frame.nbytes if nbytes is None else nbytes)
+        if self._spill and frame_size <= self._max_frame_size:
+            return True
+        if self._frame_span(self.alloc_index, frame_size) >= self.free_space:
             return False
         return True
 
     async def put(self, df: DataFrame):
-        capacity = (self.size - self.Q_CONTROL_SIZE - self.free_space) / self.size
-        if capacity > self.MAX_CAPACITY:
-            return False
-        body = df.to_byte_arr()
+        if df.priority and self.lanes > 1:
+            return await self.lane(df.priority).put(df)
+        if self.mode == QueueMode.CONFLATE:
+            return await self._put_conflated(df.to_byte_arr(), self._conflate_key_of(df))
+        return await self._put_frame(df)
+
+    def _conflate_key_of(self, df: DataFrame):
+        if self.conflate_key is None or self.conflate_key not in df.fields:
+            return None
+        key = df.fields[self.conflate_key].value
+        return key if isinstance(key, (int, str)) else str(key)
+
+    async def _put_conflated(self, body, key) -> bool:
+        """
+        QueueMode.CONFLATE: the frame always goes in, the oldest unread frames of its key past conflate_depth
+        are dropped first, then the oldest unread frames of any key until it fits
+        """
         frame_size = len(body) + self.FRAME_HEADER_SIZE
-        if frame_size > self.free_space:
+        if frame_size > self._max_frame_size:
+            raise MemoryError(f"Queue {self.qid}: conflating queues keep whole frames, {len(body)} bytes do not fit")
+        while True:
+            await self._conflate(key, frame_size)
+            view = await self.reserve(len(body))
+            if view is not None:
+                break  # else another producer took the space we made, make it again
+        try:
+            view[:] = body
+            self._conflated[key].append((self._reserved[0], self.alloc_counter))
+        except Exception:
+            self.cancel_reserve()
+            raise
+        self.commit(view)
+        return True
+
+    async def _conflate(self, key, frame_size):
+        frames = self._conflated[key]
+        exe_counter = self.exe_counter
+        while frames and frames[0][1] < exe_counter:
+            frames.popleft()  # read already
+        if len(frames) < self.conflate_depth and self._has_space(frame_size):
+            return
+        await self.acquire_read_lock()
+        try:
+            while len(frames) >= self.conflate_depth:
+                self._drop_frame(*frames.popleft())
+            self._skip_dropped()
+            while not self._has_space(frame_size) and self.pending_counter > 0:
+                if not self._drop_frame(self._frame_at(self.exe_index), self.exe_counter):
+                    break
+                self._skip_dropped()
+        finally:
+            self.release_read_lock()
+
+    def _drop_frame(self, frame_start, frame_number) -> bool:
+        # under the read lock, the frame is dropped only if it is still the unread frame we put there
+        if frame_number < self.exe_counter:
+            return False
+        frame_header = self._read_frame_header(frame_start)
+        if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.CREATED or \
+                int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8], "little") != frame_number:
+            return False
+        self.set_frame_status(frame_start, FRAME_STATUS.DROPPED)
+        self._ctrl.dropped_frames += 1
+        return True
+
+    def _skip_dropped(self):
+        # under the read lock, dropped frames at the head give their space back
+        frame_start = self.exe_index
+        skipped = 0
+        pending = self.pending_counter
+        while skipped < pending:
+            frame_start = self._frame_at(frame_start)
+            frame_header = self._read_frame_header(frame_start)
+            if frame_header[self.FRAME_STATUS_OFFSET] != FRAME_STATUS.DROPPED:
+                break
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8], "little")
+            self._clear_frame(frame_start)
+            frame_start = self._next_frame_index(frame_start, frame_size)
+            skipped += 1
+        if skipped == 0:
+            return
+        self.exe_index = frame_start
+        self.update_dfps()
+        self.exe_counter += skipped
+        self._notify_space()
+        self._maybe_checkpoint()
+
+    async def _put_frame(self, df: DataFrame) -> bool:
+        # frames that fit the ring are encoded straight into their reserved slot, array buffers are copied there
+        # from the array
+        if self._spill or df.nbytes + self.FRAME_HEADER_SIZE > self._max_frame_size:
+            return await self._put_body(df.to_byte_arr())
+        view = await self.reserve(df.nbytes)
+        if view is None:
             return False
-        if self.alloc_index == 2765604:
-            pass
-        debug_print(
-            f"Put {current_milli_time()} - Frame size:{frame_size}, free space:{self.free_space}, alloc_index:{self.alloc_index},exe_index:{self.exe_index}")
         try:
-            await self.acquire_write_lock()
-            header = bytearray(self.FRAME_HEADER_SIZE)
-            header[self.FRAME_STATUS_OFFSET] = FRAME_STATUS.CREATED
-            header[self.FRAME_TYPE_OFFSET] = 13  # for luck, not needed for now
-            header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 4] = frame_size.to_bytes(4, "little")
-            header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8] = self.WATER_MARK
-            header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4] = binascii.crc32(body).to_bytes(4, "little")
-            header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 4] = self.frame_counter.to_bytes(4, "little")
-            self.log_enqueue(
-                QLogEntry(frame_counter=self.frame_counter, alloc_index=self.alloc_index, exe_index=self.exe_index,
-                          alloc_counter=self.alloc_counter, exe_counter=self.exe_counter,
-                          pending_counter=self.pending_counter, free_space=self.free_space, capacity=capacity,
-                          data_size=len(body)))
-            self.frame_counter += 1
-            frame = header + body
-            end_of_buffer_space = self.size - self.alloc_index
-            frame_address = self.alloc_index
-            if frame_size >= end_of_buffer_space:  # split the message, end of buffer reached
+            df.write_into(view)
+        except Exception:
+            self.cancel_reserve()
+            raise
+        self.commit(view)
+        return True
+
+    async def _put_body(self, body) -> bool:
+        if self._spill and await self.replay_spill() > 0:
+            return self._spill_frame(body)  # keep FIFO order behind the frames already on disk
+        if len(body) + self.FRAME_HEADER_SIZE > self._max_frame_size:
+            return await self._put_chunked(body)
+        view = await self.reserve(len(body))
+        if view is None:
+            if self._spill:
+                return self._spill_frame(body)
+            return False
+        try:
+            view[:] = body
+        except Exception:
+            self.cancel_reserve()
+            raise
+        self.commit(view)
+        return True
+
+    async def put_many(self, frames: List[DataFrame]) -> int:
+        """
+        Enqueue a batch of frames under one lock, indexes and counters are published once for the whole run.
+        Stops at the first frame that does not fit, returns the number of frames enqueued
+        """
+        if self.lanes > 1:
+            return await self._put_many_lanes(frames)
+        return await self._put_frames(frames)
+
+    async def _put_frames(self, frames: List[DataFrame]) -> int:
+        if self.mode == QueueMode.CONFLATE:
+            for df in frames:
+                await self._put_conflated(df.to_byte_arr(), self._conflate_key_of(df))
+            return len(frames)
+        bodies = [df.to_byte_arr() for df in frames]
+        if len(bodies) == 0:
+            return 0
+        if any([len(body) + self.FRAME_HEADER_SIZE > self._max_frame_size for body in bodies]):
+            written = 0  # a frame larger than half the ring is streamed, the batch goes frame by frame
+            for body in bodies:
+                if not await self._put_body(body):
+                    break
+                written += 1
+            return written
+        if not self._spill:
+            return await self._put_many(bodies)
+        written = 0
+        if await self.replay_spill() == 0:
+            written = await self._put_many(bodies)
+        for body in bodies[written:]:
+            if not self._spill_frame(body):
+                break
+            written += 1
+        return written
+
+    async def _put_many_lanes(self, frames: List[DataFrame]) -> int:
+        # runs of frames going to the same lane are put as one batch
+        written = 0
+        while written < len(frames):
+            lane = self.lane(frames[written].priority)
+            run_end = written + 1
+            while run_end < len(frames) and self.lane(frames[run_end].priority) is lane:
+                run_end += 1
+            lane_written = await lane._put_frames(frames[written:run_end])
+            written += lane_written
+            if written < run_end:
+                break
+        return written
+
+    async def _put_many(self, bodies) -> int:
+        await self._acquire_put_lock()
+        try:
+            self._fits(len(bodies[0]) + self.FRAME_HEADER_SIZE)  # durable queues may commit consumed space first
+            alloc_index = start_alloc_index = self.alloc_index
+            alloc_counter = self.alloc_counter
+            exe_index = self.exe_index  # can only move forward while we write, giving more space
+            used = self._data_size - self.free_space
+            written = 0
+            written_bytes = 0
+            for body in bodies:
+                frame_size = len(body) + self.FRAME_HEADER_SIZE
+                frame_span = self._frame_span(alloc_index, frame_size)
+                if used / self.size > self.MAX_CAPACITY or frame_span >= self._data_size - used:
+                    break
+                header = self._frame_header(frame_size, self._checksum(alloc_counter + written, body),
+                                            alloc_counter + written)
+                frame_address = self._place_frame(alloc_index, frame_size)
+                self._write_ring(self._frame_data_pointer(frame_address), body)
+                self._write_ring(frame_address, header)
+                alloc_index = self._next_frame_index(frame_address, frame_size)
+                used += frame_span
+                written += 1
+                written_bytes += len(body)
+            if written == 0:
+                return 0
+            debug_print(
+                f"Put many {current_milli_time()} - Frames:{written}, bytes:{written_bytes}, alloc_index:{alloc_index},exe_index:{exe_index}")
+            for i, body in enumerate(bodies[:written]):
+                self.log_enqueue(alloc_counter + i, len(body))  # a sample per frame, sizing reads frame sizes
+            self.direction = Q_DIRECTION.NORMAL if alloc_index <= start_alloc_index else Q_DIRECTION.WRAP
+            self.alloc_index = alloc_index
+            self.update_dfps()
+            # publish the whole batch at once
+            self.alloc_counter += written
+            self._notify_data()
+            return written
+        finally:
+            self._release_put_lock()
+
+    async def _put_chunked(self, body) -> bool:
+        """
+        Stream a frame larger than half the ring as chunk frames with consecutive frame numbers,
+        get() reassembles it.
+        The write lock (the producer turn of lock free queues) is held until the last chunk is published,
+        the producer waits for space between chunks.
+        returns False if the first chunk does not fit
+        """
+        chunk_size = self._data_size // self.CHUNK_RATIO - self.FRAME_HEADER_SIZE - self.CHUNK_PREFIX_SIZE
+        if chunk_size <= 0:
+            raise MemoryError(f"Queue {self.qid}: queue too small to stream a {len(body)} bytes frame")
+        await self._acquire_put_lock()
+        try:
+            if not self._fits(chunk_size + self.CHUNK_PREFIX_SIZE + self.FRAME_HEADER_SIZE):
+                return False
+            prefix = self.alloc_counter.to_bytes(8, "little") + len(body).to_bytes(8, "little")
+            frame_type = FRAME_TYPE.CHUNK_FIRST
+            with memoryview(body) as body_view:
+                for offset in range(0, len(body), chunk_size):
+                    payload = body_view[offset:offset + chunk_size]
+                    frame_size = len(payload) + self.CHUNK_PREFIX_SIZE + self.FRAME_HEADER_SIZE
+                    deadline = time.time() + self.CHUNK_TIMEOUT
+                    while not self._fits(frame_size):
+                        if time.time() > deadline:
+                            raise TimeoutError(f"Queue {self.qid}: chunk stream stalled at {offset} of {len(body)} bytes")
+                        await self.wait_space(frame_size - self.FRAME_HEADER_SIZE, self.WAIT_PARK_TIMEOUT)
+                    self._write_chunk(prefix, payload, frame_type)
+                    frame_type = FRAME_TYPE.CHUNK
+            return True
+        finally:
+            self._release_put_lock()
+
+    def _write_chunk(self, prefix, payload, frame_type: FRAME_TYPE):
+        frame_size = len(prefix) + len(payload) + self.FRAME_HEADER_SIZE
+        frame_address = self._place_frame(self.alloc_index, frame_size)
+        frame_number = self.alloc_counter
+        data_pointer = self._frame_data_pointer(frame_address)
+        self._write_ring(data_pointer, prefix)
+        self._write_ring(data_pointer + len(prefix), payload)
+        header = self._frame_header(frame_size, self._checksum(frame_number, payload, prefix), frame_number, frame_type)
+        self.log_enqueue(frame_number, frame_size - self.FRAME_HEADER_SIZE)
+        self._write_ring(frame_address, header)
+        next_index = self._next_frame_index(frame_address, frame_size)
+        self.direction = Q_DIRECTION.NORMAL if next_index <= self.alloc_index else Q_DIRECTION.WRAP
+        self.alloc_index = next_index
+        self.update_dfps()
+        self.alloc_counter += 1  # published chunk by chunk, the consumer copies it out while we write the next
+        self._notify_data()
+
+    def _spill_frame(self, body) -> bool:
+        if len(body) + self.FRAME_HEADER_SIZE > self._max_frame_size:
+            return False  # could never be replayed
+        self._spill.append(body)
+        self._ctrl.spilled_frames += 1
+        self._ctrl.spilled_bytes += len(body)
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.ensure_future(self._replay_spilled())
+        return True
+
+    async def _replay_spilled(self):
+        # background replay, spilled frames go in as consumers free space, not on the producer next put
+        while await self.replay_spill() > 0:
+            await self.wait_space(len(self._spill.peek()), self.WAIT_PARK_TIMEOUT)
+
+    async def replay_spill(self) -> int:
+        """
+        OverflowPolicy.SPILL: move spilled frames back into the queue while they fit, oldest first.
+        returns the number of frames still on disk
+        """
+        spill = self._spill
+        async with self._replay_lock:
+            while spill.pending_frames > 0:
+                body = spill.peek()
+                view = await self.reserve(len(body))
+                if view is None:
+                    break
+                view[:] = body
+                self.commit(view)
+                spill.pop()
+                self._ctrl.spilled_frames -= 1
+                self._ctrl.spilled_bytes -= len(body)
+        return spill.pending_frames
+
+    async def drain_spill(self, timeout: float = None) -> bool:
+        """
+        Replay spilled frames until none is left on disk, returns False on timeout
+        """
+        start = time.time()
+        for lane in self._lanes:
+            if not await lane.drain_spill(timeout):
+                return False
+        while self._spill and await self.replay_spill() > 0:
+            wait_timeout = None if timeout is None else timeout - (time.time() - start)
+            if not await self.wait_space(len(self._spill.peek()), wait_timeout):
+                return False
+        return True
+
+    async def reserve(self, nbytes: int) -> Union[memoryview, None]:
+        """
+        Zero copy enqueue: returns a writable view of nbytes over the next frame data slot.
+        Fill it and publish with commit(view), or give the slot back with cancel_reserve().
+        The write lock is held until then, a slot that does not fit before the ring end starts at the data start.
+        returns None if the queue has no room for the frame
+        """
+        if self._reserved is not None:
+            raise BufferError(f"Queue {self.qid}: commit the reserved frame before reserving the next one")
+        frame_size = nbytes + self.FRAME_HEADER_SIZE
+        await self._acquire_put_lock()
+        if not self._fits(frame_size):
+            self._release_put_lock()
+            return None
+        frame_address = self._place_frame(self.alloc_index, frame_size)
+        data_pointer = self._frame_data_pointer(frame_address)
+        view = self.mem.buf[data_pointer:data_pointer + nbytes]
+        self._reserved = (frame_address, view)
+        return view
+
+    def commit(self, view: memoryview, nbytes: int = None):
+        """
+        Publish the frame written into a reserve() view, nbytes can trim the frame to the bytes actually written
+        """
+        if self._reserved is None or self._reserved[1] is not view:
+            raise BufferError(f"Queue {self.qid}: view was not reserved on this queue")
+        frame_address, _ = self._reserved
+        if nbytes is None:
+            nbytes = len(view)
+        if nbytes > len(view):
+            raise IndexError(f"Queue {self.qid}: commit of {nbytes} bytes over a {len(view)} bytes reservation")
+        try:
+            frame_size = nbytes + self.FRAME_HEADER_SIZE
+            debug_print(
+                f"Put {current_milli_time()} - Frame size:{frame_size}, free space:{self.free_space}, alloc_index:{self.alloc_index},exe_index:{self.exe_index}")
+            frame_number = self.alloc_counter  # queue wide sequence, the producer side is ours until published
+            header = self._frame_header(frame_size, self._checksum(frame_number, view[:nbytes]), frame_number)
+            self.log_enqueue(frame_number, nbytes)
+            self._write_ring(frame_address, header)
+            next_index = self._next_frame_index(frame_address, frame_size)
+            if next_index <= self.alloc_index:  # end of buffer reached
                 debug_print("Q wrap")
-                self.mem.buf[frame_address:frame_address + end_of_buffer_space] = frame[0:end_of_buffer_space]
-                size_left = frame_size - end_of_buffer_space
-                self.mem.buf[self.DATA_START_POINT:self.DATA_START_POINT + size_left] = frame[end_of_buffer_space:]
-                self.alloc_index = self.DATA_START_POINT + size_left
                 self.direction = Q_DIRECTION.NORMAL
             else:
-                self.mem.buf[frame_address:frame_address + frame_size] = frame
-                self.alloc_index = self.alloc_index + frame_size
                 self.direction = Q_DIRECTION.WRAP
+            self.alloc_index = next_index
             self.update_dfps()
+            # publish, frame bytes and alloc_index are in place before the consumer can see the new count
             self.alloc_counter += 1
-            return True
+            self._notify_data()
         finally:
-            self.release_write_lock()
+            self._reserved = None
+            view.release()
+            self._release_put_lock()
+
+    def cancel_reserve(self):
+        if self._reserved is None:
+            return
+        _, view = self._reserved
+        self._reserved = None
+        view.release()
+        self._release_put_lock()
+
+    def _frame_header(self, frame_size, crc32, frame_number, frame_type=FRAME_TYPE.WHOLE) -> bytearray:
+        header = bytearray(self.FRAME_HEADER_SIZE)
+        header[self.FRAME_STATUS_OFFSET] = FRAME_STATUS.CREATED
+        header[self.FRAME_TYPE_OFFSET] = frame_type
+        header[self.FRAME_VERSION_OFFSET] = self.FRAME_VERSION
+        header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 8] = frame_size.to_bytes(8, "little")
+        header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8] = self.WATER_MARK
+        header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4] = crc32.to_bytes(4, "little")
+        header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 8] = frame_number.to_bytes(8, "little")
+        header[self.FRAME_PRIORITY_OFFSET] = self.priority
+        return header
+
+    def _write_ring(self, address, data):
+        self.mem.buf[address:address + len(data)] = data
+
+    async def wait_data(self, timeout: float = None) -> bool:
+        """
+        Park until a frame can be dequeued, returns False on timeout
+        """
+        def ready():
+            self.follow(consumer=True)
+            return self._has_data()
+
+        return await self._wait(ready, self._data_event, "data_waiters", timeout, [self, *self._lanes])
+
+    async def wait_space(self, nbytes: int, timeout: float = None, priority: int = None) -> bool:
+        """
+        Park until a frame of nbytes data fits in the queue (the lane of the priority), returns False on timeout
+        """
+        if priority and self.lanes > 1:
+            return await self.lane(priority).wait_space(nbytes, timeout)
+        frame_size = self._fit_size(nbytes)
+        has_space = self._fits if self.mode == QueueMode.BROADCAST else self._has_space
+
+        def ready():
+            self._follow_producer()
+            return has_space(frame_size)
+
+        return await self._wait(ready, self._space_event, "space_waiters", timeout)
+
+    def _has_data(self):
+        return any([lane._has_data() for lane in self._lanes]) or self._ring_has_data()
+
+    def _ring_has_data(self):
+        if self.mode == QueueMode.MPMC:
+            return self.unclaimed_counter > 0
+        if self.mode == QueueMode.BROADCAST:
+            if self._cursor is None:
+                raise LookupError(f"Queue {self.qid}: broadcast queue opened without a reader")
+            return self._cursor.counter != self._ctrl.alloc_counter
+        return self.pending_counter > 0
+
+    def _has_space(self, frame_size):
+        capacity = (self._data_size - self.free_space) / self.size
+        # a full ring would read as empty
+        return capacity <= self.MAX_CAPACITY and self._frame_span(self.alloc_index, frame_size) < self.free_space
+
+    def _fit_size(self, nbytes):
+        # frames larger than half the ring are streamed, only a chunk has to fit at a time
+        frame_size = nbytes + self.FRAME_HEADER_SIZE
+        if frame_size > self._max_frame_size:
+            return self._data_size // self.CHUNK_RATIO
+        return frame_size
+
+    def _fits(self, frame_size):
+        if self._ctrl.generation != self.generation:
+            self._follow_producer()  # resized, callers hold the write lock (or are the SPSC producer)
+        if self._has_space(frame_size):
+            return True
+        if self.mode == QueueMode.BROADCAST:
+            self._try_reclaim_cursors()  # a reclaim lost to a concurrent one
+            return self._has_space(frame_size)
+        if self._checkpoints is not None and not self.lock_free and self.exe_index != self._committed_exe_index:
+            self._try_checkpoint()  # durable: hand the consumed space over now
+            return self._has_space(frame_size)
+        return False
+
+    async def _wait(self, ready, event: QueueEvent, waiters_field, timeout, queues=None):
+        start = time.time()
+        while True:
+            if ready():
+                return True
+            elapsed = time.time() - start
+            if timeout is not None and elapsed >= timeout:
+                return False
+            if elapsed * 10 ** 6 < self.spin_us:
+                await asyncio.sleep(0)
+                continue
+            park_timeout = self.WAIT_PARK_TIMEOUT if event else self.WAIT_POLL_INTERVAL
+            if timeout is not None:
+                park_timeout = min(park_timeout, timeout - elapsed)
+            if not event:
+                await asyncio.sleep(park_timeout)
+                continue
+            for q in queues or [self]:
+                setattr(q._ctrl, waiters_field, 1)
+            if ready():  # published between the check and raising the flag
+                return True
+            await event.wait(park_timeout)
+
+    def _notify_data(self):
+        if self._data_event and self._ctrl.data_waiters:
+            self._ctrl.data_waiters = 0
+            self._data_event.notify()
+
+    def _notify_space(self):
+        if self._space_event and self._ctrl.space_waiters:
+            self._ctrl.space_waiters = 0
+            self._space_event.notify()
 
     def print(self):
         return
         # parser = FrameParser(self.mem.buf, self.exe_index)
         # parser.print()
 
+    def close(self):
+        for lane in self._lanes:
+            lane.close()
+        self.release()
+        self.cancel_reserve()
+        self.release_read_lock()
+        self._release_put_lock()
+        for event in (self._data_event, self._space_event):
+            if event:
+                event.close()
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            self._replay_task = None
+        if self._spill:
+            if self._spill.pending_frames > 0:
+                print(f"Warning: queue {self.qid} closed with {self._spill.pending_frames} frames spilled to disk")
+                self._ctrl.spilled_frames -= self._spill.pending_frames
+                self._ctrl.spilled_bytes -= self._spill.pending_bytes
+            self._spill.close()
+        if self._checkpoints is not None:
+            self.mem.flush(0, self._checkpoint_offset)
+            self._checkpoints = None
+        self._ctrl = None
+        self._cursor = None
+        self._cursors = None
+        self.mem.close()
+        for mem in self._retired:
+            mem.close()
+        self.log.close()
+
+    def unlink(self):
+        for lane in self._lanes:
+            lane.unlink()
+        self.mem.unlink()
+        for mem in self._retired:
+            mem.unlink()
+        self._retired = []
+        self.log.unlink()
+        for event in (self._data_event, self._space_event):
+            if event:
+                event.unlink()
+
+    def shm_files(self) -> Dict[str, int]:
+        """
+        Files the queue keeps in shared memory, path to size: segments, action log, locks and wait events.
+        Durable queue files are left out, they outlive the pipe
+        """
+        files = {}
+        if not self.durable_path:
+            files[memory_path(self.mem)] = self.mem.size
+        for mem in self._retired:
+            files[memory_path(mem)] = mem.size
+        if self.log.mem:
+            files[memory_path(self.log.mem)] = self.log.mem.size
+        lock_names = [self.w_lock_memory_name, f"{self.memory_name}_rlock"]
+        if self.mode == QueueMode.BROADCAST:
+            lock_names += [f"{self.memory_name}_rlock_{i}" for i in range(len(self.readers))]
+        for lock_name in lock_names:
+            files[os.path.join(LOCK_DIR, lock_name)] = 0
+        for event in (self._data_event, self._space_event):
+            if event:
+                files[event.path] = 0
+        for lane in self._lanes:
+            files.update(lane.shm_files())
+        return files
+
     def get_frame_status(self, frame_start):
         address = frame_start + self.FRAME_STATUS_OFFSET
         return int.from_bytes(self.mem.buf[address:address + 1], "little")
@@ -348,97 +1972,108 @@ class MemQueue:
 
     def get_frame_size(self, frame_start):
         address = frame_start + self.FRAME_SIZE_OFFSET
-        return int.from_bytes(self.mem.buf[address:address + 4], "little")
+        return int.from_bytes(self.mem.buf[address:address + 8], "little")
 
     def set_frame_size(self, frame_start, size):
         address = frame_start + self.FRAME_SIZE_OFFSET
-        self.mem.buf[address:address + 4] = size.to_bytes(4, "little")
+        self.mem.buf[address:address + 8] = size.to_bytes(8, "little")
 
     async def acquire_read_lock(self):
-        self.r_lock_mem = await self.acquire_lock(self.r_lock_memory_name)
+        self.r_lock = await self.acquire_lock(self.r_lock_memory_name)
 
     async def acquire_write_lock(self):
-        self.w_lock_mem = await self.acquire_lock(self.w_lock_memory_name)
+        self.w_lock = await self.acquire_lock(self.w_lock_memory_name)
 
     async def acquire_lock(self, lock_name):
+        # locks are held for a few index updates, a waiter retries right away and backs off while it is contended
         start = time.time()
-        attempts = 0
+        interval = self.LOCK_SPIN_INTERVAL
         while True:
-            attempts += 1
-            try:
-                lock_mem = shared_memory.SharedMemory(name=lock_name, create=True, size=1)
-                return lock_mem
-            except FileExistsError:
-                await asyncio.sleep(self.LOCK_CHECK_INTERVAL)
-            elapsed = time.time() - start
-            if elapsed > self.LOCK_TIMEOUT + attempts * self.LOCK_CHECK_INTERVAL / 2:
+            lock = self.try_acquire_lock(lock_name)
+            if lock:
+                return lock
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.LOCK_CHECK_INTERVAL)
+            if time.time() - start > self.LOCK_TIMEOUT:
                 raise TimeoutError
 
+    @staticmethod
+    def try_acquire_lock(lock_name):
+        # the lock is the file existence, exclusive create is atomic across processes
+        lock_path = os.path.join(LOCK_DIR, lock_name)
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return lock_path
+        except FileExistsError:
+            return None
+
+    async def _acquire_put_lock(self):
+        # lock free queues take no write lock, but a frame or a chunk stream is still written by one task at a time
+        if self.lock_free:
+            await self._put_lock.acquire()
+            self._put_locked = True
+        else:
+            await self.acquire_write_lock()
+
+    def _release_put_lock(self):
+        if self._put_locked:
+            self._put_locked = False
+            self._put_lock.release()
+        self.release_write_lock()
+
     def release_read_lock(self):
-        if not self.r_lock_mem:
+        if not self.r_lock:
             return
-        self.r_lock_mem.close()
-        self.r_lock_mem = None
+        os.unlink(self.r_lock)
+        self.r_lock = None
 
     def release_write_lock(self):
-        if not self.w_lock_mem:
+        if not self.w_lock:
             return
-        self.w_lock_mem.close()
-        self.w_lock_mem = None
-
-    def get_32b_int(self, address):
-        return int.from_bytes(self.mem.buf[address:address + 4], "little")
-
-    def set_32b_int(self, address, value):
-        self.mem.buf[address:address + 4] = value.to_bytes(4, "little")
-
-    def get_64b_int(self, address):
-        return int.from_bytes(self.mem.buf[address:address + 8], "little")
-
-    def set_64b_int(self, address, value):
-        self.mem.buf[address:address + 8] = value.to_bytes(8, "little")
-
-    def get_32b_float(self, address):
-        return struct.unpack("f", self.mem.buf[address:address + 4])[0]
-
-    def set_32b_float(self, address, value):
-        self.mem.buf[address:address + 4] = bytearray(struct.pack('f', value))
+        os.unlink(self.w_lock)
+        self.w_lock = None
 
     @property
     def id(self):
         return self.qid
 
+    @property
+    def lock_free(self):
+        # SPSC: alloc side (alloc_index, alloc_counter) is written by the producer only and exe side
+        # (exe_index, exe_counter) by the consumer only, each side publishes its counter after its index
+        return self.mode == QueueMode.SPSC
+
     @property
     def dfps_interval_ms(self):
-        return self.get_32b_int(self.DFPS_CALC_INTERVAL)
+        return self._ctrl.dfps_interval_ms
 
     @dfps_interval_ms.setter
     def dfps_interval_ms(self, val):
-        self.set_32b_int(self.DFPS_CALC_INTERVAL, val)
+        self._ctrl.dfps_interval_ms = val
 
     @property
     def last_dfps_calc_time(self):
-        return self.get_64b_int(self.LAST_DFPS_CALC_TIME)
+        return self._ctrl.last_dfps_calc_time
 
     @last_dfps_calc_time.setter
     def last_dfps_calc_time(self, val):
-        self.set_64b_int(self.LAST_DFPS_CALC_TIME, val)
+        self._ctrl.last_dfps_calc_time = val
 
     @property
     def dfps_last_alloc_counter(self):
-        return self.get_32b_int(self.DFPS_LAST_ALLOC_COUNTER)
+        return self._ctrl.dfps_last_alloc_counter
 
     @dfps_last_alloc_counter.setter
     def dfps_last_alloc_counter(self, val):
-        self.set_32b_int(self.DFPS_LAST_ALLOC_COUNTER, val)
+        self._ctrl.dfps_last_alloc_counter = val
 
     @property
     def dfps_last_exe_counter(self):
-        return self.get_32b_int(self.DFPS_LAST_EXE_COUNTER)
+        return self._ctrl.dfps_last_exe_counter
 
     @dfps_last_exe_counter.setter
     def dfps_last_exe_counter(self, val):
-        self.set_32b_int(self.DFPS_LAST_EXE_COUNTER, val)
+        self._ctrl.dfps_last_exe_counter = val
 
     @property
     def dfps_in(self):
@@ -452,62 +2087,102 @@ class MemQueue:
 
     @property
     def free_space(self):
-        if self.alloc_index < self.exe_index:
-            return self.exe_index - self.alloc_index
+        alloc_index = self._ctrl.alloc_index
+        exe_index = self._ctrl.exe_index if self._checkpoints is None else self._committed_exe_index
+        if alloc_index < exe_index:
+            return exe_index - alloc_index
         else:
-            return self._data_size - (self.alloc_index - self.exe_index)
+            return self._data_size - (alloc_index - exe_index)
 
     @property
     def _data_size(self):
         return self.size - self.Q_CONTROL_SIZE
 
+    @property
+    def _max_frame_size(self):
+        # frames are contiguous, a whole frame up to this size fits an empty ring wherever its indexes are.
+        # Larger frames are streamed
+        return (self._data_size - self.FRAME_HEADER_SIZE) // 2
+
     @property
     def alloc_index(self):
-        return int.from_bytes(self.mem.buf[self.ALLOC_POINTER:self.ALLOC_POINTER + 4], "little")
+        return self._ctrl.alloc_index
 
     @alloc_index.setter
     def alloc_index(self, val):
-        self.mem.buf[self.ALLOC_POINTER:self.ALLOC_POINTER + 4] = val.to_bytes(4, "little")
+        self._ctrl.alloc_index = val
 
     @property
     def exe_index(self):
-        return int.from_bytes(self.mem.buf[self.EXE_POINTER:self.EXE_POINTER + 4], "little")
+        return self._ctrl.exe_index
 
     @exe_index.setter
     def exe_index(self, val):
-        self.mem.buf[self.EXE_POINTER:self.EXE_POINTER + 4] = val.to_bytes(4, "little")
+        self._ctrl.exe_index = val
 
     @property
     def exe_counter(self):
-        return int.from_bytes(self.mem.buf[self.EXE_COUNTER_POINTER:self.EXE_COUNTER_POINTER + 4], "little")
+        return self._ctrl.exe_counter
 
     @exe_counter.setter
     def exe_counter(self, val):
-        self.mem.buf[self.EXE_COUNTER_POINTER:self.EXE_COUNTER_POINTER + 4] = val.to_bytes(4, "little")
+        self._ctrl.exe_counter = val
 
     @property
     def alloc_counter(self):
-        return int.from_bytes(self.mem.buf[self.ALLOC_COUNTER_POINTER:self.ALLOC_COUNTER_POINTER + 4], "little")
+        return self._ctrl.alloc_counter
 
     @alloc_counter.setter
     def alloc_counter(self, val):
-        self.mem.buf[self.ALLOC_COUNTER_POINTER:self.ALLOC_COUNTER_POINTER + 4] = val.to_bytes(4, "little")
+        self._ctrl.alloc_counter = val
+
+    @property
+    def claim_index(self):
+        return self._ctrl.claim_index
+
+    @claim_index.setter
+    def claim_index(self, val):
+        self._ctrl.claim_index = val
+
+    @property
+    def claim_counter(self):
+        return self._ctrl.claim_counter
+
+    @claim_counter.setter
+    def claim_counter(self, val):
+        self._ctrl.claim_counter = val
 
     @property
     def pending_counter(self):
-        return self.alloc_counter - self.exe_counter
+        return self._ctrl.alloc_counter - self._ctrl.exe_counter
+
+    def pending_for(self, reader: str) -> int:
+        """
+        Frames pending for the given reader, broadcast queues keep a count per reader
+        """
+        lanes_pending = sum([lane.pending_for(reader) for lane in self._lanes])
+        if self.mode != QueueMode.BROADCAST:
+            return self.pending_counter + lanes_pending
+        return self._ctrl.alloc_counter - self._cursors[self.readers.index(reader)].counter + lanes_pending
+
+    def has_reader(self, proc_id: str) -> bool:
+        return self.to_p == proc_id or proc_id in self.readers
+
+    @property
+    def unclaimed_counter(self):
+        return self._ctrl.alloc_counter - self._ctrl.claim_counter
 
     @property
     def direction(self):
-        return int.from_bytes(self.mem.buf[self.DIRECTION_POINTER:self.DIRECTION_POINTER + 1], "little")
+        return self._ctrl.direction
 
     @direction.setter
     def direction(self, val: Q_DIRECTION):
-        self.mem.buf[self.DIRECTION_POINTER:self.DIRECTION_POINTER + 1] = int(val).to_bytes(1, "little")
+        self._ctrl.direction = val
 
     @property
     def status(self):
-        return int.from_bytes(self.mem.buf[self.STATUS_POINTER:self.STATUS_POINTER + 1], "little")
+        return self._ctrl.status
 
     @property
     def w_lock_memory_name(self):
@@ -515,11 +2190,13 @@ class MemQueue:
 
     @property
     def r_lock_memory_name(self):
+        if self._cursor is not None:
+            return f"{self.memory_name}_rlock_{self.readers.index(self.reader)}"  # readers lock their own cursor
         return f"{self.memory_name}_rlock"
 
     @status.setter
     def status(self, val: LOCK_STATUS):
-        self.mem.buf[self.STATUS_POINTER:self.STATUS_POINTER + 1] = int(val).to_bytes(1, "little")
+        self._ctrl.status = val
 
     @property
     def queue_def(self):
@@ -528,7 +2205,26 @@ class MemQueue:
                         to_p=self.to_p,
                         id=self.qid,
                         size=self.size,
-                        host=self.host)
+                        host=self.host,
+                        mode=self.mode,
+                        log_sample_every=self.log.sample_every,
+                        shared_log=self.log.mem is not None,
+                        overflow=self.overflow,
+                        spill_dir=self.spill_dir,
+                        durable_path=self.durable_path,
+                        checkpoint_interval_ms=self.checkpoint_interval_ms,
+                        spin_us=self.spin_us,
+                        readers=self.readers,
+                        lanes=self.lanes,
+                        generation=self.generation,
+                        burst_window_ms=self.burst_window_ms,
+                        integrity=self.integrity,
+                        integrity_sample_every=self.integrity_sample_every,
+                        conflate_depth=self.conflate_depth,
+                        conflate_key=self.conflate_key,
+                        page_backing=self.page_backing,
+                        prefault=self.prefault,
+                        numa_node=self.numa_node)
 
     @property
     def status_str(self):
@@ -544,4 +2240,13 @@ class MemQueue:
                                      exe_index=PerformanceMetric(value=self.exe_index),
                                      free_space=PerformanceMetric(value=self.free_space),
                                      size=PerformanceMetric(value=self._data_size),
+                                     spilled_frames=PerformanceMetric(value=self._ctrl.spilled_frames),
+                                     spilled_bytes=PerformanceMetric(metric_type=MetricType.STORAGE,
+                                                                     value=self._ctrl.spilled_bytes),
+                                     crc_errors=PerformanceMetric(
+                                         value=sum([q._ctrl.crc_errors for q in [self, *self._lanes]])),
+                                     header_errors=PerformanceMetric(
+                                         value=sum([q._ctrl.header_errors for q in [self, *self._lanes]])),
+                                     dropped_frames=PerformanceMetric(
+                                         value=sum([q._ctrl.dropped_frames for q in [self, *self._lanes]])),
                                      q_id=self.id)
@@ -0,0 +1,128 @@
+import ctypes
+import mmap
+import os
+import platform
+from multiprocessing import shared_memory
+from typing import List, Union
+
+import numpy as np
+
+from ..types import PageBacking
+from .file_memory import FileMemory
+
+SHM_DIR = "/dev/shm"
+MPOL_BIND = 2
+MPOL_MF_MOVE = 2  # pages already faulted in are moved to the node
+SYS_MBIND = {"x86_64": 237, "aarch64": 235}
+
+
+def memory_path(mem) -> str:
+    """
+    File behind a SharedMemory or FileMemory segment
+    """
+    return mem.name if os.path.isabs(mem.name) else os.path.join(SHM_DIR, mem.name)
+
+
+def hugetlbfs_mount() -> Union[str, None]:
+    """
+    First hugetlbfs mount point, None if the host has no huge pages mounted
+    """
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "hugetlbfs":
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def huge_page_size() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("Hugepagesize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2 * 1024 * 1024
+
+
+def numa_node_cpus(numa_node: int) -> List[int]:
+    try:
+        with open(f"/sys/devices/system/node/node{numa_node}/cpulist") as f:
+            cpu_list = f.read().strip()
+    except OSError:
+        raise LookupError(f"NUMA node {numa_node} not found")
+    cpus = []
+    for cpu_range in cpu_list.split(","):
+        first, _, last = cpu_range.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def pin_to_numa_node(numa_node: int):
+    """
+    Run the current process on the NUMA node CPUs only
+    """
+    os.sched_setaffinity(0, numa_node_cpus(numa_node))
+
+
+def bind_numa_node(mm: mmap.mmap, numa_node: int):
+    """
+    mbind the mapping pages to the NUMA node, for shared memory the policy is kept by the segment
+    """
+    syscall_number = SYS_MBIND.get(platform.machine())
+    if syscall_number is None:
+        raise LookupError(f"NUMA binding is not supported on {platform.machine()}")
+    if not 0 <= numa_node < 64:
+        raise ValueError(f"NUMA node {numa_node} out of range")
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+    node_mask = ctypes.c_ulong(1 << numa_node)
+    address = ctypes.addressof(ctypes.c_char.from_buffer(mm))  # the mapping stays open, the address holds
+    if libc.syscall(ctypes.c_long(syscall_number), ctypes.c_void_p(address), ctypes.c_ulong(len(mm)),
+                    ctypes.c_int(MPOL_BIND), ctypes.byref(node_mask), ctypes.c_ulong(65),
+                    ctypes.c_uint(MPOL_MF_MOVE)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"mbind to NUMA node {numa_node}: {os.strerror(errno)}")
+
+
+def place_memory(mm: mmap.mmap, numa_node: int = None, prefault: bool = False):
+    """
+    Page placement of a new mapping: NUMA node, pages faulted in up front. Prefault writes zeros, new segments only
+    """
+    if numa_node is not None:
+        bind_numa_node(mm, numa_node)  # before the pages are touched, they are allocated on the node
+    if prefault:
+        pages = np.frombuffer(mm, dtype=np.uint8)
+        pages[::mmap.PAGESIZE] = 0
+        del pages
+
+
+def open_memory(name: str, create: bool, size: int, page_backing: PageBacking = PageBacking.DEFAULT,
+                numa_node: int = None, prefault: bool = False):
+    """
+    Shared memory segment with its page placement, SharedMemory interface (name, size, buf, close, unlink).
+    PageBacking.HUGETLBFS segments are files on the hugetlbfs mount, sized up to a huge page multiple
+    """
+    if page_backing == PageBacking.HUGETLBFS:
+        mount = hugetlbfs_mount()
+        if mount is None:
+            raise LookupError("No hugetlbfs mount, huge pages are not set up on this host")
+        page_size = huge_page_size()
+        mem = FileMemory(os.path.join(mount, name.lstrip("/")), create=create, size=-(-size // page_size) * page_size)
+    else:
+        mem = shared_memory.SharedMemory(name=name, create=create, size=size)
+    try:
+        if page_backing == PageBacking.TRANSPARENT:
+            mem._mmap.madvise(mmap.MADV_HUGEPAGE)  # per mapping, attached processes advise their own
+        if create:
+            place_memory(mem._mmap, numa_node, prefault)
+    except Exception:
+        mem.close()
+        if create:
+            mem.unlink()
+        raise
+    return mem
@@ -18,6 +18,7 @@ class PipeFrameFuture(asyncio.Future):
 
 
 class Pipe(Processor, Worker):
+    SINK_WAIT_TIMEOUT = 1  # sec, the baby sitter checks for completion at least this often
 
     def __init__(self, name):
         Processor.__init__(self, name)
@@ -101,33 +102,39 @@ class Pipe(Processor, Worker):
                         raise BrokenPipeError("Completed frame not found on log")
                     self.executing_frames[frame.pipe_execution_id].set_result(frame)
                     continue
-            await asyncio.sleep(0)
+            await self.sink_q.wait_data(timeout=self.SINK_WAIT_TIMEOUT)
 
     @staticmethod
-    def _generate_pipe_frame(data, d_type: entities.DType = None):
+    def _generate_pipe_frame(data, d_type: entities.DType = None, priority: int = None):
         if isinstance(data, entities.DataFrame):
             frame = data
         else:
             frame = entities.DataFrame(data)
         if frame.pipe_execution_id is None:
             frame.set_pipe_exe_id()
+        if priority is not None:
+            frame.priority = priority
         return frame
 
-    async def emit(self, data, d_type: entities.DType = None):
+    async def emit(self, data, d_type: entities.DType = None, priority: int = None):
         if self.status != types.PipeExecutionStatus.RUNNING:
             raise BrokenPipeError("Pipe is not running: data ingestion blocked")
-        frame = self._generate_pipe_frame(data, d_type)
+        frame = self._generate_pipe_frame(data, d_type, priority)
         success = await super().emit(frame)
         return success
 
-    async def emit_sync(self, data, d_type: entities.DType = None, timeout_ms=500):
+    async def emit_sync(self, data, d_type: entities.DType = None, timeout_ms=500, priority: int = None):
+        """
+        Emit and wait for the pipe result. With priority, the frame (and the frames emitted for it)
+        go through the higher queue lanes, ahead of frames pending on the lower ones
+        """
         if timeout_ms < 0:
             timeout_sec = None
         else:
             timeout_sec = timeout_ms / 1000
         if self.status != types.PipeExecutionStatus.RUNNING:
             raise BrokenPipeError("Pipe is not running: data ingestion blocked")
-        frame = self._generate_pipe_frame(data, d_type)
+        frame = self._generate_pipe_frame(data, d_type, priority)
         self.executing_frames[frame.pipe_execution_id] = PipeFrameFuture()
         success = await super().emit_sync(frame)
         if success:
@@ -174,9 +181,38 @@ class Pipe(Processor, Worker):
     def _sink_q_def(self):
         sink: APIQueue = APIQueue(name="pipe_sink_q", from_p="*", to_p=self.processor_def.id,
                                   size=self.input_buffer_size,
-                                  id=SINK_QUEUE_ID)
+                                  id=SINK_QUEUE_ID,
+                                  lanes=self._lanes([self]),
+                                  lane_size=self.processor_def.settings.lane_buffer_size)
         return sink
 
+    @staticmethod
+    def _queue_sizing(readers: list) -> dict:
+        bursts = [p.processor_def.settings.buffer_burst_ms for p in readers if p.processor_def.settings.buffer_burst_ms]
+        if not bursts:
+            return {}
+        return {"burst_window_ms": max(bursts), "shared_log": True}  # the node sizes it from the enqueue log
+
+    @staticmethod
+    def _placement(readers: list) -> dict:
+        # one queue memory for all readers, its pages can only follow settings the readers share
+        placements = {(p.processor_def.settings.page_backing, p.processor_def.settings.numa_node) for p in readers}
+        if len(placements) > 1:
+            raise ValueError(f"Readers {[p.id for p in readers]} of one queue set different page_backing or numa_node")
+        page_backing, numa_node = placements.pop()
+        return {"page_backing": page_backing, "prefault": page_backing != types.PageBacking.DEFAULT,
+                "numa_node": numa_node}
+
+    @staticmethod
+    def _lanes(readers: list) -> int:
+        # unprioritized frames on lane 0 and a lane for each priority level the readers serve
+        return max([p.processor_def.settings.lanes or max(p.processor_def.settings.priority + 1, 1) for p in readers])
+
+    @staticmethod
+    def _lane_size(readers: list):
+        sizes = [p.processor_def.settings.lane_buffer_size for p in readers if p.processor_def.settings.lane_buffer_size]
+        return max(sizes) if sizes else None
+
     @property
     def pipe_def(self):
         pipe_api_def = types.APIPipe(name=self.name, id=self.name, root=self.processor_def, sink=self._sink_q_def)
@@ -184,14 +220,47 @@ class Pipe(Processor, Worker):
         def map_proc(processor: Processor):
             proc_def = processor.processor_def
             pipe_api_def.processors[proc_def.id] = proc_def
+            # conflating children keep their own CONFLATE queue, a broadcast queue does not drop frames per reader
+            local_children = [child for child in processor.children
+                              if not child.processor_def.settings.host and not child.processor_def.settings.conflate]
+            if len(local_children) > 1:
+                # fan out: frames are serialized once, each child reads through its own cursor
+                qid = f"{processor.id}->*"
+                q_def = types.APIQueue(id=qid, name=qid, from_p=processor.id, to_p="*",
+                                       size=max([child.input_buffer_size for child in local_children]),
+                                       mode=types.QueueMode.BROADCAST,
+                                       readers=[child.id for child in local_children],
+                                       lanes=self._lanes(local_children),
+                                       lane_size=self._lane_size(local_children),
+                                       **self._placement(local_children),
+                                       **self._queue_sizing(local_children))
+                pipe_api_def.queues[qid] = q_def
             for child in processor.children:
+                if len(local_children) > 1 and child in local_children:
+                    map_proc(child)
+                    continue
                 qid = f"{processor.id}->{child.id}"
                 host = None
                 if child.processor_def.settings.host:
                     host = child.processor_def.settings.host
+                mode = types.QueueMode.LOCKED
+                if processor.autoscale == 1 and child.autoscale == 1:
+                    mode = types.QueueMode.SPSC  # one writer instance, one reader instance
+                elif child.autoscale > 1:
+                    mode = types.QueueMode.MPMC  # instances claim frames instead of serializing on the read lock
+                settings = child.processor_def.settings
+                if settings.conflate:
+                    mode = types.QueueMode.CONFLATE  # newest frames only, the consumer never works on a backlog
                 q_def = types.APIQueue(id=qid, name=qid, from_p=processor.id, to_p=child.id,
                                        size=child.input_buffer_size,
-                                       host=host)
+                                       host=host,
+                                       mode=mode,
+                                       conflate_depth=max(settings.conflate, 1),
+                                       conflate_key=settings.conflate_key,
+                                       **self._placement([child]),
+                                       lanes=self._lanes([child]),
+                                       lane_size=settings.lane_buffer_size,
+                                       **self._queue_sizing([child]))
                 pipe_api_def.queues[qid] = q_def
                 map_proc(child)
 
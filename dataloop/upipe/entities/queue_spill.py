@@ -0,0 +1,98 @@
+import mmap
+import os
+from collections import deque
+from typing import Deque
+
+
+class SpillSegment:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.write_offset = 0
+        self.read_offset = 0
+        fd = os.open(path, os.O_CREAT | os.O_RDWR | os.O_TRUNC)
+        try:
+            os.ftruncate(fd, size)
+            self.mem = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def fits(self, nbytes):
+        return self.write_offset + QueueSpill.FRAME_SIZE_BYTES + nbytes <= self.size
+
+    def close(self):
+        self.mem.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class QueueSpill:
+    """
+    Overflow frames of a queue producer, appended to memory mapped segment files on local disk
+    and read back in FIFO order. Segments are deleted once read
+    """
+    SEGMENT_SIZE = 64 * 1024 * 1024
+    FRAME_SIZE_BYTES = 4
+
+    def __init__(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.next_segment_id = 0
+        self.pending_frames = 0
+        self.pending_bytes = 0
+        self._segments: Deque[SpillSegment] = deque()
+
+    def _new_segment(self, nbytes):
+        size = max(self.SEGMENT_SIZE, nbytes + self.FRAME_SIZE_BYTES)
+        path = os.path.join(self.directory, f"{self.name}_{os.getpid()}_{self.next_segment_id}.spill")
+        self.next_segment_id += 1
+        segment = SpillSegment(path, size)
+        self._segments.append(segment)
+        return segment
+
+    def append(self, data):
+        nbytes = len(data)
+        if len(self._segments) == 0 or not self._segments[-1].fits(nbytes):
+            segment = self._new_segment(nbytes)
+        else:
+            segment = self._segments[-1]
+        offset = segment.write_offset
+        segment.mem[offset:offset + self.FRAME_SIZE_BYTES] = nbytes.to_bytes(self.FRAME_SIZE_BYTES, "little")
+        offset += self.FRAME_SIZE_BYTES
+        segment.mem[offset:offset + nbytes] = data
+        segment.write_offset = offset + nbytes
+        self.pending_frames += 1
+        self.pending_bytes += nbytes
+
+    def peek(self) -> bytes:
+        if self.pending_frames == 0:
+            raise LookupError(f"Spill {self.name} is empty")
+        segment = self._segments[0]
+        offset = segment.read_offset
+        nbytes = int.from_bytes(segment.mem[offset:offset + self.FRAME_SIZE_BYTES], "little")
+        offset += self.FRAME_SIZE_BYTES
+        return segment.mem[offset:offset + nbytes]
+
+    def pop(self):
+        segment = self._segments[0]
+        offset = segment.read_offset
+        nbytes = int.from_bytes(segment.mem[offset:offset + self.FRAME_SIZE_BYTES], "little")
+        segment.read_offset = offset + self.FRAME_SIZE_BYTES + nbytes
+        self.pending_frames -= 1
+        self.pending_bytes -= nbytes
+        if segment.read_offset < segment.write_offset:
+            return
+        if len(self._segments) > 1:
+            self._segments.popleft().close()
+        else:  # last segment drained, write again from its start
+            segment.read_offset = 0
+            segment.write_offset = 0
+
+    def close(self):
+        while self._segments:
+            self._segments.popleft().close()
+        self.pending_frames = 0
+        self.pending_bytes = 0
@@ -0,0 +1,111 @@
+import binascii
+import ctypes
+import mmap
+from typing import List, Tuple
+
+
+class QControlBlockV1(ctypes.LittleEndianStructure):
+    """
+    Version 1 queue control block, 32 bit indexes and counters
+    """
+    _pack_ = 1
+    _fields_ = [("data_waiters", ctypes.c_uint8),
+                ("space_waiters", ctypes.c_uint8),
+                ("spilled_frames", ctypes.c_uint32),
+                ("claim_index", ctypes.c_uint32),
+                ("claim_counter", ctypes.c_uint32),
+                ("spilled_bytes", ctypes.c_uint64),
+                ("generation", ctypes.c_uint16),
+                ("status", ctypes.c_uint8),
+                ("direction", ctypes.c_uint8),
+                ("alloc_index", ctypes.c_uint32),
+                ("exe_index", ctypes.c_uint32),
+                ("alloc_counter", ctypes.c_uint32),
+                ("exe_counter", ctypes.c_uint32),
+                ("dfps_interval_ms", ctypes.c_uint16),
+                ("last_dfps_calc_time", ctypes.c_uint64),
+                ("dfps_last_alloc_counter", ctypes.c_uint32),
+                ("dfps_last_exe_counter", ctypes.c_uint32),
+                ("ring_size", ctypes.c_uint32)]  # 0 on files written before it was kept
+
+
+class QCheckpointV1(ctypes.LittleEndianStructure):
+    _pack_ = 1
+    _fields_ = [("sequence", ctypes.c_uint64),
+                ("control", QControlBlockV1),
+                ("crc32", ctypes.c_uint32)]
+
+    @property
+    def valid(self):
+        return self.sequence > 0 and binascii.crc32(bytes(self)[:-4]) == self.crc32
+
+
+class QueueV1Reader:
+    """
+    Compatibility reader for durable queue files in the version 1 layout, MemQueue moves their pending frames
+    to the current layout when the file is opened. Frames are read from the last checkpoint the way recover() does
+    """
+    Q_CONTROL_SIZE = 64
+    CHECKPOINT_SLOT_SIZE = 128
+    FRAME_HEADER_SIZE = 32
+    FRAME_TYPE_OFFSET = 1
+    FRAME_SIZE_OFFSET = 2  # size 4
+    FRAME_WATERMARK_OFFSET = 6  # size 8
+    FRAME_CRC32_OFFSET = 14  # size 4
+    FRAME_NUM_OFFSET = 18  # size 4
+    WATER_MARK = b"d@tal0op"
+
+    def __init__(self, buf, size: int):
+        self.buf = buf
+        ctrl = QControlBlockV1.from_buffer_copy(buf)
+        self.size = ctrl.ring_size or size
+        self.exe_counter = 0
+
+    def _read(self, address, size) -> bytes:
+        if address >= self.size:
+            address = self.Q_CONTROL_SIZE + address - self.size
+        space_left = self.size - address
+        if size <= space_left:
+            return bytes(self.buf[address:address + size])
+        return bytes(self.buf[address:self.size]) + bytes(
+            self.buf[self.Q_CONTROL_SIZE:self.Q_CONTROL_SIZE + size - space_left])
+
+    def _next_frame_index(self, frame_start, frame_size):
+        if frame_start + frame_size < self.size:
+            return frame_start + frame_size
+        return self.Q_CONTROL_SIZE + (frame_start + frame_size) % self.size
+
+    def frames(self) -> List[Tuple[int, bytes]]:
+        """
+        Frames after the last valid checkpoint, as (frame type, frame data). exe_counter is set to the checkpoint one
+        """
+        checkpoint_offset = -(-self.size // mmap.PAGESIZE) * mmap.PAGESIZE
+        slots = [QCheckpointV1.from_buffer_copy(self.buf, checkpoint_offset + i * self.CHECKPOINT_SLOT_SIZE)
+                 for i in range(2)]
+        valid = [slot for slot in slots if slot.valid]
+        if len(valid) == 0:
+            raise BrokenPipeError("Version 1 queue file has no valid checkpoint")
+        checkpoint = max(valid, key=lambda c: c.sequence)
+        self.exe_counter = checkpoint.control.exe_counter
+        frame_start = checkpoint.control.exe_index
+        frames = []
+        walked = 0
+        while True:
+            frame_header = self._read(frame_start, self.FRAME_HEADER_SIZE)
+            frame_size = int.from_bytes(frame_header[self.FRAME_SIZE_OFFSET:self.FRAME_SIZE_OFFSET + 4], "little")
+            frame_number = int.from_bytes(frame_header[self.FRAME_NUM_OFFSET:self.FRAME_NUM_OFFSET + 4], "little")
+            if frame_header[self.FRAME_WATERMARK_OFFSET:self.FRAME_WATERMARK_OFFSET + 8] != self.WATER_MARK:
+                break
+            if frame_number != (self.exe_counter + len(frames)) & 0xFFFFFFFF:
+                break
+            if frame_size < self.FRAME_HEADER_SIZE or walked + frame_size >= self.size - self.Q_CONTROL_SIZE:
+                break
+            frame_data = self._read(self._next_frame_index(frame_start, self.FRAME_HEADER_SIZE),
+                                    frame_size - self.FRAME_HEADER_SIZE)
+            if binascii.crc32(frame_data).to_bytes(4, "little") != \
+                    frame_header[self.FRAME_CRC32_OFFSET:self.FRAME_CRC32_OFFSET + 4]:
+                break
+            frames.append((frame_header[self.FRAME_TYPE_OFFSET], frame_data))
+            walked += frame_size
+            frame_start = self._next_frame_index(frame_start, frame_size)
+        return frames
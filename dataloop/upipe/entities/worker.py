@@ -15,6 +15,7 @@ from colorama import init, Fore
 from .. import node, types, entities
 from ..types import UPipeEntityType, UPipeMessage, SINK_QUEUE_ID, ProcessPerformanceStats
 from ..types.performance import PerformanceMetric, ThroughputPerformanceMetric
+from .page_memory import pin_to_numa_node
 
 init(autoreset=True)
 
@@ -31,6 +32,7 @@ class Worker:
     in_qs: List[entities.MemQueue]
     out_qs: List[entities.MemQueue]
     SHARED_MEM_SIZE = 64
+    SPILL_DRAIN_TIMEOUT = 10  # sec, exit waits this long for consumers to take the spilled frames
 
     def __init__(self,
                  name=None,
@@ -48,6 +50,8 @@ class Worker:
         self.input_buffer_size = settings.input_buffer_size
         self.host = settings.host
         self.autoscale = settings.autoscale
+        if settings.numa_node is not None:
+            pin_to_numa_node(settings.numa_node)  # next to the input queues memory
         self.in_qs = []
         self.out_qs = []
         self.sink_q = None
@@ -86,6 +90,8 @@ class Worker:
         self.type = types.UPipeEntityType.PROCESS
         self.node_client = node.NodeClient(self.worker_def, self.id, self._on_ws_message)
         self.current_pipe_execution_id = None
+        self.current_priority = None  # priority of the frame in process, passed on to the frames it emits
+        self.current_batch = []  # (pipe execution id, priority) of each frame of the batch in process
         atexit.register(self._cleanup)
 
     # noinspection PyBroadException
@@ -98,6 +104,9 @@ class Worker:
         # except Exception as e:
         #     print(Fore.RED + f"FAILED CLEANUP : {self.name}: {str(e)}")
 
+        for q in self.out_qs:
+            if not loop.run_until_complete(q.drain_spill(self.SPILL_DRAIN_TIMEOUT)):
+                print(Fore.RED + f"Queue {q.id}: spilled frames not delivered on exit")
         loop.run_until_complete(self.node_client.cleanup())
         print(Fore.RED + f'Bye {self.name}')
 
@@ -199,11 +208,21 @@ class Worker:
             return
         if self._q_exist(q):
             raise BrokenPipeError(f"Q already added to proc {self.id}")
-        if q.to_p == self.id and not self._in_q_exist(q.id):
-            self.in_qs.append(entities.MemQueue(q))
+        if q.has_reader(self.id) and not self._in_q_exist(q.id):
+            reader = self.id if q.mode == types.QueueMode.BROADCAST else None
+            self.in_qs.append(entities.MemQueue(q, reader=reader))
         if q.from_p == self.id and not self._out_q_exist(q.id):
             self.out_qs.append(entities.MemQueue(q))
 
+    def _update_q(self, q: types.APIQueue):
+        # resized on the node, move to the new memory segment
+        for in_q in self.in_qs:
+            if in_q.id == q.id:
+                in_q.follow(consumer=True)
+        for out_q in self.out_qs:
+            if out_q.id == q.id:
+                out_q.follow(consumer=False)
+
     def _run(self):
         self.execution_status = ProcessorExecutionStatus.RUNNING
 
@@ -219,7 +238,10 @@ class Worker:
                 qs = types.APIProcQueues.parse_obj(msg.body)
                 for q in qs.queues:
                     queue = qs.queues[q]
-                    self._add_q(queue)
+                    if self._q_exist(queue):
+                        self._update_q(queue)
+                    else:
+                        self._add_q(queue)
             if msg.type == types.UPipeMessageType.CONFIG_UPDATE:
                 print("Updating config")
                 self.config = msg.body
@@ -256,8 +278,10 @@ class Worker:
             frame = data
         else:
             frame = entities.DataFrame(data)
-        if self.current_pipe_execution_id:
+        if self.current_pipe_execution_id and frame.pipe_execution_id is None:
             frame.set_pipe_exe_id(self.current_pipe_execution_id)
+        if frame.priority is None:
+            frame.priority = self.current_priority
         q = self._get_next_q_to_emit()
         if not q and self.sink_q:
             sink_result = await self._enqueue(self.sink_q, frame)
@@ -273,16 +297,74 @@ class Worker:
             success = success and await self._enqueue(q, frame)
         return success
 
+    async def _enqueue_many(self, q, frames):
+        if not q.host:
+            return await q.put_many(frames)
+        added = 0
+        for frame in frames:
+            if not await self.node_client.put_q(q, frame):
+                break
+            added += 1
+        return added
+
+    async def emit_many(self, data_list: list, d_type: entities.DType = None):
+        """
+        Emit a batch of frames, each queue takes the batch under a single lock.
+        Frames keep their pipe execution id, the others take the id of the frame at the same place in the batch
+        from get_many() when the batch sizes match, else the id of the frame in process.
+        returns the number of frames emitted, every output queue took them. The rest did not fit
+        """
+        batch = self.current_batch if len(self.current_batch) == len(data_list) else []
+        frames = []
+        for i, data in enumerate(data_list):
+            frame = data if isinstance(data, entities.DataFrame) else entities.DataFrame(data)
+            pipe_execution_id, priority = batch[i] if batch else (self.current_pipe_execution_id,
+                                                                  self.current_priority)
+            if pipe_execution_id and frame.pipe_execution_id is None:
+                frame.set_pipe_exe_id(pipe_execution_id)
+            if frame.priority is None:
+                frame.priority = priority
+            frames.append(frame)
+        q = self._get_next_q_to_emit()
+        if not q and not self.sink_q:
+            print(f"Warning:Processor {self.name} emit dropped: No destination")
+            return 0
+        out_qs = self.out_qs if q else [self.sink_q]
+        accepted = [await self._enqueue_many(q, frames) for q in out_qs]
+        emitted = max(accepted)
+        for q, count in zip(out_qs, accepted):
+            while count < emitted:  # frames one queue took go to all, the queues behind wait for space
+                if q.host:
+                    await asyncio.sleep(entities.MemQueue.WAIT_POLL_INTERVAL)
+                else:
+                    frame = frames[count]
+                    await q.wait_space(frame.nbytes, entities.MemQueue.WAIT_PARK_TIMEOUT, frame.priority)
+                count += await self._enqueue_many(q, frames[count:emitted])
+        if batch:
+            self.current_batch = batch[emitted:]  # the rest of the results, emitted again, keep their ids
+        self.processed_counter += emitted
+        return emitted
+
     async def emit_sync(self, data, d_type: entities.DType = None):
         if isinstance(data, entities.DataFrame):
             frame = data
         else:
             frame = entities.DataFrame(data)
-        while not await self.out_qs[0].space_available(frame):
-            await asyncio.sleep(.1)
-        return await self.emit(data)
+        frame_size = frame.nbytes
+        while not await self.out_qs[0].space_available(frame, frame_size):
+            await self.out_qs[0].wait_space(frame_size, priority=frame.priority)
+        return await self.emit(frame)
 
     async def get(self):
+        frame = await self.get_frame()
+        if frame is None:
+            return None
+        return frame.data
+
+    async def get_frame(self):
+        """
+        Get the next frame, emit() it to forward it as is, its encoding is not redone
+        """
         sys.stdout.flush()
         for i in range(len(self.in_qs)):
             next_index = (self.consumer_next_q_index + i) % len(self.in_qs)
@@ -294,15 +376,55 @@ class Worker:
                     self.current_pipe_execution_id = frame.pipe_execution_id
                 else:
                     self.current_pipe_execution_id = None
+                self.current_priority = frame.priority
+                self.current_batch = []
                 self.received_counter += 1
-                return frame.data
+                return frame
         if self.request_termination:  # no more messages and goodbye requested from pipe
             await self.terminate()
         return None
 
+    async def get_many(self, max_n: int, max_bytes: int = None):
+        """
+        Get up to max_n frames data from the next input queue holding frames, empty list if none
+        """
+        return [frame.data for frame in await self.get_frames(max_n, max_bytes)]
+
+    async def get_frames(self, max_n: int, max_bytes: int = None):
+        """
+        Get up to max_n frames from the next input queue holding frames, empty list if none
+        """
+        for i in range(len(self.in_qs)):
+            next_index = (self.consumer_next_q_index + i) % len(self.in_qs)
+            q: entities.MemQueue = self.in_qs[next_index]
+            frames = await q.get_many(max_n, max_bytes)
+            if frames:
+                self.consumer_next_q_index += 1
+                self.current_batch = [(frame.pipe_execution_id, frame.priority) for frame in frames]
+                pipe_execution_ids = {frame.pipe_execution_id for frame in frames}
+                # frames of several executions have no one id, results are matched by their place in the batch
+                self.current_pipe_execution_id = pipe_execution_ids.pop() if len(pipe_execution_ids) == 1 else None
+                self.current_priority = max([frame.priority or 0 for frame in frames])
+                self.received_counter += len(frames)
+                return frames
+        if self.request_termination:  # no more messages and goodbye requested from pipe
+            await self.terminate()
+        return []
+
+    async def _wait_in_qs(self, timeout):
+        if len(self.in_qs) == 0:
+            await asyncio.sleep(timeout)
+            return
+        if len(self.in_qs) == 1:
+            await self.in_qs[0].wait_data(timeout)
+            return
+        waits = [asyncio.ensure_future(q.wait_data(timeout)) for q in self.in_qs]
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for w in waits:
+            w.cancel()
+
     async def get_sync(self, timeout: int = 5):
         start_time = time.time()
-        sleep_time = 0.01
         while True:
             data = await self.get()
             if data is not None:
@@ -310,7 +432,7 @@ class Worker:
             elapsed = time.time() - start_time
             if elapsed > timeout:
                 raise TimeoutError(f"get_sync timeout {elapsed} sec")
-            await asyncio.sleep(sleep_time)
+            await self._wait_in_qs(timeout - elapsed)
 
     async def terminate(self):
         (data, messages) = await self.node_client.notify_termination(self.worker_def)
@@ -142,6 +142,12 @@ class NodeClient:
         register_url = f"http://{self.server_base_url}/load_pipe"
         return await self.server_session.post(register_url, json=pipe.dict())
 
+    async def resize_q(self, qid: str, size: int) -> bool:
+        resize_url = f"http://{self.server_base_url}/resize_q/{qid}"
+        resp = await self.server_session.post(resize_url, params={"size": size})
+        res: types.APIResponse = types.APIResponse.parse_obj(await resp.json())
+        return res.success
+
     def send_message(self, msg: types.UPipeMessage):
         if not self.socket:
             return
@@ -1,4 +1,6 @@
 from .pid_log import pid_log
+from .shm_registry import ShmRegistry, shm_registry
+from .queue_sizer import QueueSizer, queue_sizer
 from .node_config import NodeConfig
 from .node_utils import get_process_by_path, kill_em_all, count_process_by_path
 from .node_main import ComputeNode
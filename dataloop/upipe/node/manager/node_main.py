@@ -18,11 +18,12 @@ from ... import entities, types, utils
 from .node_config import NodeConfig
 
 from .pipe_controller import PipeController
+from .shm_registry import shm_registry
 from .node_utils import kill_em_all, get_process_by_path, count_process_by_path, WebsocketHandler
 from ...types import UPipeEntityType, APIQueue
 from ...types.node import APINodeResource, ResourceType
 from ...types.performance import NodePerformanceStats, CPUPerformanceMetric, MemoryPerformanceMetric, \
-    DiskPerformanceMetric, ProcessorPerformanceStats
+    DiskPerformanceMetric, ProcessorPerformanceStats, ShmPerformanceMetric
 from ...types.pipe import PipelineAlreadyExist
 
 init(autoreset=True)
@@ -52,6 +53,7 @@ class ComputeNode:
     NODE_HOST_URL_POINTER = 100  # size 255,
     NODE_HOST_URL_SIZE = 255
     NODE_USAGE_HISTORY_LIMIT = 30
+    QUEUE_TUNE_INTERVAL = 10  # seconds between queue sizing passes
     config = NodeConfig()
     _instance = None
     node_root_path = os.path.dirname(os.path.abspath(__file__))
@@ -76,6 +78,7 @@ class ComputeNode:
         self.last_scale_time = time.time()
         self.scale_block_time = 10  # time to wait before scaling again, seconds
         self.pipe_controllers: Dict[str, PipeController] = {}
+        self.last_queue_tune_time = time.time()
         self._node_ready = False
         self.connections: List[WebsocketHandler] = []
 
@@ -89,7 +92,8 @@ class ComputeNode:
             out_q_cout = len([q for qid in queues.queues if queues.queues[qid].from_p == proc_id])
             if out_q_cout == 0:
                 proc_sink = types.APIQueue(from_p=proc_id, to_p=pipe.pipe.id, id=pipe.pipe.sink.id,
-                                           size=pipe.pipe.sink.size, name=pipe.pipe.sink.id)
+                                           size=pipe.pipe.sink.size, name=pipe.pipe.sink.id,
+                                           lanes=pipe.pipe.sink.lanes, lane_size=pipe.pipe.sink.lane_size)
                 queues.queues[proc_sink.id] = proc_sink
         return queues
 
@@ -259,6 +263,13 @@ class ComputeNode:
                 return await queue.put(df)
         return False
 
+    async def resize_q(self, qid: str, size: int) -> Union[types.APIQueue, None]:
+        for pipe_name in self.pipe_controllers:
+            pipe = self.pipe_controllers[pipe_name]
+            if qid in pipe.queues:
+                return await pipe.resize_queue(qid, size)
+        return None
+
     async def wait_for_node_ready(self, timeout=10):
         start_time = time.time()
         while not self._node_ready:
@@ -268,6 +279,7 @@ class ComputeNode:
                 raise TimeoutError("Timeout waiting for node initialization")
 
     def start(self):
+        shm_registry.sweep()  # a node restarted after a crash, files of the gone processes
         loop = asyncio.get_event_loop()
         loop.create_task(self.baby_sitter())
 
@@ -305,6 +317,15 @@ class ComputeNode:
         self.pipe_controllers[pipe_to_scale].scale_up()
         self.last_scale_time = time.time()
 
+    async def tune_queues(self):
+        if time.time() - self.last_queue_tune_time < self.QUEUE_TUNE_INTERVAL:
+            return
+        self.last_queue_tune_time = time.time()
+        for pipe_name in self.pipe_controllers:
+            p = self.pipe_controllers[pipe_name]
+            if p.running:
+                await p.tune_queues()
+
     def log_node_utilization(self):
         cpu = psutil.cpu_percent()
         cores = psutil.cpu_percent(percpu=True)
@@ -336,12 +357,15 @@ class ComputeNode:
                 p_stats = p_controller.stats()
                 p_stats.pipe_id = p.pipe.id
                 processor_usage.append(p_stats)
+        shm_usage = [ShmPerformanceMetric(pipe_id=pipe_id, value=size)
+                     for pipe_id, size in shm_registry.pipe_bytes().items()]
         node_usage = types.NodePerformanceStats(node_id=self.node_id,
                                                 cpu_total=CPUPerformanceMetric(value=cpu, core_id='total_cpu'),
                                                 memory=MemoryPerformanceMetric(id=memory, value=memory),
                                                 cores_usage=cores_usage, disks_usage=disks_stats,
                                                 queues_usage=queues_usage,
-                                                processors_usage=processor_usage)
+                                                processors_usage=processor_usage,
+                                                shm_usage=shm_usage)
         self.node_usage_history.append(node_usage)
         while len(self.node_usage_history) > self.NODE_USAGE_HISTORY_LIMIT:
             del self.node_usage_history[0]
@@ -447,6 +471,7 @@ class ComputeNode:
                     print(Fore.BLACK + Back.GREEN + f"Pipe {pipe_name} completed ...")
                     pipe.cleanup()
             self.check_autoscale()
+            await self.tune_queues()
             if self.running_pipes_count == 0:
                 print(waiting_print)
 
@@ -5,6 +5,7 @@ import os.path
 import tempfile
 import os
 from .node_utils import kill_process
+from .shm_registry import shm_registry
 
 
 def get_timestamped_object():
@@ -53,6 +54,7 @@ class PidLog:
             return
         for pid in session_log['pids']:
             kill_process(pid)
+        shm_registry.release_session(root_pid)
         del self.log[root_pid]
         self._save()
 
@@ -70,6 +72,15 @@ class PidLog:
             new_session_obj['pids'] = {}
             self.log[root_pid] = new_session_obj
         self._save()
+        reclaimed = shm_registry.sweep()
+        if reclaimed > 0:
+            print(f"Reclaimed {reclaimed} bytes of shared memory left by dead sessions")
+
+    @property
+    def session_pid(self):
+        if len(self.log) != 1:
+            return None
+        return int(list(self.log.keys())[0])
 
     def _save(self):
         with open(self.log_file, 'w') as outfile:
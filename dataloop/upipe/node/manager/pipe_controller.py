@@ -10,6 +10,9 @@ from starlette.websockets import WebSocketDisconnect
 from .node_utils import WebsocketHandler
 from ... import types, entities
 from .processor_controller import ProcessorController, WorkerController
+from .queue_sizer import queue_sizer
+from .pid_log import pid_log
+from .shm_registry import shm_registry
 from ...types import PipeExecutionStatus, APIProcessor, APIQueue
 
 
@@ -32,7 +35,7 @@ class PipeController:
         queues: List[APIQueue] = []
         for qid in self.queues:
             queue = self.queues[qid]
-            if queue.from_p == proc_id or queue.to_p == proc_id:
+            if queue.from_p == proc_id or queue.has_reader(proc_id):
                 api_q: APIQueue = queue.queue_def
                 queues.append(api_q)
         return queues
@@ -214,6 +217,8 @@ class PipeController:
 
     async def set_pipe_status(self, status: PipeExecutionStatus):
         self.status = status
+        if status == PipeExecutionStatus.COMPLETED:
+            shm_registry.release_pipe(self.name)
         await self._sync_status()
 
     async def _sync_status(self):
@@ -286,16 +291,61 @@ class PipeController:
         proc_queues = []
         for qid in self.queues:
             queue = self.queues[qid]
-            if queue.to_p == proc_name or queue.from_p == proc_name:
+            if queue.has_reader(proc_name) or queue.from_p == proc_name:
                 proc_queues.append(queue)
         return proc_queues
 
+    async def resize_queue(self, qid: str, size: int):
+        """
+        Resize a queue while the pipe runs, attached processors are sent the new queue definition
+        """
+        queue = self.queues[qid]
+        await queue.resize(size)
+        shm_registry.register(self.name, queue.shm_files(), pid_log.session_pid)  # the new segment generation
+        for proc_name in self.processors:
+            p: ProcessorController = self.processors[proc_name]
+            if queue not in p.in_queues and queue not in p.out_queues:
+                continue
+            queues_def = types.APIProcQueues(proc_id=p.id, queues={qid: queue.queue_def})
+            q_update_msg = types.UPipeMessage(dest=p.id,
+                                              sender=self.node_proc.id,
+                                              type=types.UPipeMessageType.Q_UPDATE,
+                                              body=queues_def,
+                                              scope=types.UPipeEntityType.PROCESSOR)
+            for instance in p.instances:
+                await instance.send_message(q_update_msg)
+        return queue.queue_def
+
+    async def tune_queues(self):
+        """
+        Resize the queues with a burst window to the size their observed traffic needs
+        """
+        for qid in self.queues:
+            queue = self.queues[qid]
+            if not queue.burst_window_ms or queue.durable_path:
+                continue
+            size = queue_sizer.target_size(queue)
+            if size is None or not queue_sizer.needs_resize(queue, size):
+                continue
+            try:
+                await self.resize_queue(qid, size)
+            except MemoryError:
+                continue  # pending frames do not fit the smaller size yet
+            print(f"Queue {qid} resized to {size} bytes")
+            queue_sizer.record(self.name, qid, size)
+
     def load(self, pipe: types.APIPipe):
         self.processors: Dict[str, ProcessorController] = {}
         self.queues: Dict[str, entities.MemQueue] = {}
         for qid in pipe.queues:
             queue = pipe.queues[qid]
+            if queue.burst_window_ms:
+                # tuned on an earlier run
+                queue = queue.copy(update={"size": queue_sizer.initial_size(pipe.name, queue)})
             self.queues[qid] = entities.MemQueue(queue)
+            if queue.durable_path and not self.queues[qid].created:
+                pending = self.queues[qid].recover()
+                print(f"Queue {qid} recovered from {queue.durable_path}, {pending} frames pending")
         self.queues[pipe.sink.id] = entities.MemQueue(pipe.sink)
         for proc_name in pipe.processors:
             proc = pipe.processors[proc_name]
@@ -304,6 +354,15 @@ class PipeController:
         self.status = types.PipeExecutionStatus.READY
         self.name = pipe.name
         self.pipe = pipe
+        shm_registry.register(self.name, self.shm_files(), pid_log.session_pid)
+
+    def shm_files(self) -> Dict[str, int]:
+        files = {}
+        for qid in self.queues:
+            files.update(self.queues[qid].shm_files())
+        for proc_name in self.processors:
+            files.update(self.processors[proc_name].shm_files())
+        return files
 
     def handle_control_msg(self, control_msg: types.APIPipeControlMessage):
         if control_msg.action == types.PipeActionType.START:
@@ -317,6 +376,7 @@ class PipeController:
 
     def handle_instance_exit(self, instance: WorkerController):
         p = self.processors[instance.proc_id]
+        shm_registry.detach(p.shm_files(), instance.pid)
         if instance.exit_code == 0:
             print(f"{instance.proc_id}({instance.pid}) >> ************Completed**************")
             p.on_complete(False)
@@ -8,14 +8,16 @@ import sys
 import types
 from enum import IntEnum
 from multiprocessing.queues import Queue
-from typing import List, Union
+from typing import Dict, List, Union
 import os
 from fastapi import WebSocket
 
 from . import pid_log
+from .shm_registry import shm_registry
 from ... import entities, utils
 from ... import types as up_types
 from .worker_controller import InstanceType, WorkerController, InstanceState
+from ...entities.page_memory import memory_path
 
 # This is a Queue that behaves like stdout
 from ...types.performance import ProcessorPerformanceStats
@@ -153,8 +155,18 @@ class ProcessorController:
         runner = WorkerController(self.proc, process, instance_type, stdout_q)
         print(f"{self.proc.name} instance launched, pid: {runner.pid}")
         pid_log.log_pid(runner.pid, self.proc.name)
+        shm_registry.attach(self.shm_files(), runner.pid)
         self._instances.append(runner)
 
+    def shm_files(self) -> Dict[str, int]:
+        """
+        Shared memory files the processor instances attach, its control block and queues
+        """
+        files = {memory_path(self._control_mem.mem): self._control_mem.size}
+        for q in self._queues:
+            files.update(q.shm_files())
+        return files
+
     # def register_instance(self):
     #     if len(self.launched_instances) == 0:
     #         raise BrokenPipeError("Missing launch instances error")
@@ -217,7 +229,7 @@ class ProcessorController:
 
     @property
     def pending(self):
-        return sum([q.pending_counter for q in self.in_queues])
+        return sum([q.pending_for(self.name) for q in self.in_queues])
 
     @property
     def pending_termination(self):
@@ -225,7 +237,7 @@ class ProcessorController:
 
     @property
     def in_queues(self):
-        return [q for q in self._queues if q.to_p == self.name]
+        return [q for q in self._queues if q.has_reader(self.name)]
 
     @property
     def out_queues(self):
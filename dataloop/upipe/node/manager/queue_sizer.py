@@ -0,0 +1,82 @@
+import json
+import math
+import mmap
+import os
+import tempfile
+from typing import Dict, Union
+
+import numpy as np
+import psutil
+
+from ... import types, entities
+from ...entities.mem_queue import QActionLog
+
+
+class QueueSizer:
+    """
+    Queue sizes from observed traffic: the ring holds burst_window_ms of frames at the enqueue rate,
+    sized by the p99 frame. Tuned sizes are kept in a json file by pipe and queue id, and applied when the pipe
+    loads again
+    """
+    SIZE_PERCENTILE = 99
+    MIN_SAMPLES = 10  # enqueue log samples needed before sizing a queue
+    MIN_FRAMES = 4  # a queue holds at least this many p99 frames
+    MIN_SIZE = 16 * mmap.PAGESIZE
+    MEMORY_FRACTION = 0.25  # default max size, share of the host memory one tuned ring may take
+    SHRINK_RATIO = 2  # shrink only when the queue is this many times too big, avoids resizing back and forth
+
+    def __init__(self, log_file: str = None, max_size: int = None):
+        """
+        max_size: memory budget of a tuned ring in bytes, the ring indexes are 64 bit and do not limit it
+        """
+        if log_file is None:
+            log_file = os.path.join(tempfile.gettempdir(), "upipe_queue_sizes.json")
+        self.log_file = log_file
+        if max_size is None:
+            max_size = int(psutil.virtual_memory().total * self.MEMORY_FRACTION)
+        self.max_size = max(max_size // mmap.PAGESIZE * mmap.PAGESIZE, self.MIN_SIZE)
+        self.sizes: Dict[str, int] = {}
+        if os.path.exists(self.log_file):
+            try:
+                with open(self.log_file, 'r') as f:
+                    self.sizes = json.load(f)
+            except Exception:
+                os.unlink(self.log_file)
+                self.sizes = {}
+
+    @staticmethod
+    def _key(pipe_name: str, qid: str) -> str:
+        return f"{pipe_name}/{qid}"  # queue ids repeat across pipes
+
+    def initial_size(self, pipe_name: str, q: types.APIQueue) -> int:
+        if not q.burst_window_ms:
+            return q.size
+        return self.sizes.get(self._key(pipe_name, q.id), q.size)
+
+    def target_size(self, q: entities.MemQueue) -> Union[int, None]:
+        """
+        Ring size for the queue burst window from the enqueue log, None if not enough samples were logged
+        """
+        entries = q.log.entries(QActionLog.ENQUEUE)
+        if len(entries) < self.MIN_SAMPLES:
+            return None
+        span_ms = entries["time"][-1] - entries["time"][0]
+        if span_ms <= 0:
+            return None
+        rate = (len(entries) - 1) * q.log.sample_every / (span_ms / 1000)  # frames per second
+        frame_size = np.percentile(entries["data_size"], self.SIZE_PERCENTILE) + q.FRAME_HEADER_SIZE
+        frames = max(rate * q.burst_window_ms / 1000, self.MIN_FRAMES)
+        size = frames * frame_size / q.MAX_CAPACITY + q.Q_CONTROL_SIZE
+        size = math.ceil(size / mmap.PAGESIZE) * mmap.PAGESIZE
+        return int(min(max(size, self.MIN_SIZE), self.max_size))
+
+    def needs_resize(self, q: entities.MemQueue, size: int) -> bool:
+        return size > q.size or size * self.SHRINK_RATIO < q.size
+
+    def record(self, pipe_name: str, qid: str, size: int):
+        self.sizes[self._key(pipe_name, qid)] = size
+        with open(self.log_file, 'w') as outfile:
+            json.dump(self.sizes, outfile, indent=4)
+
+
+queue_sizer = QueueSizer()
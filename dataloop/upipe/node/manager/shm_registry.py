@@ -0,0 +1,157 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from typing import Dict, Iterable
+
+import psutil
+
+from ...entities.page_memory import SHM_DIR
+
+
+class ShmRegistry:
+    """
+    Node registry of the shared memory files a session creates: queue segments, queue logs, locks, wait events and
+    processor control blocks. Attachments are reference counted by pid, the files of a pipe are unlinked once it
+    completed and the last attached process let go. Files of dead sessions are swept when a session starts.
+    Updates hold an flock on a lock file next to the registry, the registry file is replaced atomically
+    """
+
+    def __init__(self, log_file: str = None):
+        if log_file is None:
+            log_file = os.path.join(tempfile.gettempdir(), "upipe_shm_registry.json")
+        self.log_file = log_file
+        self.files: Dict[str, dict] = {}
+        self._load()
+
+    @contextmanager
+    def _update(self):
+        # the node and the session process both write the registry: read, change and save under the lock
+        with open(f"{self.log_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+                self._save()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        self.files = {}
+        if not os.path.exists(self.log_file):
+            return
+        try:
+            with open(self.log_file, 'r') as f:
+                self.files = json.load(f)
+        except Exception:
+            os.unlink(self.log_file)
+            self.files = {}
+
+    def _save(self):
+        temp_file = f"{self.log_file}.{os.getpid()}"
+        with open(temp_file, 'w') as outfile:
+            json.dump(self.files, outfile, indent=4)
+        os.replace(temp_file, self.log_file)  # readers without the lock see the old or the new registry
+
+    def register(self, pipe: str, files: Dict[str, int], session: int = None):
+        """
+        Files created for the pipe, path to size in bytes. Registering a file again updates its size
+        """
+        with self._update():
+            for path, size in files.items():
+                entry = self.files.setdefault(path, {"pipe": pipe,
+                                                     "session": session or os.getpid(),
+                                                     "owner": os.getpid(),
+                                                     "holders": [],
+                                                     "released": False})
+                entry["size"] = size
+
+    def attach(self, files: Iterable[str], pid: int):
+        with self._update():
+            for path in files:
+                if path in self.files and pid not in self.files[path]["holders"]:
+                    self.files[path]["holders"].append(pid)
+
+    def detach(self, files: Iterable[str], pid: int):
+        """
+        The process let go of the files, released files with no holder left are unlinked
+        """
+        with self._update():
+            for path in files:
+                entry = self.files.get(path)
+                if entry is None:
+                    continue
+                if pid in entry["holders"]:
+                    entry["holders"].remove(pid)
+                if entry["released"] and not self._held(entry):
+                    self._unlink(path)
+
+    def release_pipe(self, pipe: str) -> int:
+        """
+        Pipe completed: its files are unlinked, the ones still attached when their last holder detaches.
+        returns the number of bytes unlinked
+        """
+        released = 0
+        with self._update():
+            for path in [path for path in self.files if self.files[path]["pipe"] == pipe]:
+                entry = self.files[path]
+                entry["released"] = True
+                if not self._held(entry):
+                    released += entry["size"]
+                    self._unlink(path)
+        return released
+
+    def release_session(self, session: int) -> int:
+        """
+        Session processes were stopped, all of its files are unlinked. returns the number of bytes unlinked
+        """
+        with self._update():
+            session_files = [path for path in self.files if self.files[path]["session"] == int(session)]
+            released = sum([self.files[path]["size"] for path in session_files])
+            for path in session_files:
+                self._unlink(path)
+        return released
+
+    def sweep(self) -> int:
+        """
+        Unlink the files no live process owns or holds, left over by crashed sessions.
+        returns the number of bytes reclaimed
+        """
+        reclaimed = 0
+        with self._update():
+            for path in list(self.files):
+                entry = self.files[path]
+                if psutil.pid_exists(entry["session"]) or psutil.pid_exists(entry["owner"]) or self._held(entry):
+                    continue
+                reclaimed += entry["size"]
+                self._unlink(path)
+        return reclaimed
+
+    def pipe_bytes(self) -> Dict[str, int]:
+        """
+        Shared memory bytes per pipe, files still held after their pipe completed included
+        """
+        self._load()
+        usage = {}
+        for entry in self.files.values():
+            usage[entry["pipe"]] = usage.get(entry["pipe"], 0) + entry["size"]
+        return usage
+
+    @staticmethod
+    def _held(entry) -> bool:
+        return any([psutil.pid_exists(pid) for pid in entry["holders"]])
+
+    def _unlink(self, path):
+        entry = self.files.pop(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # unlinked by its owner
+        if entry["owner"] == os.getpid() and entry["size"] > 0 and os.path.dirname(path) == SHM_DIR:
+            # segment we created, the resource tracker would unlink the name again on exit
+            resource_tracker.unregister(f"/{os.path.basename(path)}", "shared_memory")
+
+
+shm_registry = ShmRegistry()
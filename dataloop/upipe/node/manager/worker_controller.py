@@ -118,6 +118,11 @@ class WorkerController:
         self.state = InstanceState.DONE
         return True
 
+    async def send_message(self, msg: UPipeMessage):
+        if not self.connection:
+            return
+        await self.connection.send_json([msg.dict()])
+
     @property
     def color(self):
         return self.colors[self.color_index]
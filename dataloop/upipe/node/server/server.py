@@ -94,6 +94,17 @@ async def push_q(q: str = Form(...), frame_file: UploadFile = Form(...)):
     return types.APIResponse(success=added)
 
 
+@fast_api.post("/resize_q/{qid}")
+async def resize_q(qid: str, size: int):
+    try:
+        q = await node.resize_q(qid, size)
+    except (MemoryError, ValueError, BufferError) as e:
+        return types.APIResponse(success=False, text=f"Error resizing queue:{str(e)}")
+    if q is None:
+        return types.APIResponse(success=False, text=f"Queue not found:{qid}")
+    return types.APIResponse(success=True, data=q.dict())
+
+
 @fast_api.on_event("startup")
 async def startup_event():
     print("network ready")
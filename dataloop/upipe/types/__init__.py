@@ -6,7 +6,7 @@ from .performance import APINodeUsageMessage, NodePerformanceStats, node_server,
     ProcessPerformanceStats
 from .pipe import UPipeEntity, APIPipe, SINK_QUEUE_ID, APIPipeControlMessage, PipeActionType, PipeExecutionStatus
 from .processor import APIProcSettings, APIProcessor, ProcessorExecutionStatus
-from .mem_queue import APIQueue, APIProcQueues
+from .mem_queue import APIQueue, APIProcQueues, QueueMode, OverflowPolicy, IntegrityPolicy, PageBacking
 from .message_parser import APIPipeStatusMessage, parse_pipe_message
 from .processor_instance import APIProcessorInstance, APIWorker, APIInstanceActionMessage, ProcessorExecutionStatus, \
     ProcessStatsMessage
@@ -1,3 +1,6 @@
+from enum import IntEnum
+from typing import List
+
 from pydantic import BaseModel
 from pydantic.annotated_types import Dict
 from pydantic.class_validators import Optional
@@ -5,12 +8,61 @@ from pydantic.class_validators import Optional
 from .base import UPipeEntity, UPipeEntityType
 
 
+class QueueMode(IntEnum):
+    LOCKED = 1  # any number of producers/consumers, every access takes the queue locks
+    SPSC = 2  # single producer instance, single consumer instance, lock free
+    MPMC = 3  # consumers claim frames, autoscaled instances dequeue in parallel
+    BROADCAST = 4  # frames are written once, every reader gets every frame through its own cursor
+    CONFLATE = 5  # latest value, a new frame drops the oldest unread one past conflate_depth (per conflate_key)
+
+
+class OverflowPolicy(IntEnum):
+    REJECT = 1  # put returns False when the queue is full
+    SPILL = 2  # overflow frames go to disk and are replayed into the queue as space frees up
+
+
+class IntegrityPolicy(IntEnum):
+    FULL = 1  # every frame payload is checksummed, CRC32C when the crc32c package is installed
+    SAMPLED = 2  # one of every integrity_sample_every frames is checksummed
+    HEADER = 3  # frame header watermark and version check only
+    OFF = 4  # no checks, for trusted local edges
+
+
+class PageBacking(IntEnum):
+    DEFAULT = 1  # system page size
+    TRANSPARENT = 2  # madvise(MADV_HUGEPAGE), transparent huge pages when the kernel allows them for shared memory
+    HUGETLBFS = 3  # segment on the hugetlbfs mount, needs huge pages reserved on the host
+
+
 class APIQueue(UPipeEntity):
     type: UPipeEntityType = UPipeEntityType.QUEUE
     from_p: str
     to_p: str
     size: int
     host: Optional[str]
+    mode: QueueMode = QueueMode.LOCKED
+    log_sample_every: int = 1  # queue log records one of every N operations
+    shared_log: bool = False  # queue log in shared memory, readable from other processes
+    overflow: OverflowPolicy = OverflowPolicy.REJECT
+    spill_dir: Optional[str]  # OverflowPolicy.SPILL segment files directory, defaults to the temp dir
+    durable_path: Optional[str]  # file backed queue, recovers pending frames after a crash
+    checkpoint_interval_ms: int = 1000  # durable queues, consumed space is committed (and reused) at this rate
+    spin_us: int = 0  # busy wait before parking on an empty/full queue, for latency critical queues
+    readers: List[str] = []  # QueueMode.BROADCAST, the processors reading the queue, one cursor each
+    lanes: int = 1  # priority lanes, each a ring, get serves the highest non-empty lane first
+    lane_size: Optional[int]  # ring size of each lane above lane 0, size // MemQueue.LANE_SIZE_DIVISOR if not set
+    generation: int = 0  # memory segment generation, bumped by every online resize
+    burst_window_ms: Optional[int]  # node resizes the queue to hold this window of traffic, needs shared_log
+    integrity: IntegrityPolicy = IntegrityPolicy.FULL
+    integrity_sample_every: int = 16  # IntegrityPolicy.SAMPLED
+    conflate_depth: int = 1  # QueueMode.CONFLATE, unread frames kept per key
+    conflate_key: Optional[str]  # QueueMode.CONFLATE, frame field the frames are conflated by, the whole queue if None
+    page_backing: PageBacking = PageBacking.DEFAULT
+    prefault: bool = False  # fault the queue pages in when it is created, not on the first frames
+    numa_node: Optional[int]  # queue memory bound to this NUMA node, the node of the consumer CPUs
+
+    def has_reader(self, proc_id: str) -> bool:
+        return self.to_p == proc_id or proc_id in self.readers
 
 
 class APIProcQueues(BaseModel):
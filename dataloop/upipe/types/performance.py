@@ -70,6 +70,11 @@ class QueuePerformanceStats(BaseModel):
     exe_index: PerformanceMetric
     free_space: PerformanceMetric
     size: PerformanceMetric
+    spilled_frames: PerformanceMetric = PerformanceMetric()
+    spilled_bytes: PerformanceMetric = PerformanceMetric(metric_type=MetricType.STORAGE)
+    crc_errors: PerformanceMetric = PerformanceMetric()
+    header_errors: PerformanceMetric = PerformanceMetric()
+    dropped_frames: PerformanceMetric = PerformanceMetric()
     q_id: str
 
 
@@ -95,12 +100,18 @@ class ProcessorPerformanceStats(BaseModel):
     pipe_id: Optional[str]
 
 
+class ShmPerformanceMetric(PerformanceMetric):
+    metric_type: str = MetricType.MEMORY
+    pipe_id: str  # shared memory bytes of the pipe queues and processors
+
+
 class NodePerformanceStats(BaseModel):
     cpu_total: CPUPerformanceMetric
     cores_usage: List[CPUPerformanceMetric] = []
     disks_usage: List[DiskPerformanceMetric] = []
     queues_usage: List[QueuePerformanceStats] = []
     processors_usage: List[ProcessorPerformanceStats] = []
+    shm_usage: List[ShmPerformanceMetric] = []
     memory: MemoryPerformanceMetric
     node_id: str
 
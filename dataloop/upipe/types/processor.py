@@ -3,6 +3,7 @@ from enum import IntEnum
 from pydantic import BaseModel
 from pydantic.class_validators import Optional
 from .base import UPipeEntityType, UPipeEntity
+from .mem_queue import PageBacking
 
 
 class ProcessorExecutionStatus(IntEnum):
@@ -14,9 +15,16 @@ class ProcessorExecutionStatus(IntEnum):
     PENDING_TERMINATION = 7
 
 class APIProcSettings(BaseModel):
-    priority: int = 1
+    priority: int = 1  # frame priority levels served ahead of unprioritized frames, an input queue lane each
     autoscale: int = 1
     input_buffer_size: int = 1000 * 4096  # 1000 mem pages by default
+    lanes: Optional[int] = None  # input queue priority lanes, priority + 1 if not set. Higher lanes are served first
+    lane_buffer_size: Optional[int] = None  # each lane above lane 0, a quarter of input_buffer_size by default
+    buffer_burst_ms: Optional[int] = None  # node sizes the input queue to absorb this burst, from observed frames
+    conflate: int = 0  # input queue keeps only the newest N unread frames (per conflate_key), for real time streams
+    conflate_key: Optional[str] = None  # frame field the input frames are conflated by
+    page_backing: PageBacking = PageBacking.DEFAULT  # input queue pages
+    numa_node: Optional[int] = None  # instances run on this NUMA node CPUs, input queue memory is bound to it
     host: Optional[str] = None
 
 
@@ -1,5 +1,7 @@
 from enum import IntEnum
-from multiprocessing import shared_memory
+
+from .entities.page_memory import open_memory
+from .types import PageBacking
 
 
 class MEMORY_ALLOCATION_MODE(IntEnum):
@@ -10,32 +12,38 @@ class MEMORY_ALLOCATION_MODE(IntEnum):
 
 class SharedMemoryBuffer:
 
-    def __init__(self, name: str, size: int, mode=MEMORY_ALLOCATION_MODE.USE_ONLY):
+    def __init__(self, name: str, size: int, mode=MEMORY_ALLOCATION_MODE.USE_ONLY,
+                 page_backing: PageBacking = PageBacking.DEFAULT, numa_node: int = None, prefault: bool = False):
         self.size = size
         self.name = name
         self.mode = mode
+        self.page_backing = page_backing
+        self.numa_node = numa_node
+        self.prefault = prefault
         self.mem = None
         self.init()
 
+    def _open(self, create):
+        return open_memory(self.name, create, self.size, self.page_backing, self.numa_node, self.prefault)
+
     def init(self):
         if self.mode == MEMORY_ALLOCATION_MODE.USE_ONLY:
             try:
-                self.mem = shared_memory.SharedMemory(name=self.name, size=self.size)
+                self.mem = self._open(create=False)
             except FileNotFoundError:
                 raise MemoryError("Accessing unallocated memory")
 
         if self.mode == MEMORY_ALLOCATION_MODE.CREATE_ONLY:
             try:
-                self.mem = shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
+                self.mem = self._open(create=True)
             except FileExistsError:
                 raise MemoryError("Memory already allocated")
         if self.mode == MEMORY_ALLOCATION_MODE.CREATE_OR_USE:
             try:
-                self.mem = shared_memory.SharedMemory(name=self.name, size=self.size)
+                self.mem = self._open(create=False)
             except FileNotFoundError:
                 try:
-                    self.mem = shared_memory.SharedMemory(name=self.name, create=True, size=self.size)
-                    self.mem.buf[:] = bytearray(self.size)
+                    self.mem = self._open(create=True)  # new segments map zero pages, faulted in on first use
                 except FileExistsError:
                     raise MemoryError("Memory allocation conflict")
 
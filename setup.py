@@ -31,6 +31,7 @@ setup(name='dataloop-upipe',
       packages=find_packages(),
       setup_requires=['wheel'],
       install_requires=requirements,
+      extras_require={'crc32c': ['crc32c']},
       python_requires='>=3.8',
       package_data={'dataloop': package_data},
       include_package_data=True,
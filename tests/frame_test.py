@@ -1,9 +1,34 @@
 import asyncio
+import time
+import warnings
+from typing import List, Optional
 
 import numpy as np
+from pydantic import Field
 
-from upipe.entities import DataFrame
-from upipe.entities.dataframe import DataField
+from upipe.entities import DataFrame, DType
+from upipe.entities.dataframe import DataField, DataFrameBaseType, register_data_type
+
+
+class Detection(DataFrameBaseType):
+    id: int
+    score: float = Field(0, fmt="f")
+    label: str = Field("", max_length=16)
+    box: np.ndarray = Field(..., shape=(4,), dtype="float32")
+    valid: bool = True
+    tags: List[str] = []  # tail
+    note: Optional[str] = None  # tail
+
+
+DETECTION_TYPE = register_data_type(Detection)
+
+
+class Counted:
+    encodes = 0
+
+    def __reduce__(self):
+        Counted.encodes += 1
+        return Counted, ()
 
 
 async def test_field_int():
@@ -43,6 +68,155 @@ async def test_nd_array(count: int = 100):
             raise ValueError(f"custom execution id mismatch:{i}")
 
 
+async def test_nd_array_native():
+    arrays = [np.arange(24, dtype=np.uint8).reshape(2, 3, 4),
+              np.asfortranarray(np.random.rand(5, 7)),
+              np.random.rand(6, 8)[::2, 1:5],  # strided view, sent contiguous
+              np.arange(10, dtype='>i4'),
+              np.array(3.5, dtype=np.float32),
+              np.zeros((0, 3), dtype=np.int16),
+              np.array(["a", "bc"]),
+              np.arange(0, 4, dtype='datetime64[s]')]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # pickle warns on decode
+        for arr in arrays:
+            buf = DataFrame(arr).to_byte_arr()
+            decoded = DataFrame.from_byte_arr(buf).data
+            if decoded.dtype != arr.dtype or decoded.shape != arr.shape or not np.array_equal(arr, decoded):
+                raise ValueError(f"ND Array was not recovered from data frame:{arr.dtype} {arr.shape}")
+            if arr.size > 0 and not np.shares_memory(decoded, np.frombuffer(buf, dtype=np.uint8)):
+                raise ValueError(f"ND Array was copied on decode:{arr.dtype} {arr.shape}")
+            if not decoded.flags.aligned:
+                raise ValueError(f"ND Array buffer not aligned in the frame:{arr.dtype} {arr.shape}")
+            frame = DataFrame()
+            frame.add_field("k", "a")
+            frame.add_field("x", arr)
+            frame = DataFrame.from_byte_arr(frame.to_byte_arr())
+            frame.fields["k"].value = "abc"  # the array field bytes move in the frame
+            frame2 = DataFrame.from_byte_arr(frame.to_byte_arr())
+            if not frame2.fields["x"].value.flags.aligned or not np.array_equal(arr, frame2.fields["x"].value):
+                raise ValueError(f"ND Array buffer not aligned after the frame changed:{arr.dtype} {arr.shape}")
+    objects = np.array([{"a": 1}, None], dtype=object)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        decoded = DataFrame.from_byte_arr(DataFrame(objects).to_byte_arr()).data
+    if decoded[0] != {"a": 1} or decoded[1] is not None:
+        raise ValueError("Object array was not recovered from data frame")
+
+
+async def test_lazy_frame(count: int = 10):
+    for i in range(count):
+        frame = DataFrame({"counter": i})
+        frame.add_field("name", f"{i}")
+        frame.add_field("image", np.full((4, 4), i, dtype=np.uint8))
+        frame.add_field("tags", {i, i + 1})  # pickled, warns when decoded
+        buf = frame.to_byte_arr()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            frame2 = DataFrame.from_byte_arr(buf)
+            if frame2.fields["name"].value != f"{i}":
+                raise ValueError(f"String field was not recovered from lazy frame:{i}")
+            original = bytes(buf)
+            frame2.fields["image"].value[0, 0] = 255  # written through to the frame bytes
+            if frame2.to_byte_arr() == original:
+                raise ValueError(f"Array change was not forwarded:{i}")
+            buf = frame2.to_byte_arr()
+            forwarded = DataFrame.from_byte_arr(DataFrame.from_byte_arr(buf).to_byte_arr())
+            if forwarded.to_byte_arr() != buf or forwarded.fields["image"].value[0, 0] != 255:
+                raise ValueError(f"Forwarded frame was re-encoded:{i}")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            if forwarded.fields["tags"].value != {i, i + 1}:
+                raise ValueError(f"Pickled field was not recovered from lazy frame:{i}")
+            changed = DataFrame.from_byte_arr(buf)
+            changed.data["counter"] = i + 1  # decoded container, may have changed
+            frame3 = DataFrame.from_byte_arr(changed.to_byte_arr())
+            if frame3.data["counter"] != i + 1 or frame3.fields["tags"].value != {i, i + 1}:
+                raise ValueError(f"Changed field was not encoded again:{i}")
+
+
+async def test_frame_encoding(count: int = 10):
+    for i in range(count):
+        frame = DataFrame({"counter": i})
+        frame.add_field("image", np.full((3, 5), i, dtype=np.uint16))
+        frame.set_pipe_exe_id(f"{i}")
+        field = frame.fields["image"]
+        if field.size != len(field.byte_arr):
+            raise ValueError(f"Field size mismatch:{i}")
+        size = frame.nbytes
+        buf = bytearray(size + 7)
+        if frame.write_into(buf, 7) != size or frame.to_byte_arr() != buf[7:] or len(frame.to_byte_arr()) != size:
+            raise ValueError(f"Frame was not written into the buffer:{i}")
+        arr = frame.to_byte_arr()
+        arr[:] = bytes(len(arr))
+        if frame.to_byte_arr() == arr:
+            raise ValueError(f"Frame encoding was changed through to_byte_arr:{i}")
+        frame.data["counter"] = -i  # in place
+        if frame.encoding_kept or DataFrame.from_byte_arr(frame.to_byte_arr()).data["counter"] != -i:
+            raise ValueError(f"Frame was not encoded again after a value changed in place:{i}")
+        forwarded = DataFrame.from_byte_arr(frame.to_byte_arr())
+        pid = forwarded.fields["pid"]
+        forwarded.set_pipe_exe_id(f"{i}")
+        if forwarded.fields["pid"] is not pid:
+            raise ValueError(f"Pipe execution id set again with the same value:{i}")
+        if not DataFrame(f"{i}").encoding_kept:
+            raise ValueError(f"String frame encoding was not kept:{i}")
+        frame.fields["d"].value = {"counter": i + 1}
+        if DataFrame.from_byte_arr(frame.to_byte_arr()).data["counter"] != i + 1:
+            raise ValueError(f"Frame was not encoded again after a value was set:{i}")
+        frame.last = True
+        frame2 = DataFrame.from_byte_arr(frame.to_byte_arr())
+        if not frame2.last or frame2.nbytes != frame.nbytes or frame2.pipe_execution_id != f"{i}":
+            raise ValueError(f"Frame was not encoded again after a field was added:{i}")
+        try:
+            frame.write_into(bytearray(frame.nbytes - 1))
+            raise AssertionError("Frame written past the buffer end")
+        except IndexError:
+            pass
+        counted = DataFrame({"counted": Counted()})
+        Counted.encodes = 0
+        if counted.nbytes == 0 or Counted.encodes != 1:
+            raise ValueError(f"Frame size was not computed with one encoding:{i}")
+        counted.to_byte_arr()
+        if Counted.encodes != 1:
+            raise ValueError(f"Frame encoding made for its size was not written:{i}")
+        counted.to_byte_arr()
+        if Counted.encodes != 2:
+            raise ValueError(f"Frame with a container was not encoded again:{i}")
+        image = np.zeros((64, 64), dtype=np.float32)
+        frame = DataFrame(image)
+        size = frame.nbytes
+        image[0, 0] = i + 1  # the array is copied by the write, not when sized
+        if DataFrame.from_byte_arr(frame.to_byte_arr()).data[0, 0] != i + 1 or frame.nbytes != size:
+            raise ValueError(f"Array was copied to size the frame:{i}")
+
+
+async def test_model_codec(count: int = 10):
+    codec = DataField("d", Detection(id=0, box=np.zeros(4))).d_type
+    if codec != DETECTION_TYPE:
+        raise ValueError(f"Registered model was typed {codec}")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # pickle warns on decode
+        for i in range(count):
+            detections = [Detection(id=i * 10 + j, score=j / 4, label=f"label_{j}", box=np.arange(4) + j,
+                                    valid=j % 2 == 0, tags=[f"{i}"] * j, note=f"{j}" if j else None)
+                          for j in range(3)]
+            frame = DataFrame(detections)
+            frame.add_field("top", detections[0])
+            frame2 = DataFrame.from_byte_arr(frame.to_byte_arr())
+            for d, d2 in zip(detections + [detections[0]], frame2.data + [frame2.fields["top"].value]):
+                if not isinstance(d2, Detection) or d2.id != d.id or d2.score != d.score or d2.label != d.label or \
+                        d2.valid != d.valid or d2.tags != d.tags or d2.note != d.note or \
+                        d2.box.dtype != np.float32 or not np.array_equal(d2.box, d.box):
+                    raise ValueError(f"Model was not recovered from data frame:{d} {d2}")
+    for bad in [Detection(id=0, label="é" * 9, box=np.zeros(4)), Detection(id=0, box=np.zeros(5))]:
+        try:
+            DataFrame(bad).to_byte_arr()
+            raise AssertionError(f"Model encoded past its layout:{bad}")
+        except ValueError:
+            pass
+
+
 async def test_tuple(count: int = 100):
     for i in range(count):
         tp = (i, i + 1, f"{i}", {"i": i})
@@ -79,12 +253,68 @@ async def test_str(count: int = 10):
             raise ValueError(f"STRING was not recovered from data frame:{i}")
 
 
+async def test_tagged():
+    image = np.arange(12, dtype=np.float32).reshape(3, 4)
+    value = {"item_id": "42", "name": "שלום", 7: None, "ok": True, "no": False, "big": -2 ** 70, "pi": 3.14,
+             "raw": b"\x00\x01", "point": (1, 2.5, "x"), "nested": [{"a": [1, [2, 3]]}, (), []],
+             "u8": list(range(10)), "i16": list(range(-1000, 1000, 100)), "i64": [2 ** 40] * 8, "huge": [2 ** 64] * 8,
+             "floats": [0.5] * 10, "mixed": [1, 2.0, True, None, "a", 1, 2, 3], "np": [np.int64(5), np.float32(0.5)],
+             "image": image, "box": Detection(id=1, box=np.ones(4))}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")  # no field may go through pickle
+        frame = DataFrame(value)
+        if frame.fields["d"].d_type != DType.TAGGED:
+            raise ValueError(f"dict was typed {frame.fields['d'].d_type}")
+        data = DataFrame.from_byte_arr(frame.to_byte_arr()).data
+    for key in value:
+        if key in ["image", "box", "np"]:
+            continue
+        if data[key] != value[key] or type(data[key]) != type(value[key]):
+            raise ValueError(f"Tagged {key} was not recovered: {value[key]} {data[key]}")
+    if [type(v) for v in data["mixed"]] != [int, float, bool, type(None), str, int, int, int]:
+        raise ValueError(f"Tagged mixed list types were not recovered: {data['mixed']}")
+    if data["np"] != [5, 0.5] or not np.array_equal(data["image"], image) or data["box"].id != 1:
+        raise ValueError("Tagged typed values were not recovered")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if DataFrame.from_byte_arr(DataFrame([{1, 2}]).to_byte_arr()).data != [{1, 2}]:
+            raise ValueError("Tagged pickled value was not recovered")
+
+
+async def benchmark_dict_frames(count: int = 1000):
+    # examples/model_on_item frames: item message, then with the image and both models predictions
+    item = {'item_id': '42'}
+    image = np.random.randint(low=0, high=255, size=(100, 100), dtype='uint8').tolist()
+    predicted = {'item_id': '42', 'image': image, 'first_predictions': [0, 0, 0, 0, 1],
+                 'second_predictions': [0, 0, 0, 0, 1]}
+    for name, msg in [("item", item), ("predicted", predicted)]:
+        results = []
+        for d_type in [DType.JSON, DType.TAGGED]:
+            start = time.perf_counter()
+            for _ in range(count):
+                frame = DataFrame()
+                frame.fields['d'] = DataField('d', msg, d_type)
+                arr = frame.to_byte_arr()
+                if DataFrame.from_byte_arr(arr).data != msg:
+                    raise ValueError(f"{d_type.name} frame was not recovered")
+            results.append(((time.perf_counter() - start) / count * 10 ** 6, len(arr)))
+        (json_us, json_size), (tagged_us, tagged_size) = results
+        print(f"{name} frame encode+decode: json {json_us:.1f} us {json_size} bytes, "
+              f"tagged {tagged_us:.1f} us {tagged_size} bytes")
+
+
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     loop.run_until_complete(test_field_int())
     loop.run_until_complete(test_int())
     loop.run_until_complete(test_nd_array())
+    loop.run_until_complete(test_nd_array_native())
+    loop.run_until_complete(test_lazy_frame())
+    loop.run_until_complete(test_frame_encoding())
+    loop.run_until_complete(test_model_codec())
+    loop.run_until_complete(test_tagged())
     loop.run_until_complete(test_tuple())
     loop.run_until_complete(test_arr())
     loop.run_until_complete(test_json())
     loop.run_until_complete(test_str(10 ** 4))
+    loop.run_until_complete(benchmark_dict_frames())
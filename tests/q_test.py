@@ -1,10 +1,23 @@
 import asyncio
+import binascii
+import ctypes
+import mmap
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import resource_tracker
 
 import numpy as np
 
 import upipe.types
 from upipe.entities import DataFrame, DType
-from upipe.entities.mem_queue import MemQueue
+from upipe.types import QueueMode, OverflowPolicy, IntegrityPolicy, PageBacking
+from upipe.entities.mem_queue import MemQueue, QActionLog
+from upipe.entities.queue_v1 import QControlBlockV1, QCheckpointV1
+from upipe.entities.page_memory import hugetlbfs_mount
+from upipe.node.manager.shm_registry import ShmRegistry
 
 
 async def test_throughput(count: int):
@@ -30,6 +43,8 @@ async def test_throughput(count: int):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_json(count: int = 10):
@@ -56,6 +71,8 @@ async def test_json(count: int = 10):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_str(count: int = 10):
@@ -63,7 +80,7 @@ async def test_str(count: int = 10):
                                       from_p="a",
                                       to_p="b",
                                       id="12",
-                                      size=200))
+                                      size=384))
     for i in range(count):
         frame = DataFrame(f"{i}")
         frame.set_pipe_exe_id()
@@ -82,6 +99,8 @@ async def test_str(count: int = 10):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_serial(d_type: DType = DType.U8):
@@ -105,6 +124,8 @@ async def test_serial(d_type: DType = DType.U8):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_arr(count: int = 100):
@@ -128,6 +149,8 @@ async def test_arr(count: int = 100):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_tuple(count: int = 100):
@@ -151,6 +174,8 @@ async def test_tuple(count: int = 100):
         else:
             q.print()
             raise IndexError
+    q.close()
+    q.unlink()
 
 
 async def test_nd_array(count: int = 100):
@@ -171,10 +196,773 @@ async def test_nd_array(count: int = 100):
             if not np.array_equal(arr, out.data):
                 q.print()
                 raise ValueError
+            if not out.data.flags.aligned:
+                raise ValueError(f"ND Array buffer not aligned in the frame copy:{i}")
             print(f"{i} read")
         else:
             q.print()
             raise IndexError
+        if await q.put(DataFrame("x" * (i % 7 + 1))) and await q.put(DataFrame(arr)):  # odd sized frame first
+            await q.get()
+            view = await q.get_view()
+            if not DataFrame.from_byte_arr(view).data.flags.aligned:
+                raise ValueError(f"ND Array buffer not aligned in the ring:{i}")
+            q.release()
+        else:
+            q.print()
+            raise IndexError
+    q.close()
+    q.unlink()
+
+
+async def test_spsc(count: int = 10 ** 4):
+    q = MemQueue(upipe.types.APIQueue(name="test_spsc",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=4096,
+                                      mode=QueueMode.SPSC))
+
+    async def producer():
+        for i in range(count):
+            while not await q.put(DataFrame(i)):
+                await asyncio.sleep(0)
+
+    async def consumer():
+        for i in range(count):
+            out = await q.get()
+            while out is None:
+                await asyncio.sleep(0)
+                out = await q.get()
+            if out.data != i:
+                raise ValueError(f"SPSC order error, expected {i} got {out.data}")
+
+    await asyncio.gather(producer(), consumer())
+    if q.pending_counter != 0:
+        raise IndexError
+    q.close()
+    q.unlink()
+
+
+async def test_mpmc(count: int = 2000, consumers: int = 3):
+    q_def = upipe.types.APIQueue(name="test_mpmc",
+                                 from_p="a",
+                                 to_p="b",
+                                 id="12",
+                                 size=4096,
+                                 mode=QueueMode.MPMC)
+    q = MemQueue(q_def)
+    consumer_qs = [MemQueue(q_def) for _ in range(consumers)]
+    received = []
+
+    async def producer():
+        for i in range(count):
+            while not await q.put(DataFrame(i)):
+                await asyncio.sleep(0)
+
+    async def consumer(cq: MemQueue):
+        while len(received) < count:
+            out = await cq.get()
+            if out is None:
+                await asyncio.sleep(0)
+                continue
+            received.append(out.data)
+
+    await asyncio.gather(producer(), *[consumer(cq) for cq in consumer_qs])
+    if sorted(received) != list(range(count)):
+        raise ValueError("MPMC frames lost or duplicated")
+    await q.reclaim()
+    if q.pending_counter != 0 or q.exe_index != q.alloc_index:
+        raise IndexError(f"MPMC reclaim incomplete, pending {q.pending_counter}")
+    held = q.try_acquire_lock(q.r_lock_memory_name)
+    asyncio.get_event_loop().call_later(0.005, os.unlink, held)  # another consumer claims a frame
+    start = time.time()
+    await consumer_qs[0].acquire_read_lock()
+    consumer_qs[0].release_read_lock()
+    if time.time() - start >= MemQueue.LOCK_CHECK_INTERVAL:
+        raise TimeoutError("Read lock waiter slept a full lock check interval")
+    for cq in consumer_qs:
+        cq.close()
+    q.close()
+    q.unlink()
+
+
+async def test_get_view(count: int = 1000):
+    q = MemQueue(upipe.types.APIQueue(name="test_view",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=3000))
+    for i in range(count):
+        data = bytes([i % 256]) * (i % 300 + 1)
+        if not await q.put(DataFrame(data)):
+            raise MemoryError
+        view = await q.get_view()
+        if not view.readonly:
+            raise ValueError("Frame view must be read only")
+        if view.obj is not q.mem.buf.obj:
+            raise BufferError(f"Frame {i} copied, frames at the ring end start over at the data start")
+        if DataFrame.from_byte_arr(bytearray(view)).data != data:
+            raise ValueError(f"View data mismatch on frame {i}")
+        q.release()
+        if q.pending_counter != 0 or q.exe_index != q.alloc_index:
+            raise IndexError
+    q.close()
+    q.unlink()
+
+
+class SlotOnlyFrame(DataFrame):
+    def to_byte_arr(self):
+        raise BufferError("Frame that fits the queue was encoded out of its reserved slot")
+
+
+async def test_reserve_commit(count: int = 1000):
+    q = MemQueue(upipe.types.APIQueue(name="test_reserve",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=3000))
+    view = await q.reserve(100)
+    q.cancel_reserve()
+    if q.alloc_counter != 0:
+        raise IndexError
+    for i in range(count):
+        body = DataFrame(bytes([i % 256]) * (i % 300 + 1)).to_byte_arr()
+        view = await q.reserve(len(body) + 7)
+        if view is None:
+            raise MemoryError
+        if view.obj is not q.mem.buf.obj:
+            raise BufferError(f"Frame {i} reserved out of the queue memory")
+        view[:len(body)] = body
+        q.commit(view, len(body))
+        out = await q.get()
+        if out.data != bytes([i % 256]) * (i % 300 + 1):
+            raise ValueError(f"Reserved frame mismatch on frame {i}")
+        if q.pending_counter != 0 or q.exe_index != q.alloc_index:
+            raise IndexError
+    for i in range(count // 100):
+        arr = np.full((10, 10), i, dtype=np.float64)
+        if not await q.put(SlotOnlyFrame({"i": i, "image": arr})) or not await q.put(SlotOnlyFrame(arr)):
+            raise MemoryError
+        if (await q.get()).data["i"] != i or not np.array_equal((await q.get()).data, arr):
+            raise ValueError(f"Frame written into its slot mismatch on frame {i}")
+    q.close()
+    q.unlink()
+
+
+async def test_batch(count: int = 10 ** 4, mode: QueueMode = QueueMode.LOCKED):
+    q = MemQueue(upipe.types.APIQueue(name="test_batch",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=4096,
+                                      mode=mode))
+    sent = 0
+    received = 0
+    while received < count:
+        batch = [DataFrame(i) for i in range(sent, min(sent + 50, count))]
+        sent += await q.put_many(batch)
+        frames = await q.get_many(40, max_bytes=400)
+        if len(frames) > 40 or sum(len(f.to_byte_arr()) for f in frames[1:]) > 400:
+            raise IndexError
+        for frame in frames:
+            if frame.data != received:
+                raise ValueError(f"Batch order error, expected {received} got {frame.data}")
+            received += 1
+    if q.pending_counter != 0 or q.exe_index != q.alloc_index:
+        raise IndexError
+    q.close()
+    q.unlink()
+
+
+async def benchmark_control_block(count: int = 10 ** 5):
+    q = MemQueue(upipe.types.APIQueue(name="benchmark_control_block",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=4096))
+    buf = q.mem.buf
+    start = time.perf_counter()
+    for _ in range(count):  # control fields access by raw offsets, the way it was before the struct mapping
+        buf[48:56] = (int.from_bytes(buf[48:56], "little") + 1).to_bytes(8, "little")
+    offsets_ns = (time.perf_counter() - start) / count * 10 ** 9
+    start = time.perf_counter()
+    for _ in range(count):
+        q.alloc_counter = q.alloc_counter + 1
+    struct_ns = (time.perf_counter() - start) / count * 10 ** 9
+    if q.alloc_counter != 2 * count:
+        raise ValueError("Control block mapping mismatch")
+    q.alloc_counter = 0
+    start = time.perf_counter()
+    for i in range(count // 10):
+        await q.put(DataFrame(i))
+        await q.get()
+    put_get_us = (time.perf_counter() - start) / (count // 10) * 10 ** 6
+    print(f"Control field read+write: offsets {offsets_ns:.0f} ns, struct {struct_ns:.0f} ns, "
+          f"put+get: {put_get_us:.1f} us")
+    q.close()
+    q.unlink()
+
+
+async def benchmark_page_backing(size: int = 64 * 2 ** 20, frame_size: int = 2 ** 20, count: int = 256):
+    setups = [(PageBacking.DEFAULT, None, False), (PageBacking.DEFAULT, None, True),
+              (PageBacking.TRANSPARENT, None, True)]
+    if hugetlbfs_mount() is not None:
+        setups.append((PageBacking.HUGETLBFS, None, True))
+    if os.path.exists("/sys/devices/system/node/node0"):
+        setups.append((PageBacking.TRANSPARENT, 0, True))
+    data = np.ones(frame_size, dtype=np.uint8)
+    for page_backing, numa_node, prefault in setups:
+        start = time.perf_counter()
+        q = MemQueue(upipe.types.APIQueue(name="benchmark_page_backing",
+                                          from_p="a",
+                                          to_p="b",
+                                          id="12",
+                                          size=size,
+                                          integrity=IntegrityPolicy.OFF,
+                                          page_backing=page_backing,
+                                          numa_node=numa_node,
+                                          prefault=prefault))
+        create_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(count):  # zero copy both ways, the ring memory is all that is measured
+            view = await q.reserve(frame_size)
+            view[:] = data
+            q.commit(view)
+            view = await q.get_view()
+            if view[frame_size - 1] != 1:
+                raise ValueError("Frame data mismatch")
+            q.release()
+        gb_sec = count * frame_size / (time.perf_counter() - start) / 2 ** 30
+        print(f"Pages {page_backing.name}, NUMA node {numa_node}, prefault {prefault}: "
+              f"create {create_ms:.1f} ms, put+get {gb_sec:.2f} GB/s")
+        q.close()
+        q.unlink()
+
+
+async def test_wait(count: int = 100):
+    q = MemQueue(upipe.types.APIQueue(name="test_wait",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=1000))
+    if await q.wait_data(timeout=0.05):
+        raise ValueError("Empty queue reported data")
+
+    async def producer():
+        for i in range(count):
+            frame = DataFrame(i)
+            while not await q.put(frame):
+                if not await q.wait_space(len(frame.to_byte_arr()), timeout=1):
+                    raise TimeoutError("Producer was not woken up")
+
+    async def consumer():
+        for i in range(count):
+            out = await q.get()
+            while out is None:
+                if not await q.wait_data(timeout=1):
+                    raise TimeoutError("Consumer was not woken up")
+                out = await q.get()
+            if out.data != i:
+                raise ValueError(f"Wait order error, expected {i} got {out.data}")
+
+    await asyncio.gather(consumer(), producer())
+    q.close()
+    q.unlink()
+
+
+async def test_log(count: int = 1000):
+    q_def = upipe.types.APIQueue(name="test_log",
+                                 from_p="a",
+                                 to_p="b",
+                                 id="12",
+                                 size=4096,
+                                 log_sample_every=10,
+                                 shared_log=True)
+    q = MemQueue(q_def)
+    reader = MemQueue(q_def)
+    for i in range(count):
+        await q.put(DataFrame(i))
+        await q.get()
+    entries = reader.log.entries(QActionLog.ENQUEUE)
+    if len(entries) != q.log.entry_limit:
+        raise IndexError
+    if entries["frame_counter"][-1] != count - 10 or np.any(np.diff(entries["frame_counter"]) != 10):
+        raise ValueError("Shared log sampling mismatch")
+    if reader.log.pending_stats != 1:  # sampled as the frame is dequeued
+        raise ValueError
+    reader.close()
+    q.close()
+    q.unlink()
+
+
+async def test_broadcast(count: int = 2000, readers: int = 3):
+    q_def = upipe.types.APIQueue(name="test_broadcast",
+                                 from_p="a",
+                                 to_p="*",
+                                 id="12",
+                                 size=4096,
+                                 mode=QueueMode.BROADCAST,
+                                 readers=[f"r{i}" for i in range(readers)])
+    q = MemQueue(q_def)
+    reader_qs = [MemQueue(q_def, reader=reader) for reader in q_def.readers]
+
+    async def producer():
+        for i in range(count):
+            while not await q.put(DataFrame(i)):
+                await asyncio.sleep(0)
+
+    async def reader(rq: MemQueue, delay: int):
+        for i in range(count):
+            out = await rq.get()
+            while out is None:
+                await asyncio.sleep(0)
+                out = await rq.get()
+            if out.data != i:
+                raise ValueError(f"Broadcast order error on {rq.reader}, expected {i} got {out.data}")
+            if i % delay == 0:
+                await asyncio.sleep(0)
+
+    await asyncio.gather(producer(), *[reader(rq, i + 1) for i, rq in enumerate(reader_qs)])
+    if q.alloc_counter != count or q.pending_counter != 0 or q.exe_index != q.alloc_index:
+        raise IndexError(f"Broadcast reclaim incomplete, pending {q.pending_counter}")
+    await q.put(DataFrame(count))
+    if await reader_qs[0].get() is None or q.pending_counter != 1 or q.pending_for("r1") != 1:
+        raise IndexError("Broadcast frame reclaimed before the slowest reader")
+    for rq in reader_qs:
+        rq.close()
+    q.close()
+    q.unlink()
+
+
+async def test_priority(count: int = 100, lanes: int = 3):
+    q = MemQueue(upipe.types.APIQueue(name="test_priority",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=2000,
+                                      lanes=lanes))
+    written = 0
+    while await q.put(DataFrame(written)):  # bulk traffic fills the low lane
+        written += 1
+    if not await q.put(DataFrame("urgent", priority=lanes - 1)) or not await q.put(DataFrame("high", priority=1)):
+        raise MemoryError("Low priority frames took the high lanes space")
+    if await q.put_many([DataFrame("above", priority=lanes), DataFrame("bulk")]) != 1:
+        raise IndexError
+    if q.pending_for("b") != written + 3:
+        raise IndexError
+    for expected, priority in (("urgent", lanes - 1), ("above", lanes - 1), ("high", 1), (0, 0)):
+        out = await q.get()
+        if out.data != expected or out.priority != priority:
+            raise ValueError(f"Priority order error, expected {expected} got {out.data}")
+    frames = await q.get_many(count)
+    if [f.data for f in frames] != list(range(1, written)):
+        raise ValueError
+    if q.lane(1).size != 2000 // q.LANE_SIZE_DIVISOR:
+        raise MemoryError(f"Lane sized {q.lane(1).size}, expected a share of the queue size")
+    q.close()
+    q.unlink()
+    q = MemQueue(upipe.types.APIQueue(name="test_priority", from_p="a", to_p="b", id="12", size=1000, lanes=2,
+                                      lane_size=600))
+    if q.lane(1).size != 600:
+        raise MemoryError(f"Lane sized {q.lane(1).size}, expected the lane size")
+    q.close()
+    q.unlink()
+
+
+async def test_resize(count: int = 10):
+    for mode in (QueueMode.LOCKED, QueueMode.MPMC, QueueMode.SPSC):
+        q_def = upipe.types.APIQueue(name="test_resize",
+                                     from_p="a",
+                                     to_p="b",
+                                     id="12",
+                                     size=1000,
+                                     mode=mode)
+        node_q = MemQueue(q_def)
+        producer = MemQueue(q_def)
+        consumer = MemQueue(q_def)
+        for i in range(count):
+            if not await producer.put(DataFrame(i)):
+                raise MemoryError
+        if (await consumer.get()).data != 0:
+            raise ValueError
+        await node_q.resize(4000)
+        if node_q.queue_def.generation != 1 or node_q.size != 4000:
+            raise IndexError
+        for i in range(count, count * 4):
+            if not await producer.put(DataFrame(i)):
+                raise MemoryError(f"{mode.name} producer did not move to the resized segment")
+        for i in range(1, count * 4):
+            out = await consumer.get()
+            if out is None or out.data != i:
+                raise ValueError(f"{mode.name} resize order error, expected {i} got {out and out.data}")
+        if producer.size != 4000 or consumer.size != 4000 or node_q.collect_segments() != 0:
+            raise IndexError(f"{mode.name} old segment still in use")
+        late = MemQueue(node_q.queue_def)  # attached after the resize
+        if late.size != 4000:
+            raise IndexError
+        for q in (late, consumer, producer, node_q):
+            q.close()
+        node_q.unlink()
+
+
+async def test_spill(count: int = 500):
+    spill_dir = tempfile.mkdtemp()
+    q = MemQueue(upipe.types.APIQueue(name="test_spill",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=1000,
+                                      overflow=OverflowPolicy.SPILL,
+                                      spill_dir=spill_dir))
+    for i in range(count // 2):
+        if not await q.put(DataFrame(i)):
+            raise MemoryError
+    if not await q.put_many([DataFrame(i) for i in range(count // 2, count)]) == count - count // 2:
+        raise MemoryError
+    stats = q.stats()
+    if stats.spilled_frames.value + q.pending_counter != count or stats.spilled_bytes.value == 0:
+        raise IndexError
+    for i in range(count):
+        out = await q.get()  # the spilled frames are replayed in the background as we free space
+        while out is None:
+            if not await q.wait_data(1):
+                raise TimeoutError(f"Spilled frame {i} not replayed")
+            out = await q.get()
+        if out.data != i:
+            raise ValueError(f"Spill order error, expected {i} got {out.data}")
+    stats = q.stats()
+    if stats.spilled_frames.value != 0 or stats.spilled_bytes.value != 0 or q.pending_counter != 0:
+        raise IndexError
+    q.close()
+    q.unlink()
+    if os.listdir(spill_dir):
+        raise FileExistsError("Spill segments left on disk")
+    os.rmdir(spill_dir)
+
+
+async def test_durable(count: int = 500):
+    path = os.path.join(tempfile.mkdtemp(), "q_durable")
+    q_def = upipe.types.APIQueue(name="test_durable",
+                                 from_p="a",
+                                 to_p="b",
+                                 id="12",
+                                 size=1000,
+                                 durable_path=path,
+                                 checkpoint_interval_ms=10 ** 6)
+    q = MemQueue(q_def)
+    for i in range(count):  # consumed space comes back through checkpoints
+        if not await q.put(DataFrame(i)):
+            raise MemoryError
+        if (await q.get()).data != i:
+            raise ValueError
+    for i in range(10):
+        await q.put(DataFrame(count + i))
+    for i in range(4):
+        await q.get()
+    q.checkpoint()
+    for i in range(3):
+        await q.get()  # consumed after the checkpoint, delivered again after recovery
+    view = await q.reserve(100)
+    view[:4] = b"torn"  # crash in the middle of a put
+    q.close()
+    q = MemQueue(q_def)
+    if q.created or q.recover() != 6:
+        raise IndexError
+    for i in range(4, 10):
+        out = await q.get()
+        if out.data != count + i:
+            raise ValueError(f"Recovered frame mismatch, expected {count + i} got {out.data}")
+    if q.pending_counter != 0:
+        raise IndexError
+    q.close()
+    q.unlink()
+    os.rmdir(os.path.dirname(path))
+
+
+async def test_queue_sizer(count: int = 200):
+    from upipe.node.manager.queue_sizer import QueueSizer
+    q_def = upipe.types.APIQueue(name="test_queue_sizer",
+                                 from_p="a",
+                                 to_p="b",
+                                 id="12",
+                                 size=4096,
+                                 burst_window_ms=500,
+                                 shared_log=True)
+    q = MemQueue(q_def)
+    sizer = QueueSizer(log_file=os.path.join(tempfile.mkdtemp(), "sizes.json"))
+    frame_data = "x" * 1000
+    for i in range(count):
+        await q.put(DataFrame(frame_data))
+        await q.get()
+        await asyncio.sleep(0.001)
+    size = sizer.target_size(q)
+    if size is None or size % mmap.PAGESIZE != 0:
+        raise ValueError("Queue size not page aligned")
+    if size < sizer.MIN_FRAMES * 1000 or not sizer.needs_resize(q, size):
+        raise MemoryError("Queue sized below the burst window")
+    sizer.record("pipe_a", q_def.id, size)
+    if QueueSizer(log_file=sizer.log_file).initial_size("pipe_a", q_def) != size:
+        raise LookupError("Tuned size not kept")
+    if QueueSizer(log_file=sizer.log_file).initial_size("pipe_b", q_def) != q_def.size:
+        raise LookupError("Tuned size applied to the queue of another pipe")
+    budget = QueueSizer(log_file=sizer.log_file, max_size=size - 1)
+    if budget.target_size(q) != budget.max_size or budget.max_size % mmap.PAGESIZE != 0:
+        raise MemoryError("Queue sized past the memory budget")
+    frames = [DataFrame("y" * 10) for _ in range(8)]
+    if await q.put_many(frames) != len(frames) or len(await q.get_many(len(frames))) != len(frames):
+        raise MemoryError
+    for op in (QActionLog.ENQUEUE, QActionLog.DEQUEUE):
+        if list(q.log.entries(op)["data_size"][-len(frames):]) != [frames[0].nbytes] * len(frames):
+            raise ValueError(f"Batch not logged frame by frame, log {op}")
+    q.close()
+    q.unlink()
+
+
+async def test_chunked(size: int = 100000, count: int = 6):
+    for mode in (QueueMode.LOCKED, QueueMode.SPSC, QueueMode.MPMC):
+        q_def = upipe.types.APIQueue(name="test_chunked",
+                                     from_p="a",
+                                     to_p="b",
+                                     id="12",
+                                     size=4096,
+                                     mode=mode)
+        q = MemQueue(q_def)
+        consumers = [MemQueue(q_def) for _ in range(2 if mode == QueueMode.MPMC else 1)]
+        sent = [str(i) * (size // len(str(i)) + i) if i % 2 else i for i in range(count)]
+        received = []
+
+        async def producer():
+            for i, data in enumerate(sent):
+                frame = DataFrame(data)
+                if i == count - 1:
+                    if await q.put_many([frame]) != 1:
+                        raise IndexError
+                    continue
+                while not await q.put(frame):
+                    await q.wait_space(len(frame.to_byte_arr()), timeout=1)
+
+        async def consumer(cq: MemQueue):
+            while len(received) < count:
+                frames = await cq.get_many(4)
+                if not frames:
+                    await cq.wait_data(timeout=0.1)
+                received.extend([frame.data for frame in frames])
+
+        await asyncio.wait_for(asyncio.gather(producer(), *[consumer(cq) for cq in consumers]), timeout=60)
+        if mode != QueueMode.MPMC and received != sent:
+            raise ValueError(f"Chunked frames out of order or corrupted, mode {mode}")
+        if sorted(received, key=str) != sorted(sent, key=str):
+            raise ValueError(f"Chunked frames lost or corrupted, mode {mode}")
+        if q.pending_counter != 0:
+            raise IndexError("Chunk frames left in the queue")
+        for cq in consumers:
+            cq.close()
+        q.close()
+        q.unlink()
+
+
+async def test_chunked_interleave(size: int = 20000, count: int = 50):
+    for mode in (QueueMode.SPSC, QueueMode.LOCKED):
+        q_def = upipe.types.APIQueue(name="test_chunked_interleave",
+                                     from_p="a",
+                                     to_p="b",
+                                     id="12",
+                                     size=4096,
+                                     mode=mode)
+        q = MemQueue(q_def)
+        consumer_q = MemQueue(q_def)
+        big = "x" * size
+        received = []
+
+        async def put(frame):
+            while not await q.put(frame):
+                await q.wait_space(frame.nbytes, timeout=1)
+
+        async def small_producer():
+            for i in range(count):
+                await put(DataFrame(i))
+                await asyncio.sleep(0)
+
+        async def consumer():
+            while len(received) < count + 1:
+                frame = await consumer_q.get()
+                if frame is None:
+                    await consumer_q.wait_data(timeout=0.1)
+                    continue
+                received.append(frame.data)
+
+        # producer tasks of one process share the queue, the chunk stream is not split by the small frames
+        await asyncio.wait_for(asyncio.gather(put(DataFrame(big)), small_producer(), consumer()), timeout=60)
+        if received.count(big) != 1 or [data for data in received if data != big] != list(range(count)):
+            raise ValueError(f"Chunk stream interleaved with other frames, mode {mode}")
+        consumer_q.close()
+        q.close()
+        q.unlink()
+
+
+async def test_v1_upgrade(count: int = 3):
+    path = os.path.join(tempfile.mkdtemp(), "q_v1")
+    size = 1000
+    buf = bytearray(mmap.PAGESIZE * 2)  # version 1 durable file: ring, checkpoints on the next page
+    frame_start = 64
+    for i in range(count):
+        body = DataFrame(i).to_byte_arr()
+        header = bytearray(32)
+        header[0] = 1
+        header[1] = 13
+        header[2:6] = (len(body) + 32).to_bytes(4, "little")
+        header[6:14] = b"d@tal0op"
+        header[14:18] = binascii.crc32(body).to_bytes(4, "little")
+        header[18:22] = (7 + i).to_bytes(4, "little")
+        buf[frame_start:frame_start + 32 + len(body)] = header + body
+        frame_start += 32 + len(body)
+    ctrl = QControlBlockV1(exe_index=64, exe_counter=7, claim_index=64, claim_counter=7,
+                           alloc_index=frame_start, alloc_counter=7 + count, ring_size=size)
+    buf[:64] = bytes(ctrl)
+    checkpoint = QCheckpointV1(sequence=1, control=ctrl)
+    checkpoint.crc32 = binascii.crc32(bytes(checkpoint)[:-4])
+    buf[mmap.PAGESIZE:mmap.PAGESIZE + ctypes.sizeof(checkpoint)] = bytes(checkpoint)
+    with open(path, "wb") as f:
+        f.write(buf)
+    q = MemQueue(upipe.types.APIQueue(name="test_v1_upgrade",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=size,
+                                      durable_path=path))
+    if q.recover() != count or q.size != size + 64:
+        raise IndexError("Version 1 frames not moved to the new layout")
+    for i in range(count):
+        if (await q.get()).data != i:
+            raise ValueError("Version 1 frame mismatch")
+    if q.exe_counter != 7 + count or os.path.exists(f"{path}.v1"):
+        raise ValueError
+    q.close()
+    q.unlink()
+    os.rmdir(os.path.dirname(path))
+
+
+async def test_integrity(count: int = 4):
+    for integrity in IntegrityPolicy:
+        q = MemQueue(upipe.types.APIQueue(name="test_integrity",
+                                          from_p="a",
+                                          to_p="b",
+                                          id="12",
+                                          size=1000,
+                                          integrity=integrity,
+                                          integrity_sample_every=2))
+        for i in range(count):
+            await q.put(DataFrame(i))
+        for i in range(count):
+            crc32 = bytes(q.mem.buf[q._ctrl.exe_index + q.FRAME_CRC32_OFFSET:
+                                    q._ctrl.exe_index + q.FRAME_CRC32_OFFSET + 4])
+            checked = integrity == IntegrityPolicy.FULL or integrity == IntegrityPolicy.SAMPLED and i % 2 == 0
+            if checked == (crc32 == bytes(4)):
+                raise ValueError(f"{integrity.name} frame {i} checksum not written as the policy sets")
+            if (await q.get()).data != i:
+                raise ValueError("Integrity frame mismatch")
+        await q.put(DataFrame(count))
+        data_start = q._ctrl.exe_index + q.FRAME_HEADER_SIZE
+        q.mem.buf[data_start + 4] ^= 0xFF  # corrupt the frame payload
+        try:
+            await q.get()
+            corrupted = False
+        except BrokenPipeError:
+            corrupted = True
+        checked = integrity == IntegrityPolicy.FULL or integrity == IntegrityPolicy.SAMPLED and count % 2 == 0
+        if corrupted != checked or q.stats().crc_errors.value != int(corrupted):
+            raise ValueError(f"{integrity.name} corrupted frame not reported as the policy sets")
+        q.close()
+        q.unlink()
+
+
+async def test_conflate(count: int = 10):
+    q = MemQueue(upipe.types.APIQueue(name="test_conflate",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=1000,
+                                      mode=QueueMode.CONFLATE,
+                                      conflate_depth=2))
+    for i in range(count):
+        if not await q.put(DataFrame(i)):
+            raise MemoryError("Conflating put rejected")
+    if q.pending_counter != 2 or [(await q.get()).data for _ in range(2)] != [count - 2, count - 1]:
+        raise ValueError("Conflating queue did not keep the newest frames")
+    if q.stats().dropped_frames.value != count - 2 or await q.get() is not None:
+        raise ValueError("Dropped frames not counted")
+    for i in range(1000):  # frames overwrite the oldest unread one when the ring is full
+        await q.put(DataFrame(f"{i:050}"))
+    if (await q.get_many(10))[-1].data != f"{999:050}":
+        raise ValueError("Conflating queue lost the newest frame")
+    q.close()
+    q.unlink()
+    q = MemQueue(upipe.types.APIQueue(name="test_conflate",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=1000,
+                                      mode=QueueMode.CONFLATE,
+                                      conflate_key="camera"))
+    for i in range(count):
+        frame = DataFrame(i)
+        frame.add_field("camera", i % 3)
+        await q.put(frame)
+    frames = await q.get_many(count)
+    if [frame.data for frame in frames] != [count - 3, count - 2, count - 1] or q.pending_counter != 0:
+        raise ValueError("Conflating queue did not keep the newest frame per key")
+    q.close()
+    q.unlink()
+
+
+async def test_shm_registry():
+    registry = ShmRegistry(os.path.join(tempfile.mkdtemp(), "shm_registry.json"))
+    q = MemQueue(upipe.types.APIQueue(name="test_shm_registry",
+                                      from_p="a",
+                                      to_p="b",
+                                      id="12",
+                                      size=4096,
+                                      shared_log=True))
+    files = q.shm_files()
+    registry.register("pipe", files)
+    if registry.pipe_bytes() != {"pipe": q.mem.size + q.log.mem.size}:
+        raise ValueError("Pipe shared memory size mismatch")
+    registry.attach(files, os.getpid())
+    if registry.release_pipe("pipe") != 0 or not os.path.exists(f"/dev/shm/{q.mem.name}"):
+        raise ValueError("Attached segment unlinked")
+    registry.detach(files, os.getpid())
+    if os.path.exists(f"/dev/shm/{q.mem.name}") or registry.pipe_bytes():
+        raise ValueError("Released segment not unlinked on the last detach")
+    q.close()
+    q = MemQueue(q.queue_def)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    registry.register("crashed", q.shm_files(), session=dead.pid)
+    for entry in registry.files.values():
+        entry["owner"] = dead.pid  # created by a node that is gone
+    registry._save()
+    if registry.sweep() != q.mem.size + q.log.mem.size or os.path.exists(f"/dev/shm/{q.mem.name}"):
+        raise ValueError("Segments of a dead session not swept")
+    for mem in (q.mem, q.log.mem):
+        resource_tracker.unregister(mem._name, "shared_memory")  # tracked by the gone node, not by us
+    q.close()
+    register = "from upipe.node.manager.shm_registry import ShmRegistry\n" \
+               "import os, sys\n" \
+               "registry = ShmRegistry(sys.argv[1])\n" \
+               "for i in range(50):\n" \
+               "    registry.register('concurrent', {f'/dev/shm/none_{os.getpid()}_{i}': 0})\n"
+    writers = [subprocess.Popen([sys.executable, "-c", register, registry.log_file],
+                                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))) for _ in range(4)]
+    for writer in writers:
+        writer.wait()
+    registry._load()
+    if len(registry.files) != 200:
+        raise LookupError(f"Concurrent registrations lost, {len(registry.files)} of 200 kept")
+    registry.sweep()
+    os.unlink(registry.log_file)
+    os.unlink(f"{registry.log_file}.lock")
+    os.rmdir(os.path.dirname(registry.log_file))
 
 
 if __name__ == "__main__":
@@ -187,3 +975,25 @@ if __name__ == "__main__":
     loop.run_until_complete(test_str(10 ** 4))
     loop.run_until_complete(test_throughput(10 ** 5))
     loop.run_until_complete(test_serial(DType.U64))
+    loop.run_until_complete(test_spsc())
+    loop.run_until_complete(test_mpmc())
+    loop.run_until_complete(test_get_view())
+    loop.run_until_complete(test_reserve_commit())
+    loop.run_until_complete(test_batch())
+    loop.run_until_complete(test_batch(mode=QueueMode.MPMC))
+    loop.run_until_complete(benchmark_control_block())
+    loop.run_until_complete(benchmark_page_backing())
+    loop.run_until_complete(test_wait())
+    loop.run_until_complete(test_log())
+    loop.run_until_complete(test_spill())
+    loop.run_until_complete(test_durable())
+    loop.run_until_complete(test_broadcast())
+    loop.run_until_complete(test_priority())
+    loop.run_until_complete(test_resize())
+    loop.run_until_complete(test_queue_sizer())
+    loop.run_until_complete(test_chunked())
+    loop.run_until_complete(test_chunked_interleave())
+    loop.run_until_complete(test_v1_upgrade())
+    loop.run_until_complete(test_integrity())
+    loop.run_until_complete(test_conflate())
+    loop.run_until_complete(test_shm_registry())